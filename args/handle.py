@@ -2,6 +2,7 @@
 import argparse
 from configparser import ConfigParser
 from configparser import NoOptionError
+from configparser import NoSectionError
 from pycrypt.encryption import AESCipher
 
 
@@ -23,9 +24,21 @@ class Args:
         parser.add_argument('-c', '--config-file', default='/etc/metrics/metrics.conf',
                             required=False, action='store',
                             help='identifies location of the config file')
+        parser.add_argument('-daemon', '--daemon',
+                            required=False, action='store_true',
+                            help='Run continuously, applying only vCenter changes after an initial full sync')
+        parser.add_argument('-record', '--record-dir', default=None,
+                            required=False, action='store',
+                            help='directory to record the retrieved vCenter inventories to')
+        parser.add_argument('-replay', '--replay-dir', default=None,
+                            required=False, action='store',
+                            help='directory of recorded vCenter inventories to replay instead of connecting')
         cmd_args = parser.parse_args()
 
         self.DEBUG = cmd_args.debug
+        self.daemon = cmd_args.daemon
+        self.record_dir = cmd_args.record_dir
+        self.replay_dir = cmd_args.replay_dir
 
         # Parse through the provided conf
         parser = ConfigParser()
@@ -56,6 +69,23 @@ class Args:
         self.__password = parser.get('psqldb', 'password')
         if self.__password:
             self.store_passwd(self.__password)
+        self.db_pool_size = 4
+        try:
+            self.db_pool_size = int(parser.get('psqldb', 'PoolSize'))
+        except (NoSectionError, NoOptionError):
+            pass
+        self.db_pool_timeout_seconds = 300
+        try:
+            self.db_pool_timeout_seconds = float(parser.get('psqldb', 'PoolTimeoutSeconds'))
+        except (NoSectionError, NoOptionError):
+            pass
+        # create the missing unique keys and indexes of the capacity tables concurrently at startup, false only
+        # reports them
+        self.manage_schema = True
+        try:
+            self.manage_schema = parser.getboolean('psqldb', 'ManageSchema')
+        except (NoSectionError, NoOptionError):
+            pass
 
         # [LIFECYCLEDB]
         self.lc_dbserver_name_or_ip = parser.get('lifecycledb', 'NameOrIp')
@@ -66,9 +96,83 @@ class Args:
         if self.__lc_password:
             self.store_lc_passwd(self.__lc_password)
 
+        # [CREDSTORE] seconds a credential read from the credstore is reused, 0 reads it every time
+        self.credential_cache_seconds = 3600
+        try:
+            self.credential_cache_seconds = int(parser.get('credstore', 'CacheSeconds'))
+        except (NoSectionError, NoOptionError):
+            pass
+
         # [UCS]
         self.ucs_user = parser.get('ucs', 'user')
 
+        # [VCENTER] optional, Servers overrides the vCenter list, e.g. the addresses of the local simulator
+        self.vc_servers = []
+        self.vc_user = None
+        self.__vc_password = None
+        if parser.has_section('vcenter'):
+            servers = parser.get('vcenter', 'Servers', fallback='')
+            self.vc_servers = [s.strip() for s in servers.split(',') if s.strip()]
+            self.vc_user = parser.get('vcenter', 'user', fallback=None)
+            self.__vc_password = parser.get('vcenter', 'password', fallback=None)
+            if self.__vc_password:
+                self.store_vc_passwd(self.__vc_password)
+
+        # [COLLECTOR]
+        self.max_workers = 1
+        try:
+            self.max_workers = int(parser.get('collector', 'MaxWorkers'))
+        except (NoSectionError, NoOptionError):
+            pass
+        self.update_wait_seconds = 60
+        try:
+            self.update_wait_seconds = int(parser.get('collector', 'UpdateWaitSeconds'))
+        except (NoSectionError, NoOptionError):
+            pass
+        self.full_sync_hours = 24
+        try:
+            self.full_sync_hours = float(parser.get('collector', 'FullSyncHours'))
+        except (NoSectionError, NoOptionError):
+            pass
+        self.session_dir = None
+        try:
+            self.session_dir = parser.get('collector', 'SessionDir')
+        except (NoSectionError, NoOptionError):
+            pass
+        # caches the performance counter catalog of each vCenter instead of retrieving it on every connect
+        self.counter_cache_dir = None
+        try:
+            self.counter_cache_dir = parser.get('collector', 'CounterCacheDir')
+        except (NoSectionError, NoOptionError):
+            pass
+        self.keepalive_seconds = 600
+        try:
+            self.keepalive_seconds = int(parser.get('collector', 'KeepaliveSeconds'))
+        except (NoSectionError, NoOptionError):
+            pass
+        self.db_writers = 1
+        try:
+            self.db_writers = int(parser.get('collector', 'DbWriters'))
+        except (NoSectionError, NoOptionError):
+            pass
+        self.write_queue_size = 16
+        try:
+            self.write_queue_size = int(parser.get('collector', 'WriteQueueSize'))
+        except (NoSectionError, NoOptionError):
+            pass
+        # collect every vCenter in a worker process, MaxWorkers is then the number of processes
+        self.use_processes = False
+        try:
+            self.use_processes = parser.getboolean('collector', 'UseProcesses')
+        except (NoSectionError, NoOptionError):
+            pass
+        # write clusters with INSERT ... ON CONFLICT, needs the unique constraints of the capacity schema
+        self.bulk_upsert = False
+        try:
+            self.bulk_upsert = parser.getboolean('collector', 'BulkUpsert')
+        except (NoSectionError, NoOptionError):
+            pass
+
     def get_passwd(self):
         """
         Returns the stored encrypted password from memory
@@ -106,3 +210,22 @@ class Args:
         aes_cipher = AESCipher()
         self.__aes_key = aes_cipher.AES_KEY
         self.__lc_password = aes_cipher.encrypt(clr_passwd)
+
+    def get_vc_passwd(self):
+        """
+        Returns the stored encrypted password from memory
+        :return: clear_text password
+        """
+        if self.__vc_password:
+            aes_cipher = AESCipher()
+            return aes_cipher.decrypt(self.__vc_password, self.__aes_key)
+
+    def store_vc_passwd(self, clr_passwd):
+        """
+        Takes the clear text password and stores it in a variable with AES encryption.
+        :param clr_passwd:
+        :return: None, stores the password in the protected __ variable
+        """
+        aes_cipher = AESCipher()
+        self.__aes_key = aes_cipher.AES_KEY
+        self.__vc_password = aes_cipher.encrypt(clr_passwd)
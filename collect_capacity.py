@@ -1,14 +1,18 @@
 
-import psycopg2
+import os
 import csv
+import sys
 import logging
-from datetime import datetime
-from vspherecapacity.vcenter.handle import Vcenter, VcenterList
+from datetime import datetime, timedelta
+from vspherecapacity.vcenter.handle import VcenterList
 from vspherecapacity.ucs import Ucsd, UcsList
-from pycrypt.credstore import Credential
-from pyVmomi import vim
-from vspherecapacity.capacity.cluster import ClusterCapacity
-from vspherecapacity.capacity import DatabaseAccess, DatabaseObject
+from vspherecapacity.credentials.credstore import Credential, credential_cache
+from vspherecapacity.pipeline import collect_and_write
+from vspherecapacity.incremental import run_incremental
+from vspherecapacity.vcenter.session import VcenterSessionPool
+from vspherecapacity.recording import record_maps, replay_maps, list_recorded_vcenters
+from vspherecapacity.capacity import DatabaseAccess, DatabaseObject, get_connection_pool, close_connection_pools
+from vspherecapacity.capacity.schema import SchemaManager
 from log.setup import LoggerSetup
 from args.handle import Args
 
@@ -28,21 +32,14 @@ def write_csv(dict_obj, fpath, append=False):
             csv_file.close()
 
 
-if __name__ == '__main__':
-    args = Args()
-    log_setup = LoggerSetup(yaml_file=args.logger_setup_yml)
-    log_setup.set_loglevel(args.log_level)
-    log_setup.setup()
-
-    log = logging.getLogger(__name__)
-
-    lc_cred = Credential(username=args.lc_db_user).get_credential()
-    psql = psycopg2.connect(host=args.lc_dbserver_name_or_ip,
-                            database=args.lc_db_name,
+def get_sql_map(args):
+    lc_cred = Credential(username=args.lc_db_user)
+    lc_cred.get_credential()
+    lc_dba = DatabaseAccess(host=args.lc_dbserver_name_or_ip,
+                            db=args.lc_db_name,
                             user=args.lc_db_user,
-                            password=lc_cred.retrieve_password(),
-                            )
-    psql_cursor = psql.cursor()
+                            password=lc_cred.retrieve_password())
+    psql_cursor = lc_dba.cursor
 
     sql_qry_columns = "common_name,serial_number,contract_expiring,end_of_life,product_description"
     sql_qry = """SELECT {} FROM corp
@@ -51,23 +48,27 @@ if __name__ == '__main__':
               """.format(sql_qry_columns, sql_qry_columns)
     psql_cursor.execute(sql_qry)
     sql_data = [DatabaseObject(columns=sql_qry_columns.split(','), sql_data=dbo) for dbo in psql_cursor.fetchall()]
-    psql.close()
+    lc_dba.dispose()
     sql_map = {}
     for dbo in sql_data:
         sql_map.update({
             dbo.common_name.lower(): dbo
         })
+    return sql_map
+
 
+def get_ucs_hw_map():
     ucs_list = UcsList()
     ucs_list.get_list()
     ucs_handler = []
     ucs_hw_map = {}
+    cred = Credential('oppucs01')
+    cred.get_credential()
 
     for ucs in ucs_list.ucs_list:
         ucs_login = {
             'ip': ucs.get('name', None)
         }
-        cred = Credential('oppucs01').get_credential()
         ucs_login.update({
             'username': cred.username,
             'password': cred.retrieve_password(),
@@ -79,87 +80,120 @@ if __name__ == '__main__':
         if ucsm._is_connected():
             ucs_hw_map.update(ucsm.map_service_profile_to_serial_number())
         ucsm.disconnect()
+    return ucs_hw_map
 
-    cluster_capacity = []
-    start_time = datetime.now()
+
+def get_vcenter_names():
     vcenter_list = VcenterList()
     vcenter_list.get_list()
     # vc_list = vcenter_list.parse_list(env_type='prod')
     vc_list = [v for v in vcenter_list.vcenter_list if v.get('env_type', None).lower() != 'storepoc']
+    return [vcenter.get('name', None) for vcenter in vc_list]
+
+
+if __name__ == '__main__':
+    args = Args()
+    log_setup = LoggerSetup(yaml_file=args.logger_setup_yml)
+    log_setup.set_loglevel(args.log_level)
+    log_setup.setup()
+
+    log = logging.getLogger(__name__)
+
+    credential_cache.ttl_seconds = args.credential_cache_seconds
+
+    # every DatabaseAccess of the capacity database borrows its connection from this pool
+    get_connection_pool(args.dbserver_name_or_ip, args.db_name, args.db_user, max_connections=args.db_pool_size,
+                        acquire_timeout=args.db_pool_timeout_seconds)
+    dba = DatabaseAccess(host=args.dbserver_name_or_ip,
+                         db=args.db_name,
+                         user=args.db_user)
+    schema_report = SchemaManager(dba).ensure(create=args.manage_schema)
+    if schema_report.missing_tables:
+        # every write would fail, the tables are created by the migrations of the capacity web application
+        log.error('The capacity database {} is missing {} tables, stopping'.format(args.db_name,
+                                                                                 len(schema_report.missing_tables)))
+        dba.dispose()
+        close_connection_pools()
+        sys.exit(1)
+    bulk_upsert = args.bulk_upsert
+    if bulk_upsert and not schema_report.is_complete():
+        # the upserts need the unique keys, write every row with update_or_create_dbo instead, which also links
+        # without ON CONFLICT when a join table has no unique key
+        log.warning('The capacity schema is incomplete, BulkUpsert is disabled for this run')
+        bulk_upsert = False
+    # load the ids of the existing rows once, the clusters written later look them up in memory
+    dba.preload_ids()
+    dba.dispose()
+
+    if args.replay_dir:
+        log.info('Replaying collection recorded in {}'.format(args.replay_dir))
+        ucs_hw_map, sql_map = replay_maps(args.replay_dir)
+        vc_names = list_recorded_vcenters(args.replay_dir)
+    else:
+        sql_map = get_sql_map(args)
+        ucs_hw_map = get_ucs_hw_map()
+        vc_names = args.vc_servers or get_vcenter_names()
+        if args.record_dir:
+            log.info('Recording collection to {}'.format(args.record_dir))
+            os.makedirs(args.record_dir, exist_ok=True)
+            record_maps(args.record_dir, ucs_hw_map, sql_map)
+
+    session_pool = None
+    if args.session_dir or args.daemon:
+        session_pool = VcenterSessionPool(session_dir=args.session_dir, keepalive_seconds=args.keepalive_seconds)
+
+    start_time = datetime.now()
+    if args.daemon:
+        log.info('Starting incremental collection of {} vCenters'.format(len(vc_names)))
+        if args.use_processes:
+            # the daemon keeps every inventory in memory of this process to apply the updates
+            log.warning('UseProcesses is ignored in daemon mode')
+        if args.bulk_upsert:
+            log.warning('BulkUpsert is ignored in daemon mode')
+        run_incremental(vc_names,
+                        db_host=args.dbserver_name_or_ip,
+                        db_name=args.db_name,
+                        db_user=args.db_user,
+                        hw_map=ucs_hw_map,
+                        sql_map=sql_map,
+                        max_wait_seconds=args.update_wait_seconds,
+                        full_sync_interval=timedelta(hours=args.full_sync_hours),
+                        username=args.vc_user,
+                        password=args.get_vc_passwd(),
+                        session_pool=session_pool,
+                        counter_cache_dir=args.counter_cache_dir)
+        # run_incremental does not return while it is running, never fall through to a batch run
+        log.error('Incremental collection stopped')
+        close_connection_pools()
+        sys.exit(1)
+
+    log.debug('{}\tCollecting {} vCenters with {} workers, writing with {} writers'.format(
+        datetime.now(), len(vc_names), args.max_workers, args.db_writers))
+    collect_and_write(vc_names,
+                      db_host=args.dbserver_name_or_ip,
+                      db_name=args.db_name,
+                      db_user=args.db_user,
+                      max_workers=args.max_workers,
+                      db_writers=args.db_writers,
+                      queue_size=args.write_queue_size,
+                      hw_map=ucs_hw_map,
+                      sql_map=sql_map,
+                      record_dir=args.record_dir,
+                      replay_dir=args.replay_dir,
+                      username=args.vc_user,
+                      password=args.get_vc_passwd(),
+                      session_pool=session_pool,
+                      processes=args.use_processes,
+                      session_dir=args.session_dir,
+                      bulk_upsert=bulk_upsert,
+                      counter_cache_dir=args.counter_cache_dir)
 
-    vc_handler = []
-    for vcenter in vc_list:
-        vc_handler.append(Vcenter(vcenter.get('name', None)))
-
-    for vc in vc_handler:
-        log.debug("Starting vCenter Capacity for {}".format(vc.name))
-        vc.connect()
-        if vc.si:
-            vsp_cap = []
-            ds_cap = []
-            log.debug('{}\tCollecting all clusters'.format(datetime.now()))
-            all_clusters = vc.get_container_view([vim.ClusterComputeResource])
-            log.debug('{}\tCollecting all clusters Capacities'.format(datetime.now()))
-            cluster_capacity.append([ClusterCapacity(vc.name, cl, hw_map=ucs_hw_map, sql_map=sql_map) for cl in all_clusters])
-            log.debug('{}\tComplete Collecting all clusters Capacities'.format(datetime.now()))
-            vc.disconnect()
-            log.debug("End vCenter Capacity for {}".format(vc.name))
-
-    log.debug('{}\tStartDB Updates'.format(datetime.now()))
-    cl_capacity_json = []
-    vsp_capacity_json = []
-    ha_capacity_json = []
-    first_write = True
-    for list_obj in cluster_capacity:
-        for cl_capacity in list_obj:
-            cl_cap_dict = cl_capacity.convert_to_json().copy()
-            vsp_capacity_json.append(cl_cap_dict['vsp_capacity'].copy())
-            [cap.update({'cluster': cl_cap_dict['name']}) for cap in cl_cap_dict['ha_capacity']]
-            ha_capacity_json.append(cl_cap_dict['ha_capacity'].copy())
-            cl_cap_dict.pop('vm_sizes')
-            cl_cap_dict.pop('vsp_capacity')
-            cl_cap_dict.pop('datastores')
-            cl_cap_dict.pop('datastore_clusters')
-            cl_cap_dict.pop('ha_capacity')
-            cl_cap_dict.pop('_ClusterCapacity__dbo')
-            cl_capacity_json.append(cl_cap_dict)
-            cl_capacity.setup_database_connection(db_host=args.dbserver_name_or_ip,
-                                                  db_name=args.db_name,
-                                                  db_user=args.db_user)
-            cl_capacity.db_update_or_create()
-    #         if first_write:
-    #             first_write = False
-    #             write_csv(cl_cap_dict, '/u01/tmp/cluster_capacity.csv')
-    #
-    #         else:
-    #             write_csv(cl_cap_dict, '/u01/tmp/cluster_capacity.csv', append=True)
-    #
-    # first_write = True
-    # for list_obj in ha_capacity_json:
-    #     for cap in list_obj:
-    #         if first_write:
-    #             first_write = False
-    #             write_csv(cap, '/u01/tmp/cluster_ha_capacity.csv')
-    #         else:
-    #             write_csv(cap, '/u01/tmp/cluster_ha_capacity.csv', append=True)
-    #
-    # first_write = True
-    # for list_obj in vsp_capacity_json:
-    #     for cap in list_obj:
-    #         if first_write:
-    #             first_write = False
-    #             write_csv(cap, '/u01/tmp/cluster_vsphere_capacity.csv')
-    #         else:
-    #             write_csv(cap, '/u01/tmp/cluster_vsphere_capacity.csv', append=True)
-    #
-    #
-    # exit(0)
     log.debug('{}\tStartDB Decomm Updates'.format(datetime.now()))
-    dba = DatabaseAccess(host='y0319t11888',
-                         db='vsphere_capacity',
-                         user='django_app')
+    dba = DatabaseAccess(host=args.dbserver_name_or_ip,
+                         db=args.db_name,
+                         user=args.db_user)
     dba.update_decommissions(days_missing_before_decomm=3)
     dba.dispose()
+    close_connection_pools()
     log.debug('{}\tCompleteDB Decomm Updates'.format(datetime.now()))
-    log.debug('{}\tCompleteDB Updates'.format(datetime.now()))
 
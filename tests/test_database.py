@@ -0,0 +1,185 @@
+"""
+Runs DatabaseAccess against a PostgreSQL database set with CAPACITY_TEST_DB_HOST, CAPACITY_TEST_DB_NAME,
+CAPACITY_TEST_DB_USER and CAPACITY_TEST_DB_PASSWORD, the port is taken from PGPORT. The tests create and drop
+their own tables, use a database that holds nothing else. Skipped when CAPACITY_TEST_DB_HOST is not set.
+"""
+import os
+import uuid
+import pytest
+import psycopg2
+from vspherecapacity.capacity import ConnectionPool, DatabaseAccess
+from vspherecapacity.capacity.schema import SchemaReport
+
+DB_HOST = os.environ.get('CAPACITY_TEST_DB_HOST', None)
+DB_NAME = os.environ.get('CAPACITY_TEST_DB_NAME', 'capacity_test')
+DB_USER = os.environ.get('CAPACITY_TEST_DB_USER', 'postgres')
+DB_PASSWORD = os.environ.get('CAPACITY_TEST_DB_PASSWORD', None)
+
+pytestmark = pytest.mark.skipif(not DB_HOST, reason='CAPACITY_TEST_DB_HOST is not set')
+
+
+@pytest.fixture
+def pool():
+    pool = ConnectionPool(DB_HOST, DB_NAME, DB_USER, password=DB_PASSWORD, acquire_timeout=10)
+    yield pool
+    pool.closeall()
+
+
+@pytest.fixture
+def tables(pool):
+    """
+    :return: dict of 'item', 'keyless_item', 'link' and 'keyless_link' to the name of a new table, the keyless
+        tables have no unique key
+    """
+    suffix = uuid.uuid4().hex[:8]
+    names = {kind: 'test_{}_{}'.format(kind, suffix) for kind in ['item', 'keyless_item', 'link', 'keyless_link']}
+    item_columns = """id serial PRIMARY KEY, _mo_id varchar(50) NOT NULL, vcenter varchar(50) NOT NULL DEFAULT '',
+                      name varchar(50), cpu integer, date_created timestamp, date_modified timestamp,
+                      decommission boolean, decommission_date timestamp"""
+    link_columns = 'id serial PRIMARY KEY, parent_id integer NOT NULL, child_id integer NOT NULL'
+    connection = pool.getconn()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE {} ({}, UNIQUE (_mo_id)) ;'.format(names['item'], item_columns))
+            cursor.execute('CREATE TABLE {} ({}) ;'.format(names['keyless_item'], item_columns))
+            cursor.execute('CREATE TABLE {} ({}, UNIQUE (parent_id, child_id)) ;'.format(names['link'], link_columns))
+            cursor.execute('CREATE TABLE {} ({}) ;'.format(names['keyless_link'], link_columns))
+        connection.commit()
+        yield names
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {} ;'.format(', '.join(names.values())))
+        connection.commit()
+        pool.putconn(connection)
+
+
+@pytest.fixture
+def dba(pool):
+    dba = DatabaseAccess(DB_HOST, DB_NAME, DB_USER, pool=pool)
+    yield dba
+    dba.dispose()
+
+
+def fetch(dba, sql_qry):
+    dba.cursor.execute(sql_qry)
+    rows = dba.cursor.fetchall()
+    dba.connection.rollback()
+    return rows
+
+
+def fetch_links(dba, table):
+    return sorted(fetch(dba, 'SELECT parent_id, child_id FROM {} ;'.format(table)))
+
+
+def test_bulk_upsert_inserts_and_updates(dba, tables):
+    table = tables['item']
+    ids = dba.bulk_upsert(table, [{'_mo_id': 'host-1', 'name': 'esx01', 'cpu': 24},
+                                  {'_mo_id': 'host-2', 'name': 'esx02', 'cpu': 24}])
+    assert sorted(ids) == ['host-1', 'host-2']
+    created = {row[0]: row[1:] for row in fetch(dba, 'SELECT _mo_id, id, date_created, decommission FROM {} ;'
+                                                     .format(table))}
+    assert {mo_id: row[0] for mo_id, row in created.items()} == ids
+    assert all(row[1] is not None and row[2] is False for row in created.values())
+
+    dba.cursor.execute('UPDATE {} SET decommission = true, decommission_date = now() ;'.format(table))
+    dba.commit()
+    updated_ids = dba.bulk_upsert(table, [{'_mo_id': 'host-1', 'name': 'esx01', 'cpu': 32},
+                                          {'_mo_id': 'host-3', 'name': 'esx03', 'cpu': 16}])
+    assert updated_ids['host-1'] == ids['host-1']
+    rows = {row[0]: row[1:] for row in fetch(dba, 'SELECT _mo_id, cpu, date_created, decommission, '
+                                                  'decommission_date FROM {} ;'.format(table))}
+    assert rows['host-1'] == (32, created['host-1'][1], False, None)
+    assert rows['host-2'][0] == 24 and rows['host-2'][2] is True
+    assert rows['host-3'][0] == 16 and rows['host-3'][2] is False
+
+
+def test_bulk_upsert_writes_duplicate_keys_once(dba, tables):
+    ids = dba.bulk_upsert(tables['item'], [{'_mo_id': 'host-1', 'name': 'old', 'cpu': 1},
+                                           {'_mo_id': 'host-1', 'name': 'new', 'cpu': 2}])
+    assert list(ids) == ['host-1']
+    assert fetch(dba, 'SELECT name, cpu FROM {} ;'.format(tables['item'])) == [('new', 2)]
+
+
+def test_bulk_upsert_composite_key(dba, tables):
+    table = tables['keyless_item']
+    dba.cursor.execute('ALTER TABLE {} ADD UNIQUE (vcenter, _mo_id) ;'.format(table))
+    dba.commit()
+    ids = dba.bulk_upsert(table, [{'vcenter': 'vc1', '_mo_id': 'host-1', 'cpu': 1},
+                                  {'vcenter': 'vc2', '_mo_id': 'host-1', 'cpu': 2}],
+                          conflict_columns=('vcenter', '_mo_id'))
+    assert sorted(ids) == [('vc1', 'host-1'), ('vc2', 'host-1')]
+    again = dba.bulk_upsert(table, [{'vcenter': 'vc2', '_mo_id': 'host-1', 'cpu': 4}],
+                            conflict_columns=('vcenter', '_mo_id'))
+    assert again == {('vc2', 'host-1'): ids[('vc2', 'host-1')]}
+    assert sorted(fetch(dba, 'SELECT vcenter, cpu FROM {} ;'.format(table))) == [('vc1', 1), ('vc2', 4)]
+
+
+def test_bulk_upsert_skip_date(dba, tables):
+    dba.bulk_upsert(tables['item'], [{'_mo_id': 'host-1', 'cpu': 1}], skip_date=True)
+    assert fetch(dba, 'SELECT date_created, date_modified, decommission FROM {} ;'.format(tables['item'])) == \
+        [(None, None, None)]
+
+
+def test_bulk_upsert_without_commit(dba, pool, tables):
+    dba.bulk_upsert(tables['item'], [{'_mo_id': 'host-1', 'cpu': 1}], commit=False)
+    other = DatabaseAccess(DB_HOST, DB_NAME, DB_USER, pool=pool)
+    try:
+        assert fetch(other, 'SELECT count(*) FROM {} ;'.format(tables['item'])) == [(0,)]
+        dba.commit()
+        assert fetch(other, 'SELECT count(*) FROM {} ;'.format(tables['item'])) == [(1,)]
+    finally:
+        other.dispose()
+
+
+def test_bulk_upsert_without_unique_key(dba, tables):
+    with pytest.raises(psycopg2.Error):
+        dba.bulk_upsert(tables['keyless_item'], [{'_mo_id': 'host-1', 'cpu': 1}])
+    # the failed transaction is rolled back, the connection is usable again
+    assert fetch(dba, 'SELECT count(*) FROM {} ;'.format(tables['keyless_item'])) == [(0,)]
+
+
+@pytest.fixture(params=['unique', 'keyless', 'unreported'])
+def link_table(request, pool, tables):
+    """
+    Join table with the unique key in the schema report, without a unique key, and with a unique key the
+    schema report does not know about
+    """
+    if request.param == 'keyless':
+        return tables['keyless_link']
+    if request.param == 'unique':
+        pool.schema_report = SchemaReport()
+        pool.schema_report.unique.append((tables['link'], ('parent_id', 'child_id')))
+    return tables['link']
+
+
+def test_sync_links(dba, link_table):
+    assert dba.sync_links(link_table, 'parent_id', 'child_id', {1: {10, 11}, 2: {20}}) == [3, 0]
+    assert fetch_links(dba, link_table) == [(1, 10), (1, 11), (2, 20)]
+
+    assert dba.sync_links(link_table, 'parent_id', 'child_id', {1: {10, 11}, 2: {20}}) == [0, 0]
+    assert dba.sync_links(link_table, 'parent_id', 'child_id', {1: {11, 12}}) == [1, 1]
+    # parents not in links are not touched
+    assert fetch_links(dba, link_table) == [(1, 11), (1, 12), (2, 20)]
+
+    assert dba.sync_links(link_table, 'parent_id', 'child_id', {2: set()}) == [0, 1]
+    assert fetch_links(dba, link_table) == [(1, 11), (1, 12)]
+
+
+def test_sync_links_empty(dba, link_table):
+    assert dba.sync_links(link_table, 'parent_id', 'child_id', {}) == [0, 0]
+
+
+def test_sync_links_removes_duplicates(dba, tables):
+    table = tables['keyless_link']
+    dba.cursor.execute('INSERT INTO {} (parent_id, child_id) VALUES (1, 10), (1, 10), (1, 10), (1, 11) ;'
+                       .format(table))
+    dba.commit()
+    assert dba.sync_links(table, 'parent_id', 'child_id', {1: {10, 12}}) == [1, 3]
+    assert fetch_links(dba, table) == [(1, 10), (1, 12)]
+
+
+def test_sync_links_without_commit(dba, link_table):
+    dba.sync_links(link_table, 'parent_id', 'child_id', {1: {10}}, commit=False)
+    dba.rollback()
+    assert fetch_links(dba, link_table) == []
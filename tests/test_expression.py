@@ -0,0 +1,70 @@
+import pytest
+from vspherecapacity.vcenter.expression import compile_filter, FilterSyntaxError
+
+
+def test_and_binds_tighter_than_or():
+    flt = compile_filter('name == a or name == b and config.hardware.numCPU > 4')
+    assert flt.evaluate({'name': 'a', 'config.hardware.numCPU': 1})
+    assert not flt.evaluate({'name': 'b', 'config.hardware.numCPU': 1})
+    assert flt.evaluate({'name': 'b', 'config.hardware.numCPU': 8})
+
+
+def test_parentheses_override_precedence():
+    flt = compile_filter('(name == a or name == b) and config.hardware.numCPU > 4')
+    assert not flt.evaluate({'name': 'a', 'config.hardware.numCPU': 1})
+    assert flt.evaluate({'name': 'a', 'config.hardware.numCPU': 8})
+    assert not flt.evaluate({'name': 'c', 'config.hardware.numCPU': 8})
+
+
+def test_nested_parentheses():
+    flt = compile_filter("runtime.powerState == poweredOn and (name -like 'web*' or (config.hardware.numCPU >= 8 "
+                         "and config.template == $false))")
+    assert flt.evaluate({'runtime.powerState': 'poweredOn', 'name': 'web01'})
+    assert flt.evaluate({'runtime.powerState': 'poweredOn', 'name': 'db01', 'config.hardware.numCPU': 8,
+                         'config.template': False})
+    assert not flt.evaluate({'runtime.powerState': 'poweredOn', 'name': 'db01', 'config.hardware.numCPU': 8,
+                             'config.template': True})
+    assert not flt.evaluate({'runtime.powerState': 'poweredOff', 'name': 'web01'})
+
+
+def test_dash_prefixed_keywords():
+    flt = compile_filter('name == a -or name == b -and config.hardware.numCPU > 4')
+    assert flt.evaluate({'name': 'a'})
+    assert not flt.evaluate({'name': 'b', 'config.hardware.numCPU': 1})
+
+
+@pytest.mark.parametrize('expression', ["name == 'and'", 'name == "or"', 'name == and', 'name == OR'])
+def test_keyword_values(expression):
+    value = expression.split('==')[1].strip().strip('\'"')
+    flt = compile_filter(expression)
+    assert flt.evaluate({'name': value})
+    assert not flt.evaluate({'name': 'web01'})
+
+
+def test_keyword_value_followed_by_keyword():
+    flt = compile_filter("name == or and parent == 'and'")
+    assert flt.evaluate({'name': 'or', 'parent': 'and'})
+    assert not flt.evaluate({'name': 'or', 'parent': 'or'})
+
+
+def test_keyword_prefixed_words():
+    flt = compile_filter('name == or-web01 or name == and01')
+    assert flt.evaluate({'name': 'or-web01'})
+    assert flt.evaluate({'name': 'and01'})
+    assert not flt.evaluate({'name': 'web01'})
+
+
+def test_quoted_values_keep_spaces_and_parentheses():
+    flt = compile_filter("name == 'web (old) or new'")
+    assert flt.evaluate({'name': 'web (old) or new'})
+
+
+def test_properties():
+    flt = compile_filter("(name == a or parent == b) and name -like 'a*'")
+    assert flt.properties == ['name', 'parent']
+
+
+@pytest.mark.parametrize('expression', ['name ==', '(name == a', 'name == a)', 'name == a or', 'and == a'])
+def test_syntax_errors(expression):
+    with pytest.raises(FilterSyntaxError):
+        compile_filter(expression)
@@ -0,0 +1,113 @@
+from pyVmomi import vim, vmodl
+from vspherecapacity.vcenter.inventory import Inventory
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+
+def update_set(*object_updates):
+    return PropertyCollector.UpdateSet(version='2',
+                                       filterSet=[PropertyCollector.FilterUpdate(objectSet=list(object_updates))])
+
+
+def object_update(kind, obj, **changes):
+    change_set = []
+    for name, val in changes.items():
+        name = name.replace('__', '.')
+        if val is None:
+            change_set.append(PropertyCollector.Change(name=name, op='remove'))
+        else:
+            change_set.append(PropertyCollector.Change(name=name, op='assign', val=val))
+    return PropertyCollector.ObjectUpdate(kind=kind, obj=obj, changeSet=change_set)
+
+
+def build_inventory():
+    objects = [
+        {'_moId': 'domain-c1', '_type': 'ClusterComputeResource', 'name': 'cl1', 'host': ['host-1'],
+         'datastore': ['datastore-1']},
+        {'_moId': 'domain-c2', '_type': 'ClusterComputeResource', 'name': 'cl2', 'host': ['host-2'],
+         'datastore': ['datastore-2']},
+        {'_moId': 'host-1', '_type': 'HostSystem', 'name': 'esx01', 'parent': 'domain-c1', 'vm': ['vm-1']},
+        {'_moId': 'host-2', '_type': 'HostSystem', 'name': 'esx02', 'parent': 'domain-c2', 'vm': ['vm-2']},
+        {'_moId': 'vm-1', '_type': 'VirtualMachine', 'name': 'web01', 'config.hardware.numCPU': 2},
+        {'_moId': 'vm-2', '_type': 'VirtualMachine', 'name': 'web02', 'config.hardware.numCPU': 2},
+        {'_moId': 'vm-3', '_type': 'VirtualMachine', 'name': 'db01', 'config.hardware.numCPU': 8},
+        {'_moId': 'datastore-1', '_type': 'Datastore', 'name': 'ds1', 'parent': 'group-s1', 'vm': ['vm-1']},
+        {'_moId': 'datastore-2', '_type': 'Datastore', 'name': 'ds2', 'parent': 'group-p1', 'vm': ['vm-2']},
+        {'_moId': 'datastore-3', '_type': 'Datastore', 'name': 'ds3', 'parent': 'group-s1', 'vm': ['vm-3']},
+        {'_moId': 'group-p1', '_type': 'StoragePod', 'name': 'pod1',
+         'childEntity': ['datastore-2', 'datastore-3']},
+    ]
+    return Inventory('vcenter01', {obj['_moId']: obj for obj in objects})
+
+
+def cluster_ids(clusters):
+    return [cl['_moId'] for cl in clusters]
+
+
+def test_apply_update_set_enter_modify_leave():
+    inventory = build_inventory()
+    changed = inventory.apply_update_set(update_set(
+        object_update('enter', vim.VirtualMachine('vm-4'), name='app01', config__hardware__numCPU=4),
+        object_update('modify', vim.VirtualMachine('vm-1'), config__hardware__numCPU=16, name=None),
+        object_update('modify', vim.HostSystem('host-1'),
+                      vm=vim.VirtualMachine.Array([vim.VirtualMachine('vm-1'), vim.VirtualMachine('vm-4')])),
+        object_update('leave', vim.VirtualMachine('vm-2')),
+    ))
+    assert changed == {'vm-4', 'vm-1', 'host-1', 'vm-2'}
+    assert inventory.get('vm-4') == {'_moId': 'vm-4', '_type': 'VirtualMachine', 'name': 'app01',
+                                     'config.hardware.numCPU': 4}
+    assert inventory.get('vm-1') == {'_moId': 'vm-1', '_type': 'VirtualMachine', 'config.hardware.numCPU': 16}
+    assert inventory.get('host-1')['vm'] == ['vm-1', 'vm-4']
+    assert inventory.get('vm-2') is None
+
+
+def test_apply_update_set_enter_replaces_object():
+    inventory = build_inventory()
+    inventory.apply_update_set(update_set(object_update('enter', vim.VirtualMachine('vm-1'), name='web01')))
+    assert inventory.get('vm-1') == {'_moId': 'vm-1', '_type': 'VirtualMachine', 'name': 'web01'}
+
+
+def test_apply_update_set_modify_unknown_object():
+    inventory = build_inventory()
+    changed = inventory.apply_update_set(update_set(object_update('modify', vim.HostSystem('host-9'), name='esx09')))
+    assert changed == {'host-9'}
+    assert inventory.get('host-9') == {'_moId': 'host-9', '_type': 'HostSystem', 'name': 'esx09'}
+
+
+def test_apply_update_set_empty():
+    inventory = build_inventory()
+    assert inventory.apply_update_set(None) == set()
+    assert inventory.apply_update_set(PropertyCollector.UpdateSet(version='2')) == set()
+    assert len(inventory) == 11
+
+
+def test_get_affected_clusters():
+    inventory = build_inventory()
+    assert cluster_ids(inventory.get_affected_clusters({'domain-c1'})) == ['domain-c1']
+    assert cluster_ids(inventory.get_affected_clusters({'host-2'})) == ['domain-c2']
+    assert cluster_ids(inventory.get_affected_clusters({'vm-1'})) == ['domain-c1']
+    assert cluster_ids(inventory.get_affected_clusters({'vm-1', 'vm-2'})) == ['domain-c1', 'domain-c2']
+
+
+def test_get_affected_clusters_through_datastore_cluster():
+    inventory = build_inventory()
+    # cl2 mounts datastore-2 of group-p1, so the other datastores of the pod and their VMs count too
+    assert cluster_ids(inventory.get_affected_clusters({'datastore-3'})) == ['domain-c2']
+    assert cluster_ids(inventory.get_affected_clusters({'vm-3'})) == ['domain-c2']
+    assert cluster_ids(inventory.get_affected_clusters({'group-p1'})) == ['domain-c2']
+
+
+def test_get_affected_clusters_unrelated():
+    inventory = build_inventory()
+    assert inventory.get_affected_clusters(set()) == []
+    assert inventory.get_affected_clusters({'vm-99', 'host-99'}) == []
+
+
+def test_get_affected_clusters_after_update():
+    inventory = build_inventory()
+    changed = inventory.apply_update_set(update_set(
+        object_update('modify', vim.HostSystem('host-2'),
+                      vm=vim.VirtualMachine.Array([vim.VirtualMachine('vm-2'), vim.VirtualMachine('vm-5')])),
+        object_update('enter', vim.VirtualMachine('vm-5'), name='app02'),
+    ))
+    assert cluster_ids(inventory.get_affected_clusters(changed)) == ['domain-c2']
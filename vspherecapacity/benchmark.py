@@ -0,0 +1,299 @@
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from vspherecapacity.simulator.inventory import generate_inventory
+from vspherecapacity.capacity.cluster import ClusterCapacity
+from vspherecapacity.capacity.vsphere import VsphereCapacity
+from vspherecapacity.capacity.datastore import StorageCapacityCache
+from vspherecapacity.capacity import columnar
+from vspherecapacity.capacity.serializer import get_row
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+VMS_PER_HOST = 50
+SHARED_DATASTORES = 8
+HA_FACTORS = [2, 1]
+CALIBRATION_ITEMS = 200000
+# result keys written to the baseline file, seconds and vms_per_second depend on the machine
+BASELINE_KEYS = ['stage', 'vms', 'relative', 'peak_mb']
+# results of the reference run, regenerate with --save-baseline after an intended change. Stages are compared
+# by their time relative to calibrate(), so the file holds no seconds specific to the machine it was run on
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+def calibrate(repeat=3):
+    """
+    Times a fixed pure python workload of dict lookups and float arithmetic, like the capacity stages do, to
+    express the stage timings relative to the speed of the machine running the benchmark
+    :param repeat: runs, the best run is reported
+    :return: wall time in seconds
+    """
+    def workload():
+        objs = [{'cpu': i % 64, 'mem': float(i)} for i in range(CALIBRATION_ITEMS)]
+        total = 0.0
+        for obj in objs:
+            total += obj['cpu'] * obj['mem'] / 1024
+        return total
+
+    timings = []
+    for i in range(max(1, repeat)):
+        gc.collect()
+        start = time.perf_counter()
+        workload()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def build_inventory(vms, seed=0):
+    """
+    Synthetic inventory of vms VMs, VMS_PER_HOST per host, with SHARED_DATASTORES mounted by every cluster
+    :param vms: number of VirtualMachines
+    :param seed: random seed
+    :return: Inventory
+    """
+    return generate_inventory('vcbench', hosts=max(1, vms // VMS_PER_HOST), vms=vms, seed=seed,
+                              shared_datastores=SHARED_DATASTORES)
+
+
+def build_clusters(inventory):
+    # one storage cache per run, as in collect_vcenters()
+    storage_cache = StorageCapacityCache()
+    return [ClusterCapacity(inventory.vcenter_name, cl, inventory, storage_cache=storage_cache)
+            for cl in inventory.get_by_type('ClusterComputeResource')]
+
+
+def reset_cluster_usage(cl_capacity):
+    """
+    Puts a ClusterCapacity back to the state before _get_usage_info() so it can be timed again
+    """
+    cl_capacity.raw_cpu_total = 0.0
+    cl_capacity.raw_mem_total = 0.0
+    cl_capacity.raw_cpu_used = 0.0
+    cl_capacity.raw_mem_used = 0.0
+    cl_capacity.vm_sizes = []
+    cl_capacity.ha_capacity = []
+
+
+def stage_cluster_init(inventory, clusters):
+    build_clusters(inventory)
+
+
+def stage_vsphere_usage(inventory, clusters):
+    for host in inventory.get_by_type('HostSystem'):
+        VsphereCapacity(inventory.vcenter_name, host, inventory)
+
+
+def stage_cluster_usage(inventory, clusters):
+    for cl_capacity in clusters:
+        reset_cluster_usage(cl_capacity)
+        cl_capacity._get_usage_info()
+
+
+def stage_serialize_rows(inventory, clusters):
+    # the rows ClusterCapacity.db_bulk_update_or_create() writes
+    for cl_capacity in clusters:
+        get_row(cl_capacity)
+        for vm_size in cl_capacity.vm_sizes:
+            get_row(vm_size)
+        for ds_cl in cl_capacity.datastore_clusters:
+            get_row(ds_cl)
+            for ds in ds_cl.datastores:
+                get_row(ds)
+        for ds in cl_capacity.datastores:
+            get_row(ds)
+        for ha in cl_capacity.ha_capacity:
+            get_row(ha)
+        for vsp in cl_capacity.vsp_capacity:
+            get_row(vsp)
+
+
+def stage_calculate_ha(inventory, clusters):
+    for cl_capacity in clusters:
+        for ha_factor in HA_FACTORS:
+            ClusterCapacity.HACapacity(ha_factor=ha_factor, capacity=cl_capacity)
+
+
+def stage_columnar(inventory, clusters):
+    columnar.ColumnarCapacity(inventory).calculate(ha_factors=HA_FACTORS)
+
+
+# stage name, function
+STAGES = [
+    ('ClusterCapacity.__init__', stage_cluster_init),
+    ('VsphereCapacity._get_usage_info', stage_vsphere_usage),
+    ('ClusterCapacity._get_usage_info', stage_cluster_usage),
+    ('serializer.get_row', stage_serialize_rows),
+    ('HACapacity._calculate_ha', stage_calculate_ha),
+]
+if columnar.np is not None:
+    STAGES.append(('ColumnarCapacity.calculate', stage_columnar))
+
+
+def measure(func, inventory, clusters):
+    """
+    :return: wall time of func in seconds
+    """
+    gc.collect()
+    start = time.perf_counter()
+    func(inventory, clusters)
+    return time.perf_counter() - start
+
+
+def measure_peak(func, inventory, clusters):
+    """
+    Runs func under tracemalloc, which slows it down, so it is kept separate from measure()
+    :return: peak bytes allocated by func
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(inventory, clusters)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(sizes=None, repeat=3, seed=0):
+    """
+    Times every stage for every inventory size, the best of repeat runs is reported.
+    :param sizes: list of VM counts
+    :param repeat: runs per stage and size
+    :param seed: random seed of the synthetic inventories
+    :return: list of result dicts with stage, vms, seconds, relative to calibrate(), vms_per_second and peak_mb
+    """
+    calibration = calibrate(repeat=repeat)
+    results = []
+    for vms in sizes or DEFAULT_SIZES:
+        inventory = build_inventory(vms, seed=seed)
+        clusters = build_clusters(inventory)
+        for name, func in STAGES:
+            timings = [measure(func, inventory, clusters) for i in range(max(1, repeat))]
+            peak = measure_peak(func, inventory, clusters)
+            seconds = min(timings)
+            results.append({
+                'stage': name,
+                'vms': vms,
+                'seconds': seconds,
+                'relative': seconds / calibration,
+                'vms_per_second': vms / seconds if seconds else 0.0,
+                'peak_mb': peak / 1048576,
+            })
+    return results
+
+
+def get_calibration(results):
+    """
+    :return: calibrate() seconds of the run the results are from, None for results without relative timings
+    """
+    for result in results:
+        if result.get('relative'):
+            return result['seconds'] / result['relative']
+    return None
+
+
+def get_expected_seconds(base, calibration):
+    """
+    :param base: baseline result
+    :param calibration: calibrate() seconds of the current run
+    :return: seconds the baseline result takes on the current machine, None for baselines without relative timings
+    """
+    if not calibration or 'relative' not in base:
+        return None
+    return base['relative'] * calibration
+
+
+def compare_to_baseline(results, baseline, tolerance=1.25, min_seconds=0.02, memory_tolerance=1.25, min_mb=1.0):
+    """
+    Finds every stage that is slower, or allocates more at its peak, than allowed by its baseline. Each limit
+    is the baseline times the tolerance plus an absolute margin, so the timer and allocator noise of stages
+    that only take a few milliseconds or megabytes never counts as a regression. The baseline time is its
+    time relative to calibrate() scaled to the calibration of the current run, see get_expected_seconds().
+    :param results: returned by run_benchmarks()
+    :param baseline: results of an earlier run loaded from the baseline file
+    :param tolerance: allowed slow down factor
+    :param min_seconds: seconds added to the time limit
+    :param memory_tolerance: allowed peak memory growth factor
+    :param min_mb: megabytes added to the peak memory limit
+    :return: list of [result, baseline result, 'relative' or 'peak_mb'] that regressed
+    """
+    baseline_map = {(b['stage'], b['vms']): b for b in baseline}
+    calibration = get_calibration(results)
+    regressions = []
+    for result in results:
+        base = baseline_map.get((result['stage'], result['vms']), None)
+        if not base:
+            continue
+        expected_seconds = get_expected_seconds(base, calibration)
+        if expected_seconds is not None and result['seconds'] > expected_seconds * tolerance + min_seconds:
+            regressions.append([result, base, 'relative'])
+        if 'peak_mb' in base and result['peak_mb'] > base['peak_mb'] * memory_tolerance + min_mb:
+            regressions.append([result, base, 'peak_mb'])
+    return regressions
+
+
+def print_results(results, baseline=None):
+    baseline_map = {(b['stage'], b['vms']): b for b in baseline or []}
+    calibration = get_calibration(results)
+    print('{:<34}{:>8}{:>12}{:>14}{:>10}{:>10}'.format('stage', 'vms', 'seconds', 'vms/s', 'peak MB', 'ratio'))
+    for r in results:
+        base = baseline_map.get((r['stage'], r['vms']), None)
+        baseline_seconds = get_expected_seconds(base, calibration) if base else None
+        ratio = '{:.2f}'.format(r['seconds'] / baseline_seconds) if baseline_seconds else '-'
+        print('{:<34}{:>8}{:>12.4f}{:>14.0f}{:>10.1f}{:>10}'.format(r['stage'], r['vms'], r['seconds'],
+                                                                   r['vms_per_second'], r['peak_mb'], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the capacity computation hot paths')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma separated VM counts of the synthetic inventories')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best run is reported')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic inventories')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline json file to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results, relative to the calibration run, to --baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='fail when a stage is slower than tolerance times its baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.02,
+                        help='seconds a stage may exceed tolerance times its baseline by')
+    parser.add_argument('--memory-tolerance', type=float, default=1.25,
+                        help='fail when a stage peaks above memory tolerance times its baseline')
+    parser.add_argument('--min-mb', type=float, default=1.0,
+                        help='megabytes a stage may exceed memory tolerance times its baseline by')
+    args = parser.parse_args()
+
+    results = run_benchmarks(sizes=[int(s) for s in args.sizes.split(',') if s.strip()],
+                             repeat=args.repeat,
+                             seed=args.seed)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump([{key: r[key] for key in BASELINE_KEYS} for r in results], f, indent=2)
+        print_results(results)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+
+    baseline = None
+    if args.baseline and os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    elif args.baseline:
+        print('Baseline {} not found, nothing to compare against'.format(args.baseline))
+    print_results(results, baseline)
+    if baseline:
+        regressions = compare_to_baseline(results, baseline,
+                                          tolerance=args.tolerance,
+                                          min_seconds=args.min_seconds,
+                                          memory_tolerance=args.memory_tolerance,
+                                          min_mb=args.min_mb)
+        for result, base, metric in regressions:
+            print('REGRESSION {} at {} VMs: {} {:.4f}, baseline {:.4f}'.format(result['stage'], result['vms'], metric,
+                                                                              result[metric], base[metric]))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,47 @@
 
 import csv
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import time
 import random
+import threading
+from psycopg2.extras import execute_values
+from functools import lru_cache
 from datetime import datetime, timedelta
 from vspherecapacity.credentials.credstore import Credential
 from log.setup import addClassLogger
 
 
+def _safe_division(x, y):
+    if y == 0:
+        return 0.0
+    return float(x / y)
+
+
 @addClassLogger
 class CapacitySuper(object):
+    """
+    Base of the capacity records. A record kind declares its fields as (name, type) tuples, which are the
+    record schema and, for the slotted kinds, also their __slots__ so instances have no per-instance dict.
+    Kinds without fields keep their attributes in __dict__. The rows written to the capacity tables come
+    from capacity.serializer rather than convert_to_json(), non_columns names the fields that are not written.
+    """
+    __slots__ = ()
+    fields = ()
+    non_columns = ()
+
+    @classmethod
+    def schema(cls):
+        """
+        :return: dict of field name to type, in declaration order
+        """
+        return dict(cls.fields)
+
+    def get_field_names(self):
+        if self.fields:
+            return [name for name, _ in self.fields]
+        return list(self.__dict__.keys())
 
     def write_csv(self, fpath):
         dict_obj = self.convert_to_json()
@@ -21,44 +53,340 @@ class CapacitySuper(object):
             csv_file.close()
 
     def convert_to_json(self):
-        dict_obj = self.__dict__
-        for key in list(dict_obj.keys()):
-            if isinstance(dict_obj[key], list):
-                for i in dict_obj[key]:
-                    index = dict_obj[key].index(i)
-                    dict_obj[key][index] = i.convert_to_json()
+        # build a new dict so capacity objects shared between clusters are left untouched
+        dict_obj = {}
+        for key in self.get_field_names():
+            value = getattr(self, key)
+            if isinstance(value, list):
+                value = [i.convert_to_json() for i in value]
+            dict_obj[key] = value
         return dict_obj
 
 
+@lru_cache(maxsize=64)
+def _column_index(columns):
+    return {column.strip(): index for index, column in enumerate(columns)}
+
+
 @addClassLogger
 class DatabaseObject(object):
+    """
+    A row of a query result. The values are kept in a tuple and the column name to index map is shared
+    by every row with the same columns, columns are read as attributes.
+    """
+    __slots__ = ('_columns', '_values')
 
     def __init__(self, columns, sql_data):
-        for column in columns:
-            setattr(self, column.strip(), sql_data[columns.index(column)])
+        self._columns = _column_index(tuple(columns))
+        self._values = tuple(sql_data)
+
+    def __getattr__(self, name):
+        # slots that are not set yet, e.g. while unpickling, must not be looked up as columns
+        if name in DatabaseObject.__slots__:
+            raise AttributeError(name)
+        try:
+            return self._values[self._columns[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getstate__(self):
+        return {'columns': list(self._columns.keys()), 'values': self._values}
+
+    def __setstate__(self, state):
+        self._columns = _column_index(tuple(state['columns']))
+        self._values = state['values']
+
+    def as_dict(self):
+        """
+        :return: dict of column name to value
+        """
+        return {column: self._values[index] for column, index in self._columns.items()}
+
+
+# natural key column of every capacity table with an entry in the IdMap
+NATURAL_KEYS = {
+    'capacity_vcentermodel': 'name',
+    'capacity_vmsizemodel': 'vm_size',
+    'capacity_clustermodel': '_mo_id',
+    'capacity_hostmodel': '_mo_id',
+    'capacity_hamodel': '_mo_id',
+    'capacity_datastoremodel': '_mo_id',
+    'capacity_datastoreclustermodel': '_mo_id',
+}
+
+
+class IdMap(object):
+    """
+    Thread safe map of natural key to id for the tables of NATURAL_KEYS, shared by every DatabaseAccess of a
+    ConnectionPool. It only holds ids of committed rows, so a hit can be used without asking the database.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__ids = {model: {} for model in NATURAL_KEYS}
+
+    def get(self, model, key):
+        with self.__lock:
+            return self.__ids[model].get(key, None)
+
+    def update(self, model, ids):
+        """
+        :param model: table name
+        :param ids: dict of natural key to id
+        :return: None
+        """
+        with self.__lock:
+            self.__ids[model].update(ids)
+
+    def discard(self, model, key):
+        with self.__lock:
+            self.__ids[model].pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            for ids in self.__ids.values():
+                ids.clear()
+
+    def __len__(self):
+        with self.__lock:
+            return sum(len(ids) for ids in self.__ids.values())
+
+
+@addClassLogger
+class ConnectionPool(object):
+    """
+    Thread safe pool of connections to one PostgreSQL database. Connections are opened when needed up to
+    max_connections, kept open when they are handed back and getconn() waits while all of them are borrowed,
+    for at most acquire_timeout seconds so a connection that is never handed back does not block every writer.
+    A connection that is closed, or idle for longer than health_check_seconds and no longer answers, is
+    replaced before it is handed out.
+    """
+
+    def __init__(self, host, db, user, password=None, max_connections=4, health_check_seconds=60,
+                 acquire_timeout=300):
+        """
+        :param host: database server
+        :param db: database name
+        :param user: database user
+        :param password: database password
+        :param max_connections: maximum number of open connections
+        :param health_check_seconds: idle seconds after which a connection is checked before it is reused
+        :param acquire_timeout: seconds getconn() waits for a connection before it raises PoolError
+        """
+        self.host = host
+        self.database = db
+        self.credential = Credential(username=user, password=password)
+        self.id_map = IdMap()
+        # foreign keys of the database, see DatabaseAccess.get_foreign_key_graph()
+        self.foreign_key_graph = None
+        # vCenter names already written through this pool, see DatabaseAccess.upsert_vcenter()
+        self.written_vcenters = set()
+        # SchemaReport of the last SchemaManager.ensure() of the database, None when it was never checked
+        self.schema_report = None
+        self.max_connections = max(1, max_connections)
+        self.health_check_seconds = health_check_seconds
+        self.acquire_timeout = acquire_timeout
+        self.__available = threading.BoundedSemaphore(self.max_connections)
+        self.__lock = threading.Lock()
+        self.__idle = []
+        self.__last_used = {}
+
+    def connect(self):
+        return psycopg2.connect(host=self.host,
+                                database=self.database,
+                                user=self.credential.username,
+                                password=self.credential.retrieve_password(),
+                                )
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+        with self.__lock:
+            last_used = self.__last_used.get(id(connection), 0)
+        if time.monotonic() - last_used < self.health_check_seconds:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1 ;')
+            connection.rollback()
+            return True
+        except psycopg2.Error as e:
+            self.__log.warning('Dropping broken connection to {}/{}: {}'.format(self.host, self.database, e))
+            return False
+
+    def getconn(self):
+        """
+        Borrows a connection, waiting up to acquire_timeout seconds while every connection is in use
+        :return: psycopg2 connection, hand it back with putconn()
+        """
+        if not self.__available.acquire(timeout=self.acquire_timeout):
+            raise psycopg2.pool.PoolError('No connection to {}/{} available after {} seconds, all {} are borrowed'
+                                          .format(self.host, self.database, self.acquire_timeout,
+                                                  self.max_connections))
+        try:
+            while True:
+                with self.__lock:
+                    connection = self.__idle.pop() if self.__idle else None
+                if connection is None:
+                    return self.connect()
+                if self.is_healthy(connection):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self.__available.release()
+            raise
+
+    def putconn(self, connection):
+        """
+        Returns a borrowed connection, an open transaction is rolled back
+        :param connection: connection from getconn()
+        :return: None
+        """
+        try:
+            if not connection.closed:
+                status = connection.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    self.discard(connection)
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            if connection.closed:
+                with self.__lock:
+                    self.__last_used.pop(id(connection), None)
+            else:
+                with self.__lock:
+                    self.__last_used[id(connection)] = time.monotonic()
+                    self.__idle.append(connection)
+        except psycopg2.Error as e:
+            self.__log.warning('Dropping connection to {}/{}: {}'.format(self.host, self.database, e))
+            self.discard(connection)
+        finally:
+            self.__available.release()
+
+    def discard(self, connection):
+        with self.__lock:
+            self.__last_used.pop(id(connection), None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def closeall(self):
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = []
+        for connection in idle:
+            self.discard(connection)
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(host, db, user, password=None, max_connections=4, health_check_seconds=60,
+                        acquire_timeout=300):
+    """
+    Returns the ConnectionPool of the process for host, db and user, creating it on first use.
+    max_connections, health_check_seconds and acquire_timeout only apply to the call that creates the pool.
+    :return: ConnectionPool
+    """
+    key = (host, db, user)
+    with _connection_pools_lock:
+        pool = _connection_pools.get(key, None)
+        if pool is None:
+            pool = ConnectionPool(host, db, user, password=password, max_connections=max_connections,
+                                  health_check_seconds=health_check_seconds, acquire_timeout=acquire_timeout)
+            _connection_pools[key] = pool
+        return pool
+
+
+def close_connection_pools():
+    with _connection_pools_lock:
+        for pool in _connection_pools.values():
+            pool.closeall()
+        _connection_pools.clear()
 
 
 @addClassLogger
 class DatabaseAccess(object):
+    """
+    Database helper working on a connection borrowed from the ConnectionPool of host, db and user.
+    dispose() hands the connection back to the pool. The ids of the rows of NATURAL_KEYS are looked up in the
+    IdMap of the pool first, see preload_ids() and get_id().
+    """
 
-    def __init__(self, host, db, user, password=None):
+    def __init__(self, host, db, user, password=None, pool=None):
         self.host = host
         self.database = db
-        self.credential = Credential(username=user, password=password)
-        self.connection = psycopg2.connect(host=self.host,
-                                           database=self.database,
-                                           user=self.credential.username,
-                                           password=self.credential.retrieve_password(),
-                                           )
+        self.pool = pool or get_connection_pool(host, db, user, password=password)
+        self.credential = self.pool.credential
+        self.id_map = self.pool.id_map
+        self.connection = self.pool.getconn()
         self.cursor = self.connection.cursor()
+        # ids returned by statements of the open transaction, added to the IdMap on commit()
+        self.__pending_ids = []
 
     def initialize_cursor(self):
         self.cursor.close()
         self.cursor = self.connection.cursor()
 
+    def commit(self):
+        self.connection.commit()
+        for model, ids in self.__pending_ids:
+            self.id_map.update(model, ids)
+        self.__pending_ids = []
+
+    def rollback(self):
+        self.__pending_ids = []
+        self.connection.rollback()
+
+    def preload_ids(self, models=None):
+        """
+        Loads the id of every row of models into the IdMap with one query per table, so the rows written
+        during the run are found without a lookup query
+        :param models: tables to load, defaults to every table of NATURAL_KEYS
+        :return: number of ids loaded
+        """
+        count = 0
+        for model in models or NATURAL_KEYS:
+            sql_qry = "SELECT id, {} FROM {} ;".format(NATURAL_KEYS[model], model)
+            try:
+                self.cursor.execute(sql_qry)
+                ids = {key: row_id for row_id, key in self.cursor.fetchall()}
+                self.connection.rollback()
+            except psycopg2.errors.UndefinedTable:
+                self.connection.rollback()
+                continue
+            except BaseException:
+                self.connection.rollback()
+                raise
+            self.id_map.update(model, ids)
+            count += len(ids)
+        self.__log.debug('Loaded {} ids'.format(count))
+        return count
+
+    def get_id(self, model, key):
+        """
+        :param model: table of NATURAL_KEYS
+        :param key: natural key, e.g. the _mo_id or the vCenter name
+        :return: id of the row, None when the row does not exist
+        """
+        row_id = self.id_map.get(model, key)
+        if row_id is None:
+            where_param = NATURAL_KEYS[model]
+            dbo = self.get_dbo(model=model, obj={where_param: key}, select_columns=where_param,
+                               where_param=where_param)
+            if dbo:
+                row_id = dbo[0][0]
+                self.id_map.update(model, {key: row_id})
+        return row_id
+
     def dispose(self):
+        # may be called more than once, the connection is only returned the first time
+        if self.connection is None:
+            return
         self.cursor.close()
-        self.connection.close()
+        self.pool.putconn(self.connection)
+        self.connection = None
 
     def get_dbo(self, model, obj, select_columns='*', where_param='_mo_id'):
         if not select_columns == '*':
@@ -69,6 +397,20 @@ class DatabaseAccess(object):
         return self.cursor.fetchall()
 
     def update_or_create_dbo(self, obj, model, columns=None, where_param='_mo_id', skip_date=False):
+        """
+        Updates the row of model whose where_param column matches obj, or inserts it when there is none
+        :param obj: dict of column to value
+        :param model: table name
+        :param columns: column names, defaults to the keys of obj
+        :param where_param: column identifying the row
+        :param skip_date: do not set date_created, date_modified and the decommission columns
+        :return: id of the row
+        """
+        # the natural key rows are found in the IdMap, the others with a lookup query
+        natural_key = NATURAL_KEYS.get(model, None) == where_param
+        key = obj[where_param]
+        row, row_columns = obj, columns
+        obj = dict(obj)
         values = tuple(obj.values())
         value_interop = ('%s,' * len(values)).rstrip(',')
 
@@ -84,9 +426,12 @@ class DatabaseAccess(object):
                 "Invalid value for parameter 'columns'. Number of items in columns must match values"
             )
 
-        existing_dbo = self.get_dbo(model=model,
-                                    obj=obj,
-                                    where_param=where_param)
+        if natural_key:
+            existing_dbo = self.get_id(model, key) is not None
+        else:
+            existing_dbo = self.get_dbo(model=model,
+                                        obj=obj,
+                                        where_param=where_param)
 
         sql_qry = ''
         if existing_dbo:
@@ -100,12 +445,12 @@ class DatabaseAccess(object):
                     'decommission_date': None})
             values = list(obj.values())
             values.append(obj[where_param])
-            sql_qry = "UPDATE {} SET ({}) = ({}) WHERE {}.{}=%s;".format(model,
-                                                                         column_interop,
-                                                                         value_interop,
-                                                                         model,
-                                                                         where_param
-                                                                         )
+            sql_qry = "UPDATE {} SET ({}) = ({}) WHERE {}.{}=%s RETURNING id ;".format(model,
+                                                                                      column_interop,
+                                                                                      value_interop,
+                                                                                      model,
+                                                                                      where_param
+                                                                                      )
         elif not existing_dbo:
             if not skip_date:
                 column_interop += ", date_created, date_modified, decommission"
@@ -117,11 +462,155 @@ class DatabaseAccess(object):
                     'decommission': False
                 })
             values = tuple(obj.values())
-            sql_qry = "INSERT INTO {} ({}) VALUES({}) ;".format(model,
-                                                                column_interop,
-                                                                value_interop)
+            sql_qry = "INSERT INTO {} ({}) VALUES({}) RETURNING id ;".format(model,
+                                                                             column_interop,
+                                                                             value_interop)
         self.cursor.execute(sql_qry, tuple(values))
-        self.connection.commit()
+        result = self.cursor.fetchone()
+        self.commit()
+        if natural_key:
+            if result is None:
+                # the row of the IdMap was deleted, insert it again
+                self.id_map.discard(model, key)
+                return self.update_or_create_dbo(row, model, columns=row_columns, where_param=where_param,
+                                                 skip_date=skip_date)
+            self.id_map.update(model, {key: result[0]})
+        return result[0] if result else None
+
+    def bulk_upsert(self, model, rows, conflict_columns=('_mo_id',), skip_date=False, page_size=1000, commit=True):
+        """
+        Inserts or updates many rows of model with multi-row INSERT ... ON CONFLICT (conflict_columns) DO UPDATE
+        ... RETURNING id statements, all in one transaction. The date and decommission columns are set as
+        update_or_create_dbo() sets them. Requires a unique key on conflict_columns, see capacity.schema.
+        Rows with the same conflict key are written once, the last one wins.
+        :param model: table name
+        :param rows: list of dicts with the same keys, e.g. from serializer.get_row()
+        :param conflict_columns: columns identifying a row
+        :param skip_date: do not set date_created, date_modified and the decommission columns
+        :param page_size: rows per statement
+        :param commit: commit the transaction, False leaves the commit to the caller. The ids of the natural key
+            rows are added to the IdMap once the transaction is committed with commit()
+        :return: dict of conflict key to id, the key is the value of the conflict column or a tuple of the values
+            of several conflict columns
+        """
+        if not rows:
+            return {}
+        conflict_columns = tuple(conflict_columns)
+        columns = list(rows[0].keys())
+        # a statement may not update the same row twice
+        unique_rows = {}
+        for row in rows:
+            unique_rows[tuple(row[c] for c in conflict_columns)] = row
+
+        now = datetime.now()
+        values = []
+        # rows are locked in conflict key order, so writers sharing rows such as the vm sizes cannot deadlock
+        for key in sorted(unique_rows):
+            row = unique_rows[key]
+            value = [row[c] for c in columns]
+            if not skip_date:
+                value.extend([now, now, False])
+            values.append(tuple(value))
+
+        insert_columns = list(columns)
+        # updating a conflict column to itself makes RETURNING include rows that did not change
+        assignments = ['{0} = EXCLUDED.{0}'.format(c) for c in columns if c not in conflict_columns] or \
+                      ['{0} = EXCLUDED.{0}'.format(conflict_columns[0])]
+        if not skip_date:
+            insert_columns.extend(['date_created', 'date_modified', 'decommission'])
+            assignments.extend(['date_modified = EXCLUDED.date_modified', 'decommission = false',
+                                'decommission_date = NULL'])
+        sql_qry = "INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO UPDATE SET {} RETURNING id, {} ;".format(
+            model,
+            ', '.join(insert_columns),
+            ', '.join(conflict_columns),
+            ', '.join(assignments),
+            ', '.join(conflict_columns))
+        try:
+            results = execute_values(self.cursor, sql_qry, values, page_size=page_size, fetch=True)
+        except BaseException:
+            self.rollback()
+            raise
+
+        ids = {}
+        for result in results:
+            key = result[1] if len(conflict_columns) == 1 else tuple(result[1:])
+            ids[key] = result[0]
+        if conflict_columns == (NATURAL_KEYS.get(model, None),):
+            self.__pending_ids.append((model, ids))
+        if commit:
+            self.commit()
+        return ids
+
+    def upsert_vcenter(self, name):
+        """
+        Writes the vCenter row in its own transaction the first time it is asked for through the ConnectionPool,
+        which is once per collection run, so the cluster transactions of the vCenter do not all update and lock
+        it. Later calls take the id from the IdMap.
+        :param name: vCenter name
+        :return: id of the vCenter row
+        """
+        model = 'capacity_vcentermodel'
+        if name in self.pool.written_vcenters:
+            row_id = self.id_map.get(model, name)
+            if row_id is not None:
+                return row_id
+        row_id = self.bulk_upsert(model, [{'name': name}], conflict_columns=('name',))[name]
+        self.pool.written_vcenters.add(name)
+        return row_id
+
+    def sync_links(self, model, parent_column, child_column, links, page_size=1000, commit=True):
+        """
+        Makes the rows of the join table model of every parent in links match links exactly. The rows of the
+        parents are read with one SELECT, the missing pairs are added with one multi-row INSERT and the others,
+        including duplicate pairs, are removed with one DELETE, all in one transaction. Parents that are not
+        in links are not touched. When the schema report of the pool has the unique key on (parent_column,
+        child_column) a pair another writer added in the meantime is skipped by ON CONFLICT DO NOTHING, without
+        the key the pairs are inserted with INSERT ... SELECT ... WHERE NOT EXISTS instead.
+        :param model: join table name
+        :param parent_column: column of the parent id, e.g. clustermodel_id
+        :param child_column: column of the child id, e.g. datastoremodel_id
+        :param links: dict of parent id to the set of child ids it is linked to, an empty set unlinks the parent
+        :param page_size: rows per INSERT statement
+        :param commit: commit the transaction, False leaves the commit to the caller
+        :return: [number of links inserted, number of links deleted]
+        """
+        if not links:
+            return [0, 0]
+        existing = set()
+        stale = []
+        try:
+            self.cursor.execute("SELECT id, {}, {} FROM {} WHERE {} = ANY(%s) ;".format(parent_column,
+                                                                                        child_column,
+                                                                                        model,
+                                                                                        parent_column),
+                                (list(links.keys()),))
+            for row_id, parent_id, child_id in self.cursor.fetchall():
+                if child_id in links[parent_id] and (parent_id, child_id) not in existing:
+                    existing.add((parent_id, child_id))
+                else:
+                    stale.append(row_id)
+            missing = [(parent_id, child_id) for parent_id in sorted(links)
+                       for child_id in sorted(links[parent_id]) if (parent_id, child_id) not in existing]
+            if missing:
+                report = self.pool.schema_report
+                if report and report.has_unique_key(model, (parent_column, child_column)):
+                    sql_qry = "INSERT INTO {0} ({1}, {2}) VALUES %s ON CONFLICT ({1}, {2}) DO NOTHING ;".format(
+                        model, parent_column, child_column)
+                else:
+                    sql_qry = """INSERT INTO {0} ({1}, {2})
+                                 SELECT v.{1}, v.{2} FROM (VALUES %s) AS v ({1}, {2})
+                                 WHERE NOT EXISTS (SELECT 1 FROM {0} WHERE {0}.{1} = v.{1} AND {0}.{2} = v.{2}) ;
+                              """.format(model, parent_column, child_column)
+                execute_values(self.cursor, sql_qry, missing, page_size=page_size)
+            if stale:
+                self.cursor.execute("DELETE FROM {} WHERE id = ANY(%s) ;".format(model), (stale,))
+            if commit:
+                self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        return [len(missing), len(stale)]
 
     def decommission_dbo(self, obj, model, where_param='id'):
         values = tuple(obj.values())
@@ -149,79 +638,70 @@ class DatabaseAccess(object):
         self.connection.commit()
 
     def update_decommissions(self, days_missing_before_decomm=3):
+        """
+        Marks the rows of every capacity table not written for days_missing_before_decomm days as decommissioned
+        and removes the rows referencing them, e.g. the cluster links of a decommissioned host. Each table takes
+        one UPDATE ... RETURNING id and each referencing table one DELETE, all in a single transaction.
+        :param days_missing_before_decomm: days since date_modified after which a row is decommissioned
+        :return: dict of table name to the list of decommissioned ids
+        """
         decom_point = datetime.now()
-        sql_qry_tables = "SELECT table_name from information_schema.tables where table_name LIKE 'capacity_%' ;"
-        self.cursor.execute(sql_qry_tables)
-        tables_dbo = self.cursor.fetchall()
-
-        decom_dbo_map = {}
-        for index in tables_dbo:
-            table = index[0]
-            if not decom_dbo_map.get(table or None):
-                decom_dbo_map.update({table: []})
-
-            sql_qry = "SELECT * FROM {} WHERE {}.date_modified < NOW() - INTERVAL '{} days' ;".format(table,
-                                                                                                      table,
-                                                                                                      days_missing_before_decomm)
-            dbo = None
-            try:
-                self.cursor.execute(sql_qry)
-                dbo = self.cursor.fetchall()
-            except psycopg2.errors.UndefinedColumn as e:
-                self.connection.rollback()
-                pass
-            except BaseException:
-                self.connection.rollback()
-                raise
-
-            if dbo:
-                decom_dbo_map[table] = dbo
-
-        for table in list(decom_dbo_map.keys()):
-            for dbo in decom_dbo_map[table]:
-                obj = {'id': dbo[00],
-                       'decommission': True,
-                       'decommission_date': decom_point
-                       }
-                self.decommission_dbo(obj=obj,
-                                      model=table,
-                                      where_param='id')
-                fkey_map = self.map_foreign_keys(table)
-                if fkey_map:
-                    for f_obj in fkey_map[table]:
-                        self.remove_decommissioned_relationships(model=f_obj.table,
-                                                                 foreign_key={f_obj.key: dbo[00]},
-                                                                 where_param=f_obj.key)
+        sql_qry_tables = """SELECT table_name FROM information_schema.columns
+                            WHERE table_name LIKE 'capacity_%' AND column_name = 'date_modified' ;"""
+        foreign_key_graph = self.get_foreign_key_graph()
+        decom_ids = {}
+        try:
+            self.cursor.execute(sql_qry_tables)
+            tables = sorted(set(row[0] for row in self.cursor.fetchall()))
+            for table in tables:
+                sql_qry = """UPDATE {} SET (decommission, decommission_date) = (%s, %s)
+                             WHERE {}.date_modified < NOW() - INTERVAL '{} days' RETURNING id ;""".format(
+                    table, table, int(days_missing_before_decomm))
+                self.cursor.execute(sql_qry, (True, decom_point))
+                ids = [row[0] for row in self.cursor.fetchall()]
+                if not ids:
+                    continue
+                decom_ids[table] = ids
+                for f_obj in foreign_key_graph.get(table, []):
+                    self.cursor.execute("DELETE FROM {} WHERE {} = ANY(%s) ;".format(f_obj.table, f_obj.key), (ids,))
+            self.commit()
+        except BaseException:
+            self.rollback()
+            raise
+        self.__log.info('Decommissioned {} rows in {} tables'.format(sum(len(i) for i in decom_ids.values()),
+                                                                     len(decom_ids)))
+        return decom_ids
+
+    def get_foreign_key_graph(self):
+        """
+        Reads the foreign keys of the database with one query the first time it is called for the ConnectionPool
+        :return: dict of table name to the list of ForeignKey referencing it
+        """
+        if self.pool.foreign_key_graph is None:
+            sql_qry = """SELECT
+                tc.table_name,
+                kcu.column_name,
+                ccu.table_name AS foreign_table_name
+            FROM
+                information_schema.table_constraints AS tc
+                JOIN information_schema.key_column_usage AS kcu
+                  ON tc.constraint_name = kcu.constraint_name
+                  AND tc.table_schema = kcu.table_schema
+                JOIN information_schema.constraint_column_usage AS ccu
+                  ON ccu.constraint_name = tc.constraint_name
+                  AND ccu.table_schema = tc.table_schema
+            WHERE tc.constraint_type = 'FOREIGN KEY' ;"""
+            self.cursor.execute(sql_qry)
+            foreign_key_graph = {}
+            for table, column, f_table in self.cursor.fetchall():
+                foreign_key_graph.setdefault(f_table, []).append(ForeignKey(table, f_table, column))
+            self.pool.foreign_key_graph = foreign_key_graph
+        return self.pool.foreign_key_graph
 
     def map_foreign_keys(self, model):
-        sql_qry = """SELECT
-            tc.table_name,
-            kcu.column_name,
-            ccu.table_name AS foreign_table_name
-        FROM
-            information_schema.table_constraints AS tc
-            JOIN information_schema.key_column_usage AS kcu
-              ON tc.constraint_name = kcu.constraint_name
-              AND tc.table_schema = kcu.table_schema
-            JOIN information_schema.constraint_column_usage AS ccu
-              ON ccu.constraint_name = tc.constraint_name
-              AND ccu.table_schema = tc.table_schema
-        WHERE tc.constraint_type = 'FOREIGN KEY' and ccu.table_name=%s;"""
-        self.cursor.execute(sql_qry, (model,))
-        dbo = self.cursor.fetchall()
-
-        if dbo:
-            foreign_map = {}
-            for i in dbo:
-                table = i[0]
-                column = i[1]
-                f_table = i[2]
-
-                if not foreign_map.get(f_table or None):
-                    foreign_map.update({f_table: []})
-                foreign_map[f_table].append(ForeignKey(table, f_table, column))
-
-            return foreign_map
+        foreign_keys = self.get_foreign_key_graph().get(model, None)
+        if foreign_keys:
+            return {model: foreign_keys}
         return None
 
     def remove_decommissioned_relationships(self, model, foreign_key, where_param):
@@ -1,22 +1,62 @@
 
 import math
-import statistics
 from datetime import datetime
-from pyVmomi import vim
-from vspherecapacity.capacity import CapacitySuper, DatabaseAccess
+from vspherecapacity.capacity import CapacitySuper, DatabaseAccess, _safe_division
 from vspherecapacity.capacity.vsphere import VsphereCapacity
-from vspherecapacity.capacity.datastore import DatastoreCapacity, DatastoreClusterCapacity
-
-
-def _safe_division(x, y):
-    if y == 0:
-        return 0.0
-    return float(x / y)
+from vspherecapacity.capacity.virtualmachine import VmSizeHistogram
+from vspherecapacity.capacity.datastore import StorageCapacityCache
+from vspherecapacity.capacity.serializer import get_row
 
 
 class ClusterCapacity(CapacitySuper):
+    # not slotted, the fields keep the database connection and the vm size histogram out of convert_to_json()
+    fields = (
+        ('vcenter_name', str),
+        ('name', str),
+        ('_mo_id', str),
+        ('raw_cpu_total', float),
+        ('raw_mem_total', float),
+        ('raw_cpu_used', float),
+        ('raw_mem_used', float),
+        ('raw_cpu_over_commit', float),
+        ('raw_avg_cpu_over_commit', float),
+        ('raw_mem_over_commit', float),
+        ('raw_avg_mem_over_commit', float),
+        ('raw_storage_total', float),
+        ('raw_storage_used', float),
+        ('raw_storage_free', float),
+        ('vsp_capacity', list),
+        ('datastores', list),
+        ('datastore_clusters', list),
+        ('vmhost_count', int),
+        ('ha_capacity', list),
+        ('vm_sizes', list),
+        ('vm_low_cpu', int),
+        ('vm_low_mem', float),
+        ('vm_avg_cpu', int),
+        ('vm_avg_mem', int),
+        ('vm_max_cpu', int),
+        ('vm_max_mem', float),
+    )
+    non_columns = ('vcenter_name',)
 
     class HACapacity(CapacitySuper):
+        fields = (
+            ('_mo_id', str),
+            ('cluster_ha', str),
+            ('cluster', str),
+            ('ha_factor', int),
+            ('ha_usable_cpu_total', float),
+            ('ha_usable_mem_total', float),
+            ('ha_reserved_cpu', float),
+            ('ha_reserved_mem', float),
+            ('ha_cpu_over_commit', float),
+            ('ha_cpu_percent_used', float),
+            ('ha_mem_over_commit', float),
+            ('ha_mem_percent_used', float),
+        )
+        __slots__ = tuple(name for name, _ in fields)
+
         def __init__(self, ha_factor, capacity):
             self._mo_id = "{}-ha{}".format(capacity._mo_id, ha_factor)
             self.cluster_ha = '{}-ha_n{}'.format(capacity.name, ha_factor)
@@ -43,11 +83,11 @@ class ClusterCapacity(CapacitySuper):
             self.ha_cpu_percent_used = self.ha_cpu_over_commit * 100
             self.ha_mem_percent_used = self.ha_mem_over_commit * 100
 
-    def __init__(self, vcenter_name, mo, hw_map=None, sql_map=None):
+    def __init__(self, vcenter_name, mo, inventory, hw_map=None, sql_map=None, storage_cache=None):
         # super().__init__()
         self.vcenter_name = vcenter_name
-        self.name = mo.name
-        self._mo_id = mo._moId
+        self.name = mo['name']
+        self._mo_id = mo['_moId']
         self.raw_cpu_total = 0.0
         self.raw_mem_total = 0.0
         self.raw_cpu_used = 0.0
@@ -62,9 +102,10 @@ class ClusterCapacity(CapacitySuper):
         self.vsp_capacity = []
         self.datastores = []
         self.datastore_clusters = []
-        self.vmhost_count = len(mo.host)
+        self.vmhost_count = len(mo.get('host') or [])
         self.ha_capacity = []
         self.vm_sizes = []
+        self.vm_size_histogram = None
         self.vm_low_cpu = 0.0
         self.vm_low_mem = 0.0
         self.vm_avg_cpu = 0.0
@@ -74,67 +115,65 @@ class ClusterCapacity(CapacitySuper):
 
         self.__dbo = None
 
-        self._get_vsp_usage_info(mo, hw_map=hw_map, sql_map=sql_map)
-        self._get_datastore_usage_info(mo)
+        self._get_vsp_usage_info(mo, inventory, hw_map=hw_map, sql_map=sql_map)
+        self._get_datastore_usage_info(mo, inventory, storage_cache=storage_cache)
         self._get_usage_info()
 
-    def _get_vsp_usage_info(self, mo, hw_map=None, sql_map=None):
-        self.vsp_capacity = [VsphereCapacity(self.vcenter_name, vmhost, hw_map, sql_map) for vmhost in mo.host]
+    def _get_vsp_usage_info(self, mo, inventory, hw_map=None, sql_map=None):
+        self.vsp_capacity = [VsphereCapacity(self.vcenter_name, vmhost, inventory, hw_map, sql_map)
+                             for vmhost in inventory.get_objects(mo.get('host'))]
         for c in self.vsp_capacity:
             self.raw_avg_cpu_over_commit += c.cpu_over_commit
             self.raw_avg_mem_over_commit += c.mem_over_commit
         self.raw_avg_cpu_over_commit = _safe_division(self.raw_avg_cpu_over_commit, self.vmhost_count)
         self.raw_avg_mem_over_commit = _safe_division(self.raw_avg_mem_over_commit, self.vmhost_count)
 
-    def _get_datastore_usage_info(self, mo):
+    def _get_datastore_usage_info(self, mo, inventory, storage_cache=None):
+        # datastores and datastore clusters are shared with the other clusters of the run through storage_cache
+        if storage_cache is None:
+            storage_cache = StorageCapacityCache()
         ds_cluster_tracker = {}
-        for ds in mo.datastore:
-            if not ds.name.find('local') >= 0 and not ds.name.find('datastore') >= 0 and not ds.name.find('swap') >= 0:
-                if isinstance(ds.parent, vim.StoragePod):
+        for ds in inventory.get_objects(mo.get('datastore')):
+            if not ds['name'].find('local') >= 0 and not ds['name'].find('datastore') >= 0 and not ds['name'].find('swap') >= 0:
+                ds_parent = inventory.get(ds.get('parent'))
+                if ds_parent and ds_parent['_type'] == 'StoragePod':
                     # datastore belongs to a datastore cluster
 
                     # Check if the ds cluster has already been processed, if so then
                     # all capacity numbers have been gathered, otherwise gather the
                     # capacity information of the ds cluster
-                    if not ds_cluster_tracker.get(ds.parent._moId or None):
-                        capacity = DatastoreClusterCapacity(ds.parent)
+                    if not ds_cluster_tracker.get(ds_parent['_moId'] or None):
+                        capacity = storage_cache.get_datastore_cluster(self.vcenter_name, ds_parent, inventory)
                         self.datastore_clusters.append(capacity)
                         self.raw_storage_total += capacity.total_capacity
                         self.raw_storage_used += capacity.total_used
                         self.raw_storage_free += capacity.total_free_actual
-                        ds_cluster_tracker.update({ds.parent._moId: True})
-                elif isinstance(ds, vim.Datastore):
-                    capacity = DatastoreCapacity(ds)
+                        ds_cluster_tracker.update({ds_parent['_moId']: True})
+                elif ds['_type'] == 'Datastore':
+                    capacity = storage_cache.get_datastore(self.vcenter_name, ds, inventory)
                     self.datastores.append(capacity)
                     self.raw_storage_total += capacity.total_capacity
                     self.raw_storage_used += capacity.total_used
                     self.raw_storage_free += capacity.total_free_actual
 
     def _get_usage_info(self):
-        vm_cpus = []
-        vm_mems = []
+        histogram = VmSizeHistogram()
         for cap in self.vsp_capacity:
             self.raw_cpu_total += cap.cpu_total
             self.raw_mem_total += cap.mem_total
             self.raw_cpu_used += cap.cpu_used
             self.raw_mem_used += cap.mem_used
-
-            for vm_size in cap.vm_sizes:
-                if vm_size not in self.vm_sizes:
-                    self.vm_sizes.append(vm_size)
-                vm_cpu, vm_mem = vm_size.__str__().split('x')
-                vm_cpus.append(int(vm_cpu))
-                vm_mems.append(float(vm_mem))
-        if not vm_cpus:
-            vm_cpus = [0]  # There could be clusters without any VMs, if this is the case then set 0
-        if not vm_mems:
-            vm_mems = [0]  # There could be clusters without any VMs, if this is the case then set 0
-        self.vm_low_cpu = min(vm_cpus)
-        self.vm_low_mem = min(vm_mems)
-        self.vm_avg_cpu = math.ceil(statistics.mean(vm_cpus))
-        self.vm_avg_mem = math.ceil(statistics.mean(vm_mems))
-        self.vm_max_cpu = max(vm_cpus)
-        self.vm_max_mem = max(vm_mems)
+            histogram.merge(cap.vm_size_histogram)
+        # statistics are taken over every VM of the cluster, clusters without VMs report 0
+        low_cpu, low_mem, avg_cpu, avg_mem, max_cpu, max_mem = histogram.get_statistics()
+        self.vm_size_histogram = histogram
+        self.vm_sizes = histogram.get_vm_sizes()
+        self.vm_low_cpu = low_cpu
+        self.vm_low_mem = low_mem
+        self.vm_avg_cpu = math.ceil(avg_cpu)
+        self.vm_avg_mem = math.ceil(avg_mem)
+        self.vm_max_cpu = max_cpu
+        self.vm_max_mem = max_mem
         self.raw_cpu_over_commit = _safe_division(self.raw_cpu_used, self.raw_cpu_total)
         self.raw_mem_over_commit = _safe_division(self.raw_mem_used, self.raw_mem_total)
         self.ha_capacity.append(self.HACapacity(ha_factor=2, capacity=self))
@@ -155,42 +194,21 @@ class ClusterCapacity(CapacitySuper):
                 raise ConnectionError(
                     "No connection to a relational database available. "
                     "Must establish database connection first using setup_database_connection()")
-            dict_obj = self.convert_to_json()
-            dict_obj = dict_obj.copy()
-
             # process vCenter database as all objects rely upon this
-            self.__dbo.update_or_create_dbo(model='capacity_vcentermodel',
-                                            obj={'name': dict_obj['vcenter_name']},
-                                            where_param='name'
-                                            )
-            cl_dbo = self.update_cl(dict_obj.copy())
-
-            for vm_size in dict_obj['vm_sizes']:
-                self.update_vm_size(vm_size.copy())
-
-            self.update_cl_vmsize(dict_obj.copy(), cl_dbo)
-
-            for ds in dict_obj['datastores']:
-                ds_dbo = self.update_datastore(ds.copy())
-                self.update_cl_ds(cl_dbo, ds_dbo)
-
-            for ds_cl in dict_obj['datastore_clusters']:
-                datastores = ds_cl.pop('datastores')
-                dscl_dbo = self.update_datastore_cluster(ds_cl.copy())
-                self.update_cl_dscl(cl_dbo, dscl_dbo)
-                for ds in datastores:
-                    ds_dbo = self.update_datastore(ds)
-                    self.update_ds_dscl(ds_dbo, dscl_dbo)
-                    self.update_cl_ds(cl_dbo, ds_dbo)
-
-            for ha in dict_obj['ha_capacity']:
-                ha_dbo = self.update_ha(ha.copy())
-                self.update_cl_ha(cl_dbo, ha_dbo)
-
-            for vsp in dict_obj['vsp_capacity']:
-                vsp_dbo = self.update_vsp(vsp.copy())
-                self.update_vsp_vmsize(vsp.copy(), vsp_dbo)
-                self.update_cl_vsp(cl_dbo, vsp_dbo)
+            vc_id = self.__dbo.update_or_create_dbo(model='capacity_vcentermodel',
+                                                    obj={'name': self.vcenter_name},
+                                                    where_param='name'
+                                                    )
+            cl_id = self.update_cl(vc_id)
+            vmsize_ids = {vm_size.vm_size: self.update_vm_size(vm_size) for vm_size in self.vm_sizes}
+            ds_ids = {}
+            for ds in self.datastores + [ds for ds_cl in self.datastore_clusters for ds in ds_cl.datastores]:
+                ds_ids[ds._mo_id] = self.update_datastore(ds, vc_id)
+            dscl_ids = {ds_cl._mo_id: self.update_datastore_cluster(ds_cl, vc_id) for ds_cl in self.datastore_clusters}
+            ha_ids = {ha._mo_id: self.update_ha(ha, vc_id) for ha in self.ha_capacity}
+            vsp_ids = {vsp._mo_id: self.update_vsp(vsp, vc_id) for vsp in self.vsp_capacity}
+
+            self.update_links(cl_id, vmsize_ids, ds_ids, dscl_ids, ha_ids, vsp_ids)
 
         except ConnectionError as ce:
             raise
@@ -200,229 +218,157 @@ class ClusterCapacity(CapacitySuper):
         finally:
             self.__dbo.dispose()
 
-    def update_cl_ds(self, cl_dbo, ds_dbo):
-        self.__dbo.update_or_create_dbo(model='capacity_clustermodel_datastores',
-                                        obj={
-                                            'datastoremodel_id': ds_dbo[0][00],
-                                            'clustermodel_id': cl_dbo[0][00]
-                                        },
-                                        where_param='clustermodel_id',
-                                        skip_date=True)
-
-    def update_cl_dscl(self, cl_dbo, dscl_dbo):
-        self.__dbo.update_or_create_dbo(model='capacity_clustermodel_datastore_clusters',
-                                        obj={
-                                            'datastoreclustermodel_id': dscl_dbo[0][00],
-                                            'clustermodel_id': cl_dbo[0][00]
-                                        },
-                                        where_param='clustermodel_id',
-                                        skip_date=True)
-
-    def update_cl_vsp(self, cl_dbo, vsp_dbo):
-        self.__dbo.update_or_create_dbo(model='capacity_clustermodel_vsp_capacity',
-                                        obj={
-                                            'hostmodel_id': vsp_dbo[0][00],
-                                            'clustermodel_id': cl_dbo[0][00]
-                                        },
-                                        where_param='clustermodel_id',
-                                        skip_date=True)
+    def db_bulk_update_or_create(self):
+        """
+        Writes the cluster like db_update_or_create(), but with one DatabaseAccess.bulk_upsert() per table in a
+        single transaction, taking the ids from the upserts instead of selecting every row again. The vCenter row
+        is written once per run, see DatabaseAccess.upsert_vcenter().
+        Requires the unique keys declared in capacity.schema.CAPACITY_SCHEMA.
+        :return: None
+        """
+        try:
+            if not self.__dbo:
+                raise ConnectionError(
+                    "No connection to a relational database available. "
+                    "Must establish database connection first using setup_database_connection()")
+            vc_id = self.__dbo.upsert_vcenter(self.vcenter_name)
+            cl_id = self.__dbo.bulk_upsert('capacity_clustermodel', [get_row(self)], commit=False)[self._mo_id]
+            vmsize_ids = self.__dbo.bulk_upsert('capacity_vmsizemodel', [get_row(v) for v in self.vm_sizes],
+                                                conflict_columns=('vm_size',), skip_date=True, commit=False)
+            datastores = self.datastores + [ds for ds_cl in self.datastore_clusters for ds in ds_cl.datastores]
+            ds_ids = self._bulk_upsert_records('capacity_datastoremodel', datastores)
+            dscl_ids = self._bulk_upsert_records('capacity_datastoreclustermodel', self.datastore_clusters)
+            ha_ids = self._bulk_upsert_records('capacity_hamodel', self.ha_capacity)
+            vsp_ids = self._bulk_upsert_records('capacity_hostmodel', self.vsp_capacity)
+
+            # every object belongs to a single vCenter
+            for model, column, ids in [('capacity_clustermodel_vcenter', 'clustermodel_id', [cl_id]),
+                                       ('capacity_datastoremodel_vcenter', 'datastoremodel_id', ds_ids.values()),
+                                       ('capacity_datastoreclustermodel_vcenter', 'datastoreclustermodel_id',
+                                        dscl_ids.values()),
+                                       ('capacity_hamodel_vcenter', 'hamodel_id', ha_ids.values()),
+                                       ('capacity_hostmodel_vcenter', 'hostmodel_id', vsp_ids.values())]:
+                self.__dbo.bulk_upsert(model, [{'vcentermodel_id': vc_id, column: i} for i in ids],
+                                       conflict_columns=(column,), skip_date=True, commit=False)
+
+            self.update_links(cl_id, vmsize_ids, ds_ids, dscl_ids, ha_ids, vsp_ids, commit=False)
+            self.__dbo.commit()
 
-    def update_cl_ha(self, cl_dbo, ha_dbo):
-        self.__dbo.update_or_create_dbo(model='capacity_clustermodel_ha_capacity',
-                                        obj={
-                                            'hamodel_id': ha_dbo[0][00],
-                                            'clustermodel_id': cl_dbo[0][00]
-                                        },
-                                        where_param='clustermodel_id',
-                                        skip_date=True)
+        except ConnectionError as ce:
+            raise
+        except BaseException as be:
+            self.__dbo.rollback()
+            raise
+        finally:
+            if self.__dbo:
+                self.__dbo.dispose()
+
+    def _bulk_upsert_records(self, model, records):
+        return self.__dbo.bulk_upsert(model, [get_row(record) for record in records], commit=False)
+
+    def update_links(self, cl_id, vmsize_ids, ds_ids, dscl_ids, ha_ids, vsp_ids, commit=True):
+        """
+        Links the cluster, its hosts and its datastore clusters to exactly their current objects, see
+        DatabaseAccess.sync_links(). Every id map is keyed by the _mo_id of the record, vmsize_ids by vm_size.
+        :param commit: commit the transaction, False leaves the commit to the caller
+        :return: None
+        """
+        links = [
+            ('capacity_clustermodel_datastores', 'clustermodel_id', 'datastoremodel_id',
+             {cl_id: set(ds_ids.values())}),
+            ('capacity_clustermodel_datastore_clusters', 'clustermodel_id', 'datastoreclustermodel_id',
+             {cl_id: set(dscl_ids.values())}),
+            ('capacity_clustermodel_ha_capacity', 'clustermodel_id', 'hamodel_id',
+             {cl_id: set(ha_ids.values())}),
+            ('capacity_clustermodel_vsp_capacity', 'clustermodel_id', 'hostmodel_id',
+             {cl_id: set(vsp_ids.values())}),
+            ('capacity_datastoreclustermodel_datastores', 'datastoreclustermodel_id', 'datastoremodel_id',
+             {dscl_ids[ds_cl._mo_id]: {ds_ids[ds._mo_id] for ds in ds_cl.datastores}
+              for ds_cl in self.datastore_clusters}),
+            ('capacity_clustermodel_vm_sizes', 'clustermodel_id', 'vmsizemodel_id',
+             {cl_id: {vmsize_ids[v.vm_size] for v in self.vm_sizes}}),
+            ('capacity_hostmodel_vm_sizes', 'hostmodel_id', 'vmsizemodel_id',
+             {vsp_ids[vsp._mo_id]: {vmsize_ids[v.vm_size] for v in vsp.vm_sizes} for vsp in self.vsp_capacity}),
+        ]
+        try:
+            for model, parent_column, child_column, model_links in links:
+                self.__dbo.sync_links(model, parent_column, child_column, model_links, commit=False)
+            if commit:
+                self.__dbo.commit()
+        except BaseException:
+            self.__dbo.rollback()
+            raise
 
-    def update_cl_vmsize(self, cl_obj, cl_dbo):
-        dbo_tracker = []
-        for vmsize in cl_obj['vm_sizes']:
-            vmsize_dbo = self.__dbo.get_dbo(model='capacity_vmsizemodel',
-                                            obj=vmsize,
-                                            where_param='vm_size')
-            if not vmsize_dbo:
-                raise ValueError('vmsize-{} dbo not found'.format(vmsize['vm_size']))
-
-            sql_qry = "SELECT * FROM {} WHERE {}=%s AND {}=%s ;".format('capacity_clustermodel_vm_sizes',
-                                                                        'clustermodel_id',
-                                                                        'vmsizemodel_id')
-            self.__dbo.cursor.execute(sql_qry, (cl_dbo[0][00], vmsize_dbo[0][00]))
-            dbo = self.__dbo.cursor.fetchall()
-
-            if not dbo:
-                sql_qry = "INSERT INTO {} (clustermodel_id, vmsizemodel_id) VALUES(%s, %s) ;".format(
-                    'capacity_clustermodel_vm_sizes')
-                self.__dbo.cursor.execute(sql_qry, (cl_dbo[0][00], vmsize_dbo[0][00]))
-                self.__dbo.connection.commit()
-            sql_qry = "SELECT * FROM {} WHERE {}=%s AND {}=%s ;".format('capacity_clustermodel_vm_sizes',
-                                                                        'clustermodel_id',
-                                                                        'vmsizemodel_id')
-            self.__dbo.cursor.execute(sql_qry, (cl_dbo[0][00], vmsize_dbo[0][00]))
-            dbo = self.__dbo.cursor.fetchall()
-            for d in dbo:
-                dbo_tracker.append(d[0])
-        sql_qry = "SELECT * FROM {} WHERE {}=%s ;".format('capacity_clustermodel_vm_sizes',
-                                                          'clustermodel_id')
-        self.__dbo.cursor.execute(sql_qry, (cl_dbo[0][00],))
-        [self.__dbo.remove_dbo(model='capacity_clustermodel_vm_sizes',
-                               obj={'id': d[0]},
-                               where_param='id') for d in self.__dbo.cursor.fetchall() if d[0] not in dbo_tracker]
-
-    def update_vsp_vmsize(self, vsp, vsp_dbo):
-        dbo_tracker = []
-        for vmsize in vsp['vm_sizes']:
-            vmsize_dbo = self.__dbo.get_dbo(model='capacity_vmsizemodel',
-                                            obj=vmsize,
-                                            where_param='vm_size')
-            if not vmsize_dbo:
-                raise ValueError('vmsize-{} dbo not found'.format(vmsize['vm_size']))
-
-            sql_qry = "SELECT * FROM {} WHERE {}=%s AND {}=%s ;".format('capacity_hostmodel_vm_sizes',
-                                                                        'hostmodel_id',
-                                                                        'vmsizemodel_id')
-            self.__dbo.cursor.execute(sql_qry, (vsp_dbo[0][00], vmsize_dbo[0][00]))
-            dbo = self.__dbo.cursor.fetchall()
-
-            if not dbo:
-                sql_qry = "INSERT INTO {} (hostmodel_id, vmsizemodel_id) VALUES(%s, %s) ;".format('capacity_hostmodel_vm_sizes')
-                self.__dbo.cursor.execute(sql_qry, (vsp_dbo[0][00], vmsize_dbo[0][00]))
-                self.__dbo.connection.commit()
-            sql_qry = "SELECT * FROM {} WHERE {}=%s AND {}=%s ;".format('capacity_hostmodel_vm_sizes',
-                                                                        'hostmodel_id',
-                                                                        'vmsizemodel_id')
-            self.__dbo.cursor.execute(sql_qry, (vsp_dbo[0][00], vmsize_dbo[0][00]))
-            dbo = self.__dbo.cursor.fetchall()
-            for d in dbo:
-                dbo_tracker.append(d[0])
-        sql_qry = "SELECT * FROM {} WHERE {}=%s ;".format('capacity_hostmodel_vm_sizes',
-                                                          'hostmodel_id')
-        self.__dbo.cursor.execute(sql_qry, (vsp_dbo[0][00],))
-        [self.__dbo.remove_dbo(model='capacity_hostmodel_vm_sizes',
-                               obj={'id': d[0]},
-                               where_param='id') for d in self.__dbo.cursor.fetchall() if d[0] not in dbo_tracker]
-
-    def update_cl(self, obj):
-        obj.pop('vcenter_name')
-        obj.pop('datastores')
-        obj.pop('datastore_clusters')
-        obj.pop('vsp_capacity')
-        obj.pop('ha_capacity')
-        obj.pop('vm_sizes')
-        obj.pop('_ClusterCapacity__dbo')
-
-        self.__dbo.update_or_create_dbo(model='capacity_clustermodel',
-                                        obj=obj,
-                                        where_param='_mo_id')
-        cl_dbo = self.__dbo.get_dbo(model='capacity_clustermodel',
-                                    obj=obj)
-        vc_dbo = self.__dbo.get_dbo(model='capacity_vcentermodel',
-                                    obj={'name': self.vcenter_name},
-                                    where_param='name')
+    def update_cl(self, vc_id):
+        cl_id = self.__dbo.update_or_create_dbo(model='capacity_clustermodel',
+                                                obj=get_row(self),
+                                                where_param='_mo_id')
         self.__dbo.update_or_create_dbo(model='capacity_clustermodel_vcenter',
                                         obj={
-                                            'vcentermodel_id': vc_dbo[0][00],
-                                            'clustermodel_id': cl_dbo[0][00]
+                                            'vcentermodel_id': vc_id,
+                                            'clustermodel_id': cl_id
                                         },
                                         where_param='clustermodel_id',
                                         skip_date=True)
-        return cl_dbo
-
-    def update_vm_size(self, obj):
-        self.__dbo.update_or_create_dbo(model='capacity_vmsizemodel',
-                                        obj=obj,
-                                        where_param='vm_size',
-                                        skip_date=True)
-
-    def update_vsp(self, obj):
-        obj.pop('vcenter')
-        obj.pop('cluster')
-        obj.pop('_parent_id')
-        obj.pop('virtualmachine')  # Todo Remove this once VirtualMachineCapacity is implemented
-        obj.pop('vm_sizes')
-
-        self.__dbo.update_or_create_dbo(model='capacity_hostmodel',
-                                        obj=obj,
-                                        where_param='_mo_id')
-        vsp_dbo = self.__dbo.get_dbo(model='capacity_hostmodel',
-                                     obj=obj)
-        vc_dbo = self.__dbo.get_dbo(model='capacity_vcentermodel',
-                                    obj={'name': self.vcenter_name},
-                                    where_param='name')
+        return cl_id
+
+    def update_vm_size(self, vm_size):
+        return self.__dbo.update_or_create_dbo(model='capacity_vmsizemodel',
+                                               obj=get_row(vm_size),
+                                               where_param='vm_size',
+                                               skip_date=True)
+
+    def update_vsp(self, vsp, vc_id):
+        vsp_id = self.__dbo.update_or_create_dbo(model='capacity_hostmodel',
+                                                 obj=get_row(vsp),
+                                                 where_param='_mo_id')
         self.__dbo.update_or_create_dbo(model='capacity_hostmodel_vcenter',
                                         obj={
-                                            'vcentermodel_id': vc_dbo[0][00],
-                                            'hostmodel_id': vsp_dbo[0][00]
+                                            'vcentermodel_id': vc_id,
+                                            'hostmodel_id': vsp_id
                                         },
                                         where_param='hostmodel_id',
                                         skip_date=True)
-        return vsp_dbo
-
-    def update_ha(self, obj):
-        self.__dbo.update_or_create_dbo(model='capacity_hamodel',
-                                        obj=obj,
-                                        where_param='_mo_id')
-        ha_dbo = self.__dbo.get_dbo(model='capacity_hamodel',
-                                    obj=obj)
-        vc_dbo = self.__dbo.get_dbo(model='capacity_vcentermodel',
-                                    obj={'name': self.vcenter_name},
-                                    where_param='name')
+        return vsp_id
+
+    def update_ha(self, ha, vc_id):
+        ha_id = self.__dbo.update_or_create_dbo(model='capacity_hamodel',
+                                                obj=get_row(ha),
+                                                where_param='_mo_id')
         self.__dbo.update_or_create_dbo(model='capacity_hamodel_vcenter',
                                         obj={
-                                            'vcentermodel_id': vc_dbo[0][00],
-                                            'hamodel_id': ha_dbo[0][00]
+                                            'vcentermodel_id': vc_id,
+                                            'hamodel_id': ha_id
                                         },
                                         where_param='hamodel_id',
                                         skip_date=True)
-        return ha_dbo
-
-    def update_datastore(self, obj):
-        obj.pop('_mo_type')
-        self.__dbo.update_or_create_dbo(model='capacity_datastoremodel',
-                                        obj=obj,
-                                        where_param='_mo_id')
-        ds_dbo = self.__dbo.get_dbo(model='capacity_datastoremodel',
-                                    obj=obj)
-        vc_dbo = self.__dbo.get_dbo(model='capacity_vcentermodel',
-                                    obj={'name': self.vcenter_name},
-                                    where_param='name')
+        return ha_id
+
+    def update_datastore(self, ds, vc_id):
+        ds_id = self.__dbo.update_or_create_dbo(model='capacity_datastoremodel',
+                                                obj=get_row(ds),
+                                                where_param='_mo_id')
         self.__dbo.update_or_create_dbo(model='capacity_datastoremodel_vcenter',
                                         obj={
-                                            'vcentermodel_id': vc_dbo[0][00],
-                                            'datastoremodel_id': ds_dbo[0][00]
+                                            'vcentermodel_id': vc_id,
+                                            'datastoremodel_id': ds_id
                                         },
                                         where_param='datastoremodel_id',
                                         skip_date=True)
-        return ds_dbo
-
-    def update_datastore_cluster(self, obj):
-        obj.pop('_mo_type')
-        self.__dbo.update_or_create_dbo(model='capacity_datastoreclustermodel',
-                                        obj=obj,
-                                        where_param='_mo_id')
-        dscl_dbo = self.__dbo.get_dbo(model='capacity_datastoreclustermodel',
-                                      obj=obj)
-        vc_dbo = self.__dbo.get_dbo(model='capacity_vcentermodel',
-                                    obj={'name': self.vcenter_name},
-                                    where_param='name')
-        self.__dbo.update_or_create_dbo(model='capacity_datastoreclustermodel_vcenter',
-                                        obj={
-                                            'vcentermodel_id': vc_dbo[0][00],
-                                            'datastoreclustermodel_id': dscl_dbo[0][00]
-                                        },
-                                        where_param='datastoreclustermodel_id',
-                                        skip_date=True)
-        return dscl_dbo
+        return ds_id
 
-    def update_ds_dscl(self, ds_dbo, dscl_dbo):
-        self.__dbo.update_or_create_dbo(model='capacity_datastoreclustermodel_datastores',
+    def update_datastore_cluster(self, ds_cl, vc_id):
+        dscl_id = self.__dbo.update_or_create_dbo(model='capacity_datastoreclustermodel',
+                                                  obj=get_row(ds_cl),
+                                                  where_param='_mo_id')
+        self.__dbo.update_or_create_dbo(model='capacity_datastoreclustermodel_vcenter',
                                         obj={
-                                            'datastoremodel_id': ds_dbo[0][00],
-                                            'datastoreclustermodel_id': dscl_dbo[0][00]
+                                            'vcentermodel_id': vc_id,
+                                            'datastoreclustermodel_id': dscl_id
                                         },
                                         where_param='datastoreclustermodel_id',
                                         skip_date=True)
+        return dscl_id
 
     @staticmethod
     def _is_lowest_level(obj):
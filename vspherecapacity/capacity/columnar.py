@@ -0,0 +1,208 @@
+from vspherecapacity.capacity.byteconversion import ByteFactors
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _safe_divide(x, y):
+    # element wise x / y with 0.0 wherever y is 0, as _safe_division() does for single values
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    result = np.zeros(np.broadcast(x, y).shape)
+    np.divide(x, y, out=result, where=y != 0)
+    return result
+
+
+def _group_sum(values, groups, n_groups):
+    return np.bincount(groups, weights=values, minlength=n_groups)[:n_groups]
+
+
+def _group_min_max(values, groups, n_groups):
+    """
+    :return: [min, max] of values per group, 0 for groups without values
+    """
+    low = np.zeros(n_groups)
+    high = np.zeros(n_groups)
+    if len(values):
+        order = np.argsort(groups, kind='stable')
+        sorted_groups = groups[order]
+        sorted_values = values[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1])))
+        present = sorted_groups[starts]
+        low[present] = np.minimum.reduceat(sorted_values, starts)
+        high[present] = np.maximum.reduceat(sorted_values, starts)
+    return [low, high]
+
+
+def _vm_statistics(vm_cpu, vm_mem, groups, n_groups):
+    """
+    :return: dict of vm_low/avg/max_cpu/mem per group over every VM of the group, 0 for groups without VMs
+    """
+    counts = np.bincount(groups, minlength=n_groups)[:n_groups]
+    low_cpu, max_cpu = _group_min_max(vm_cpu, groups, n_groups)
+    low_mem, max_mem = _group_min_max(vm_mem, groups, n_groups)
+    return {
+        'vm_low_cpu': low_cpu,
+        'vm_low_mem': low_mem,
+        'vm_avg_cpu': np.ceil(_safe_divide(_group_sum(vm_cpu, groups, n_groups), counts)),
+        'vm_avg_mem': np.ceil(_safe_divide(_group_sum(vm_mem, groups, n_groups), counts)),
+        'vm_max_cpu': max_cpu,
+        'vm_max_mem': max_mem,
+    }
+
+
+class ColumnarCapacity(object):
+    """
+    Optional numpy engine for the host, cluster and HA math of VsphereCapacity and ClusterCapacity.
+    Hosts and VMs of an Inventory are held as columns with the index of their host and cluster, and every
+    metric is computed with vectorized reductions, so the whole estate is recalculated in milliseconds.
+    The columns may be changed before calculate() for what-if calculations, e.g. zeroing host_cpu_total
+    of the hosts to be retired or adding VMs with add_vms().
+    Experimental: it is only run by vspherecapacity.benchmark and for what-if calculations, the collection
+    and the rows written to the capacity database always come from ClusterCapacity. Requires numpy.
+    """
+
+    def __init__(self, inventory):
+        """
+        :param inventory: Inventory snapshot
+        """
+        if np is None:
+            raise ImportError('numpy is required for ColumnarCapacity')
+        clusters = inventory.get_by_type('ClusterComputeResource')
+        self.cluster_ids = [cl['_moId'] for cl in clusters]
+        self.cluster_names = [cl['name'] for cl in clusters]
+        # vmhost_count is taken from ClusterComputeResource.host, like ClusterCapacity does
+        self.cluster_host_count = np.array([len(cl.get('host') or []) for cl in clusters], dtype=float)
+
+        host_ids = []
+        host_cluster = []
+        for index, cl in enumerate(clusters):
+            for host in inventory.get_objects(cl.get('host')):
+                host_ids.append(host['_moId'])
+                host_cluster.append(index)
+        hosts = [inventory.get(mo_id) for mo_id in host_ids]
+        self.host_ids = host_ids
+        self.host_cluster = np.array(host_cluster, dtype=np.intp)
+        self.host_cpu_total = np.array([h['hardware.cpuInfo.numCpuCores'] for h in hosts], dtype=float)
+        self.host_mem_total = np.array([float(h.get('hardware.memorySize') or 0) for h in hosts]) / \
+            ByteFactors.KB_to_GB
+        self.host_mem_granted = np.array([float(h.get('summary.quickStats.overallMemoryUsage') or 0)
+                                          for h in hosts]) / ByteFactors.MB_to_GB
+
+        vm_host = []
+        vm_cpu = []
+        vm_mem = []
+        vm_powered_on = []
+        for index, host in enumerate(hosts):
+            for vm in inventory.get_objects(host.get('vm')):
+                vm_host.append(index)
+                vm_cpu.append(vm.get('config.hardware.numCPU') or 0)
+                vm_mem.append(float(vm.get('config.hardware.memoryMB') or 0))
+                vm_powered_on.append(vm.get('runtime.powerState') == 'poweredOn')
+        self.vm_host = np.array(vm_host, dtype=np.intp)
+        self.vm_cpu = np.array(vm_cpu, dtype=float)
+        self.vm_mem = np.array(vm_mem, dtype=float) / ByteFactors.MB_to_GB
+        self.vm_powered_on = np.array(vm_powered_on, dtype=bool)
+
+    def add_vms(self, host_index, vcpu, mem_gb, count=1):
+        """
+        Adds count powered on VMs of one size to a host, for what-if calculations
+        :param host_index: index of the host in host_ids
+        :param vcpu: number of vCPUs
+        :param mem_gb: memory in GB
+        :param count: number of VMs
+        :return: None
+        """
+        self.vm_host = np.concatenate((self.vm_host, np.full(count, host_index, dtype=np.intp)))
+        self.vm_cpu = np.concatenate((self.vm_cpu, np.full(count, vcpu, dtype=float)))
+        self.vm_mem = np.concatenate((self.vm_mem, np.full(count, mem_gb, dtype=float)))
+        self.vm_powered_on = np.concatenate((self.vm_powered_on, np.ones(count, dtype=bool)))
+
+    def calculate_hosts(self):
+        """
+        :return: dict of VsphereCapacity attribute name to array with a value per host of host_ids
+        """
+        n_hosts = len(self.host_ids)
+        vm_host = self.vm_host[self.vm_powered_on]
+        vm_cpu = self.vm_cpu[self.vm_powered_on]
+        vm_mem = self.vm_mem[self.vm_powered_on]
+        cpu_used = _group_sum(vm_cpu, vm_host, n_hosts)
+        mem_used = _group_sum(vm_mem, vm_host, n_hosts)
+        hosts = {
+            'cpu_total': self.host_cpu_total,
+            'mem_total': self.host_mem_total,
+            'mem_granted': self.host_mem_granted,
+            'cpu_used': cpu_used,
+            'mem_used': mem_used,
+            'vm_count': np.bincount(vm_host, minlength=n_hosts)[:n_hosts],
+            'cpu_over_commit': _safe_divide(cpu_used, self.host_cpu_total),
+            'mem_over_commit': _safe_divide(mem_used, self.host_mem_total),
+            'mem_granted_percent': _safe_divide(self.host_mem_granted, self.host_mem_total) * 100,
+        }
+        hosts['cpu_percent_used'] = hosts['cpu_over_commit'] * 100
+        hosts['mem_percent_used'] = hosts['mem_over_commit'] * 100
+        hosts.update(_vm_statistics(vm_cpu, vm_mem, vm_host, n_hosts))
+        return hosts
+
+    def calculate_clusters(self, hosts=None):
+        """
+        :param hosts: result of calculate_hosts(), calculated when not given
+        :return: dict of ClusterCapacity attribute name to array with a value per cluster of cluster_ids
+        """
+        if hosts is None:
+            hosts = self.calculate_hosts()
+        n_clusters = len(self.cluster_ids)
+        groups = self.host_cluster
+        clusters = {
+            'vmhost_count': self.cluster_host_count,
+            'raw_cpu_total': _group_sum(hosts['cpu_total'], groups, n_clusters),
+            'raw_mem_total': _group_sum(hosts['mem_total'], groups, n_clusters),
+            'raw_cpu_used': _group_sum(hosts['cpu_used'], groups, n_clusters),
+            'raw_mem_used': _group_sum(hosts['mem_used'], groups, n_clusters),
+            'raw_avg_cpu_over_commit': _safe_divide(_group_sum(hosts['cpu_over_commit'], groups, n_clusters),
+                                                    self.cluster_host_count),
+            'raw_avg_mem_over_commit': _safe_divide(_group_sum(hosts['mem_over_commit'], groups, n_clusters),
+                                                    self.cluster_host_count),
+        }
+        clusters['raw_cpu_over_commit'] = _safe_divide(clusters['raw_cpu_used'], clusters['raw_cpu_total'])
+        clusters['raw_mem_over_commit'] = _safe_divide(clusters['raw_mem_used'], clusters['raw_mem_total'])
+        vm_cluster = groups[self.vm_host[self.vm_powered_on]]
+        clusters.update(_vm_statistics(self.vm_cpu[self.vm_powered_on], self.vm_mem[self.vm_powered_on],
+                                       vm_cluster, n_clusters))
+        return clusters
+
+    def calculate_ha(self, clusters=None, ha_factor=1):
+        """
+        :param clusters: result of calculate_clusters(), calculated when not given
+        :param ha_factor: number of host failures to tolerate
+        :return: dict of HACapacity attribute name to array with a value per cluster of cluster_ids
+        """
+        if clusters is None:
+            clusters = self.calculate_clusters()
+        ha = {
+            'ha_reserved_cpu': _safe_divide(clusters['raw_cpu_total'], clusters['vmhost_count']) * ha_factor,
+            'ha_reserved_mem': _safe_divide(clusters['raw_mem_total'], clusters['vmhost_count']) * ha_factor,
+        }
+        ha['ha_usable_cpu_total'] = clusters['raw_cpu_total'] - ha['ha_reserved_cpu']
+        ha['ha_usable_mem_total'] = clusters['raw_mem_total'] - ha['ha_reserved_mem']
+        ha['ha_cpu_over_commit'] = _safe_divide(clusters['raw_cpu_used'], ha['ha_usable_cpu_total'])
+        ha['ha_mem_over_commit'] = _safe_divide(clusters['raw_mem_used'], ha['ha_usable_mem_total'])
+        ha['ha_cpu_percent_used'] = ha['ha_cpu_over_commit'] * 100
+        ha['ha_mem_percent_used'] = ha['ha_mem_over_commit'] * 100
+        return ha
+
+    def calculate(self, ha_factors=(2, 1)):
+        """
+        Calculates every host, cluster and HA metric
+        :param ha_factors: HA factors to calculate
+        :return: dict with 'hosts', 'clusters' and 'ha', the latter a dict of ha_factor to calculate_ha()
+        """
+        hosts = self.calculate_hosts()
+        clusters = self.calculate_clusters(hosts)
+        return {
+            'hosts': hosts,
+            'clusters': clusters,
+            'ha': {ha_factor: self.calculate_ha(clusters, ha_factor) for ha_factor in ha_factors},
+        }
@@ -1,41 +1,73 @@
-
-from pyVmomi import vim
+import threading
 from vspherecapacity.capacity import CapacitySuper
 from vspherecapacity.capacity.byteconversion import ByteFactors
 
 
 class DatastoreCapacity(CapacitySuper):
+    fields = (
+        ('name', str),
+        ('_mo_id', str),
+        ('_mo_type', str),
+        ('total_capacity', float),
+        ('total_free_committed', float),
+        ('total_used', float),
+        ('total_free_actual', float),
+        ('vm_total', int),
+        ('vm_poweredon_count', int),
+        ('vm_template_count', int),
+        ('vm_poweredoff_count', int),
+    )
+    __slots__ = tuple(name for name, _ in fields)
+    non_columns = ('_mo_type',)
 
-    def __init__(self, mo):
-        self.name = mo.name
-        self._mo_id = mo._moId
+    def __init__(self, mo, inventory):
+        self.name = mo['name']
+        self._mo_id = mo['_moId']
         self._mo_type = 'Datastore'
-        self.total_capacity = float(mo.summary.capacity or 0) / ByteFactors.KB_to_TB
-        self.total_free_committed = float(mo.summary.freeSpace or 0) / ByteFactors.KB_to_TB
-
-        if hasattr(mo.summary, 'uncommitted'):
-            self.total_used = ((self.total_capacity - self.total_free_committed) + (float(
-                mo.summary.uncommitted or 0) / ByteFactors.KB_to_TB))
-        else:
-            self.total_used = (self.total_capacity - self.total_free_committed)
+        self.total_capacity = float(mo.get('summary.capacity') or 0) / ByteFactors.KB_to_TB
+        self.total_free_committed = float(mo.get('summary.freeSpace') or 0) / ByteFactors.KB_to_TB
+        self.total_used = ((self.total_capacity - self.total_free_committed) + (float(
+            mo.get('summary.uncommitted') or 0) / ByteFactors.KB_to_TB))
 
         # There may be files on the datastore that aren't in vcenter. Vcenter reports provisioned data
         # and these types of files are 'uncommitted' storage. So the actual free space and used space must
         # take into account the uncommitted space.
         self.total_free_actual = self.total_capacity - self.total_used
-        self.vm_total = len(mo.vm)
-        self.vm_poweredon_count = len([vm for vm in mo.vm if vm.runtime.powerState == 'poweredOn'])
-        self.vm_template_count = len([vm for vm in mo.vm if vm.config.template])
+        self.vm_total = 0
+        self.vm_poweredon_count = 0
+        self.vm_template_count = 0
+        for vm in inventory.get_objects(mo.get('vm')):
+            self.vm_total += 1
+            if vm.get('runtime.powerState') == 'poweredOn':
+                self.vm_poweredon_count += 1
+            if vm.get('config.template'):
+                self.vm_template_count += 1
         self.vm_poweredoff_count = self.vm_total - (self.vm_poweredon_count + self.vm_template_count)
 
 
 class DatastoreClusterCapacity(CapacitySuper):
+    fields = (
+        ('name', str),
+        ('_mo_type', str),
+        ('_mo_id', str),
+        ('total_capacity', float),
+        ('total_free_committed', float),
+        ('total_free_actual', float),
+        ('total_used', float),
+        ('datastores', list),
+        ('vm_total', int),
+        ('vm_poweredon_count', int),
+        ('vm_template_count', int),
+        ('vm_poweredoff_count', int),
+    )
+    __slots__ = tuple(name for name, _ in fields)
+    non_columns = ('_mo_type',)
 
-    def __init__(self, mo):
-        self.name = mo.name
+    def __init__(self, mo, inventory, vcenter_name=None, storage_cache=None):
+        self.name = mo['name']
         self._mo_type = 'DatastoreCluster'
-        self._mo_id = mo._moId
-        self.total_capacity = float(mo.summary.capacity or 0) / ByteFactors.KB_to_TB
+        self._mo_id = mo['_moId']
+        self.total_capacity = float(mo.get('summary.capacity') or 0) / ByteFactors.KB_to_TB
         # There may be files on the datastore that aren't in vcenter. Vcenter reports provisioned or 'committed'
         # data and these types of files are 'uncommitted' storage. So the actual free space and used space must
         # take into account the uncommitted space.
@@ -48,10 +80,14 @@ class DatastoreClusterCapacity(CapacitySuper):
         self.vm_template_count = 0
         self.vm_poweredoff_count = 0
 
-        self._get_storage_usage(mo)
+        self._get_storage_usage(mo, inventory, vcenter_name=vcenter_name, storage_cache=storage_cache)
 
-    def _get_storage_usage(self, mo):
-        self.datastores = [DatastoreCapacity(ds) for ds in mo.childEntity]
+    def _get_storage_usage(self, mo, inventory, vcenter_name=None, storage_cache=None):
+        if storage_cache is not None:
+            self.datastores = [storage_cache.get_datastore(vcenter_name, ds, inventory)
+                               for ds in inventory.get_objects(mo.get('childEntity'))]
+        else:
+            self.datastores = [DatastoreCapacity(ds, inventory) for ds in inventory.get_objects(mo.get('childEntity'))]
         for ds in self.datastores:
             self.total_free_committed += ds.total_free_committed
             self.total_free_actual += ds.total_free_actual
@@ -60,3 +96,57 @@ class DatastoreClusterCapacity(CapacitySuper):
             self.vm_poweredon_count += ds.vm_poweredon_count
             self.vm_template_count += ds.vm_template_count
             self.vm_poweredoff_count += ds.vm_poweredoff_count
+
+
+class StorageCapacityCache(object):
+    """
+    Run-scoped cache of DatastoreCapacity and DatastoreClusterCapacity keyed by (vCenter, moId), so a datastore
+    or StoragePod mounted by many clusters is only calculated once and the same object is shared by every
+    ClusterCapacity. The cache must not outlive the inventory snapshot it was filled from.
+    """
+
+    def __init__(self):
+        self.__capacity = {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.__capacity)
+
+    def _get(self, vcenter_name, mo, create):
+        key = (vcenter_name, mo['_moId'])
+        capacity = self.__capacity.get(key, None)
+        if capacity is None:
+            capacity = create()
+            with self.__lock:
+                # another thread may have calculated it in the meantime, keep the first one
+                capacity = self.__capacity.setdefault(key, capacity)
+                self.misses += 1
+        else:
+            self.hits += 1
+        return capacity
+
+    def get_datastore(self, vcenter_name, mo, inventory):
+        """
+        :param vcenter_name: vCenter the datastore belongs to
+        :param mo: Datastore object dict
+        :param inventory: Inventory holding mo
+        :return: DatastoreCapacity
+        """
+        return self._get(vcenter_name, mo, lambda: DatastoreCapacity(mo, inventory))
+
+    def get_datastore_cluster(self, vcenter_name, mo, inventory):
+        """
+        :param vcenter_name: vCenter the datastore cluster belongs to
+        :param mo: StoragePod object dict
+        :param inventory: Inventory holding mo
+        :return: DatastoreClusterCapacity
+        """
+        return self._get(vcenter_name, mo, lambda: DatastoreClusterCapacity(mo, inventory,
+                                                                             vcenter_name=vcenter_name,
+                                                                             storage_cache=self))
+
+    def clear(self):
+        with self.__lock:
+            self.__capacity = {}
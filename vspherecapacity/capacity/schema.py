@@ -0,0 +1,219 @@
+import hashlib
+import psycopg2
+from log.setup import addClassLogger
+from vspherecapacity.capacity import NATURAL_KEYS
+
+# PostgreSQL truncates longer identifiers
+MAX_IDENTIFIER_LENGTH = 63
+
+
+class TableSchema(object):
+    """
+    Unique keys and indexes a capacity table is expected to have. The tables and their columns are created by the
+    migrations of the capacity web application, this only declares what the collector looks rows up by.
+    """
+
+    def __init__(self, name, unique=(), indexes=()):
+        """
+        :param name: table name
+        :param unique: column tuples that must be unique, each usable as an ON CONFLICT target
+        :param indexes: column tuples that must be indexed
+        """
+        self.name = name
+        self.unique = [tuple(columns) for columns in unique]
+        self.indexes = [tuple(columns) for columns in indexes]
+
+
+def _get_capacity_schema():
+    tables = []
+    # written by update_or_create_dbo and bulk_upsert, decommissioned on date_modified
+    for model, key in NATURAL_KEYS.items():
+        indexes = [] if model == 'capacity_vmsizemodel' else [('date_modified',)]
+        tables.append(TableSchema(model, unique=[(key,)], indexes=indexes))
+    # every object belongs to a single vCenter
+    for model in ['clustermodel', 'hostmodel', 'hamodel', 'datastoremodel', 'datastoreclustermodel']:
+        tables.append(TableSchema('capacity_{}_vcenter'.format(model),
+                                  unique=[('{}_id'.format(model),)],
+                                  indexes=[('vcentermodel_id',)]))
+    # synchronized by DatabaseAccess.sync_links, the unique key also indexes the parent column
+    for model, parent_column, child_column in [
+            ('capacity_clustermodel_datastores', 'clustermodel_id', 'datastoremodel_id'),
+            ('capacity_clustermodel_datastore_clusters', 'clustermodel_id', 'datastoreclustermodel_id'),
+            ('capacity_clustermodel_ha_capacity', 'clustermodel_id', 'hamodel_id'),
+            ('capacity_clustermodel_vsp_capacity', 'clustermodel_id', 'hostmodel_id'),
+            ('capacity_clustermodel_vm_sizes', 'clustermodel_id', 'vmsizemodel_id'),
+            ('capacity_datastoreclustermodel_datastores', 'datastoreclustermodel_id', 'datastoremodel_id'),
+            ('capacity_hostmodel_vm_sizes', 'hostmodel_id', 'vmsizemodel_id')]:
+        tables.append(TableSchema(model, unique=[(parent_column, child_column)], indexes=[(child_column,)]))
+    return tables
+
+
+CAPACITY_SCHEMA = _get_capacity_schema()
+
+
+def get_index_name(table, columns, unique=False):
+    """
+    :return: name of the index the SchemaManager creates on columns of table
+    """
+    name = '{}_{}_{}'.format(table, '_'.join(columns), 'uniq' if unique else 'idx')
+    if len(name) > MAX_IDENTIFIER_LENGTH:
+        digest = hashlib.md5(name.encode('utf8')).hexdigest()[:8]
+        name = '{}_{}'.format(name[:MAX_IDENTIFIER_LENGTH - len(digest) - 1], digest)
+    return name
+
+
+class SchemaReport(object):
+    """
+    Result of SchemaManager.check() and SchemaManager.ensure(). Unique keys and indexes are (table, columns)
+    tuples.
+    """
+
+    def __init__(self):
+        self.unique = []
+        self.missing_tables = []
+        self.missing_unique = []
+        self.missing_indexes = []
+        self.created = []
+        self.failed = []
+
+    def is_complete(self):
+        """
+        :return: True when nothing is missing or every missing unique key and index was created
+        """
+        return not self.missing_tables and not self.failed and \
+            len(self.created) == len(self.missing_unique) + len(self.missing_indexes)
+
+    def has_unique_key(self, table, columns):
+        """
+        :return: True when table has the declared unique key on columns, either found by check() or created
+        """
+        return (table, tuple(columns)) in self.unique
+
+    def get_lines(self):
+        lines = ['Missing table {}'.format(table) for table in self.missing_tables]
+        lines += ['Missing unique key {} ({})'.format(table, ', '.join(columns))
+                  for table, columns in self.missing_unique]
+        lines += ['Missing index {} ({})'.format(table, ', '.join(columns)) for table, columns in self.missing_indexes]
+        lines += ['Created {}'.format(name) for name in self.created]
+        lines += ['Failed to create {}: {}'.format(name, error) for name, error in self.failed]
+        return lines
+
+
+@addClassLogger
+class SchemaManager(object):
+    """
+    Checks the live capacity database against the declared unique keys and indexes and creates the missing ones.
+    An existing valid index counts when it starts with the declared columns, an existing unique key only when it
+    is a unique index on exactly the declared columns, as ON CONFLICT requires. Missing tables are only reported.
+    """
+
+    def __init__(self, dba, tables=None):
+        """
+        :param dba: DatabaseAccess of the capacity database
+        :param tables: list of TableSchema, defaults to CAPACITY_SCHEMA
+        """
+        self.dba = dba
+        self.tables = tables if tables is not None else CAPACITY_SCHEMA
+
+    def get_tables(self):
+        """
+        :return: set of the table names of the current schema
+        """
+        sql_qry = "SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema() ;"
+        self.dba.cursor.execute(sql_qry)
+        tables = set(row[0] for row in self.dba.cursor.fetchall())
+        self.dba.connection.rollback()
+        return tables
+
+    def get_indexes(self):
+        """
+        :return: dict of table name to a list of [unique, column tuple] of each of its indexes
+        """
+        sql_qry = """SELECT t.relname, ix.indisunique, array_agg(a.attname ORDER BY k.n)
+            FROM pg_index ix
+                JOIN pg_class t ON t.oid = ix.indrelid
+                JOIN pg_namespace ns ON ns.oid = t.relnamespace
+                CROSS JOIN LATERAL unnest(ix.indkey) WITH ORDINALITY AS k(attnum, n)
+                JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+            WHERE ns.nspname = current_schema() AND ix.indisvalid
+            GROUP BY t.relname, ix.indexrelid, ix.indisunique ;"""
+        self.dba.cursor.execute(sql_qry)
+        indexes = {}
+        for table, unique, columns in self.dba.cursor.fetchall():
+            indexes.setdefault(table, []).append([unique, tuple(columns)])
+        self.dba.connection.rollback()
+        return indexes
+
+    def check(self):
+        """
+        :return: SchemaReport of the missing tables, unique keys and indexes
+        """
+        report = SchemaReport()
+        tables = self.get_tables()
+        indexes = self.get_indexes()
+        for table in self.tables:
+            if table.name not in tables:
+                report.missing_tables.append(table.name)
+                continue
+            existing = indexes.get(table.name, [])
+            for columns in table.unique:
+                if any(unique and index_columns == columns for unique, index_columns in existing):
+                    report.unique.append((table.name, columns))
+                else:
+                    report.missing_unique.append((table.name, columns))
+            for columns in table.indexes:
+                if not any(index_columns[:len(columns)] == columns for _, index_columns in existing):
+                    report.missing_indexes.append((table.name, columns))
+        return report
+
+    def drop_index(self, name):
+        """
+        Drops the index name if it exists, on a connection in autocommit
+        :return: None
+        """
+        try:
+            self.dba.cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS {} ;".format(name))
+        except psycopg2.Error as e:
+            self.__log.warning('Failed to drop index {}: {}'.format(name, str(e).strip()))
+
+    def ensure(self, create=True):
+        """
+        Creates every missing unique key and index with CREATE INDEX CONCURRENTLY, so the collectors and the web
+        application keep writing the tables while the index is built. The connection is switched to autocommit
+        for this, as CONCURRENTLY may not run in a transaction, and each index fails on its own, e.g. a unique key
+        on a table that already holds duplicates. The invalid index a failed build leaves behind is dropped so the
+        next run builds it again. The report is logged and kept on the ConnectionPool of dba.
+        :param create: create what is missing, False only reports it
+        :return: SchemaReport of what was missing, created and failed
+        """
+        report = self.check()
+        missing = [(table, columns, True) for table, columns in report.missing_unique] + \
+                  [(table, columns, False) for table, columns in report.missing_indexes]
+        if not create:
+            missing = []
+        if missing:
+            self.dba.connection.autocommit = True
+        try:
+            for table, columns, unique in missing:
+                name = get_index_name(table, columns, unique=unique)
+                sql_qry = "CREATE {}INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({}) ;".format(
+                    'UNIQUE ' if unique else '', name, table, ', '.join(columns))
+                try:
+                    self.dba.cursor.execute(sql_qry)
+                    report.created.append(name)
+                    if unique:
+                        report.unique.append((table, columns))
+                except psycopg2.Error as e:
+                    report.failed.append((name, str(e).strip()))
+                    self.drop_index(name)
+        finally:
+            if missing:
+                self.dba.connection.autocommit = False
+        # DatabaseAccess.sync_links() only uses ON CONFLICT when the report has the unique key
+        self.dba.pool.schema_report = report
+        for line in report.get_lines():
+            if line.startswith('Failed') or line.startswith('Missing table'):
+                self.__log.warning(line)
+            else:
+                self.__log.info(line)
+        return report
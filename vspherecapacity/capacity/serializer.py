@@ -0,0 +1,23 @@
+from functools import lru_cache
+
+
+# Rows are read straight from the capacity records, so serializing never copies or changes a record and may be
+# done any number of times from any thread.
+@lru_cache(maxsize=None)
+def get_columns(record_type):
+    """
+    The columns of a record kind are its fields in declaration order, except the lists, which are stored in
+    the join tables, and the fields the kind declares in non_columns.
+    :param record_type: capacity record class, e.g. VsphereCapacity
+    :return: tuple of the column names written to the table of record_type
+    """
+    return tuple(name for name, field_type in record_type.schema().items()
+                 if field_type is not list and name not in record_type.non_columns)
+
+
+def get_row(record):
+    """
+    :param record: capacity record, e.g. VsphereCapacity for capacity_hostmodel
+    :return: new dict of column name to value
+    """
+    return {column: getattr(record, column) for column in get_columns(type(record))}
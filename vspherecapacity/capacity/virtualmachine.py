@@ -1,8 +1,13 @@
-
+import math
 from vspherecapacity.capacity import CapacitySuper
 
 
 class VmSize(CapacitySuper):
+    fields = (
+        ('vm_size', str),
+        ('_mo_id', str),
+    )
+    __slots__ = tuple(name for name, _ in fields)
 
     def __init__(self, vm_size):
         self.vm_size = vm_size
@@ -10,3 +15,78 @@ class VmSize(CapacitySuper):
 
     def __str__(self):
         return self.vm_size
+
+    def __eq__(self, other):
+        return isinstance(other, VmSize) and self.vm_size == other.vm_size
+
+    def __hash__(self):
+        return hash(self.vm_size)
+
+
+# every VmSize of the process, so hosts and clusters with the same size share one object
+_vm_sizes = {}
+
+
+def get_vm_size(vcpu, mem_gb):
+    """
+    :param vcpu: number of vCPUs
+    :param mem_gb: memory in GB
+    :return: the interned VmSize of vcpu x mem_gb
+    """
+    key = (vcpu, mem_gb)
+    vm_size = _vm_sizes.get(key, None)
+    if vm_size is None:
+        vm_size = _vm_sizes.setdefault(key, VmSize('{}x{}'.format(vcpu, mem_gb)))
+    return vm_size
+
+
+class VmSizeHistogram(object):
+    """
+    Number of VMs per (vCPU, memory GB) size. The histograms of hosts merge into the histogram of their
+    cluster, so statistics are weighted by the number of VMs of each size rather than taken over the
+    distinct sizes.
+    """
+    __slots__ = ('counts',)
+
+    def __init__(self):
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, vcpu, mem_gb, count=1):
+        key = (vcpu, mem_gb)
+        self.counts[key] = self.counts.get(key, 0) + count
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram to this one
+        :param other: VmSizeHistogram
+        :return: self
+        """
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        return self
+
+    @property
+    def vm_count(self):
+        return sum(self.counts.values())
+
+    def get_vm_sizes(self):
+        """
+        :return: list of the interned VmSize of every size, in the order the sizes were first added
+        """
+        return [get_vm_size(vcpu, mem_gb) for vcpu, mem_gb in self.counts]
+
+    def get_statistics(self):
+        """
+        :return: [low_cpu, low_mem, avg_cpu, avg_mem, max_cpu, max_mem] over every VM, all 0 without VMs
+        """
+        if not self.counts:
+            return [0, 0, 0, 0, 0, 0]
+        vm_count = self.vm_count
+        cpus = [vcpu for vcpu, _ in self.counts]
+        mems = [mem_gb for _, mem_gb in self.counts]
+        avg_cpu = math.fsum(vcpu * count for (vcpu, _), count in self.counts.items()) / vm_count
+        avg_mem = math.fsum(mem_gb * count for (_, mem_gb), count in self.counts.items()) / vm_count
+        return [min(cpus), min(mems), avg_cpu, avg_mem, max(cpus), max(mems)]
@@ -1,40 +1,74 @@
 
 import math
-import statistics
-from vspherecapacity.capacity import CapacitySuper
-from vspherecapacity.capacity.virtualmachine import VmSize
+from datetime import date
+from vspherecapacity.capacity import CapacitySuper, _safe_division
+from vspherecapacity.capacity.virtualmachine import VmSizeHistogram
 from vspherecapacity.capacity.byteconversion import ByteFactors
 
 
-def avg(lst):
-    return sum(lst) / len(lst)
-
-
 class VsphereCapacity(CapacitySuper):
 
     # MB_FACTOR = 1048576
     # GB_FACTOR = 1073741824
+    fields = (
+        ('vcenter', str),
+        ('cluster', str),
+        ('_parent_id', str),
+        ('name', str),
+        ('_mo_id', str),
+        ('cpu_total', int),
+        ('cpu_used', int),
+        ('cpu_percent_used', float),
+        ('cpu_over_commit', float),
+        ('mem_total', float),
+        ('mem_granted', float),
+        ('mem_granted_percent', float),
+        ('mem_used', float),
+        ('mem_over_commit', float),
+        ('mem_percent_used', float),
+        ('vm_count', int),
+        ('uptime_days', float),
+        ('virtualmachine', list),
+        ('vm_sizes', list),
+        ('vm_low_cpu', int),
+        ('vm_low_mem', float),
+        ('vm_avg_cpu', int),
+        ('vm_avg_mem', int),
+        ('vm_max_cpu', int),
+        ('vm_max_mem', float),
+        ('vendor', str),
+        ('model', str),
+        ('serial_number', str),
+        ('contract_expiry', date),
+        ('eol', date),
+    )
+    # the histogram is aggregation state for ClusterCapacity and not part of the record
+    __slots__ = tuple(name for name, _ in fields) + ('vm_size_histogram',)
+    non_columns = ('vcenter', 'cluster', '_parent_id')
 
-    def __init__(self, vcenter_name, mo, hw_map=None, sql_map=None):
+    def __init__(self, vcenter_name, mo, inventory, hw_map=None, sql_map=None):
+        parent = inventory.get(mo['parent'])
         self.vcenter = vcenter_name
-        self.cluster = mo.parent.name
-        self._parent_id = mo.parent._moId
-        self.name = mo.name
-        self._mo_id = mo._moId
-        self.cpu_total = mo.hardware.cpuInfo.numCpuCores
+        self.cluster = parent['name']
+        self._parent_id = parent['_moId']
+        self.name = mo['name']
+        self._mo_id = mo['_moId']
+        # unset for a disconnected or not responding host
+        self.cpu_total = mo.get('hardware.cpuInfo.numCpuCores') or 0
         self.cpu_used = 0
         self.cpu_percent_used = 0.0
         self.cpu_over_commit = 0.0
-        self.mem_total = float(mo.hardware.memorySize or 0)/ByteFactors.KB_to_GB
-        self.mem_granted = float(mo.summary.quickStats.overallMemoryUsage or 0)/ByteFactors.MB_to_GB
+        self.mem_total = float(mo.get('hardware.memorySize') or 0)/ByteFactors.KB_to_GB
+        self.mem_granted = float(mo.get('summary.quickStats.overallMemoryUsage') or 0)/ByteFactors.MB_to_GB
         self.mem_granted_percent = 0.0
         self.mem_used = 0.0
         self.mem_over_commit = 0.0
         self.mem_percent_used = 0.0
         self.vm_count = 0
-        self.uptime_days = float(float(mo.summary.quickStats.uptime or 0)/86400)
+        self.uptime_days = float(float(mo.get('summary.quickStats.uptime') or 0)/86400)
         self.virtualmachine = []
         self.vm_sizes = []
+        self.vm_size_histogram = None
         self.vm_low_cpu = 0.0
         self.vm_low_mem = 0.0
         self.vm_avg_cpu = 0.0
@@ -51,13 +85,10 @@ class VsphereCapacity(CapacitySuper):
             hw_map = {}
         if not sql_map:
             sql_map = {}
-        self._get_usage_info(mo, hw_map, sql_map)
+        self._get_usage_info(mo, inventory, hw_map, sql_map)
 
-    def _get_usage_info(self, mo, hw_map=None, sql_map=None):
-        vm_size = []
-        vm_cpu = []
-        vm_mem = []
-        short_name = mo.name.lower().replace('.nordstrom.net', '')
+    def _get_usage_info(self, mo, inventory, hw_map=None, sql_map=None):
+        short_name = mo['name'].lower().replace('.nordstrom.net', '')
         if hw_map.get(short_name, None):
             # hw_map has data about this host
             self.serial_number = hw_map[short_name]['serial']
@@ -74,42 +105,34 @@ class VsphereCapacity(CapacitySuper):
                     self.serial_number = dbo.serial_number
                     self.contract_expiry = dbo.contract_expiring
                     self.eol = dbo.end_of_life
-            self.model = mo.hardware.systemInfo.model
+            self.model = mo.get('hardware.systemInfo.model')
 
-        self.vendor = mo.hardware.systemInfo.vendor
-        for vm in mo.vm:
+        self.vendor = mo.get('hardware.systemInfo.vendor')
+        histogram = VmSizeHistogram()
+        for vm in inventory.get_objects(mo.get('vm')):
             # Todo VirtualMachineCapacity() .....
-            if vm.runtime.powerState == 'poweredOn':
-                vcpu = vm.config.hardware.numCPU
-                vmem = float(vm.config.hardware.memoryMB or 0)/ByteFactors.MB_to_GB
-                size_str = '{}x{}'.format(vcpu, vmem)
-                if not size_str in vm_size:
-                    vm_size.append(size_str)
-                    self.vm_sizes.append(VmSize(size_str))
-                vm_cpu.append(vcpu)
-                vm_mem.append(vmem)
+            if vm.get('runtime.powerState') == 'poweredOn':
+                vcpu = vm.get('config.hardware.numCPU') or 0
+                vmem = float(vm.get('config.hardware.memoryMB') or 0)/ByteFactors.MB_to_GB
+                histogram.add(vcpu, vmem)
                 self.cpu_used += vcpu
                 self.mem_used += vmem
                 self.vm_count += 1
-        self.cpu_over_commit = self.cpu_used/self.cpu_total
+        self.vm_size_histogram = histogram
+        self.vm_sizes = histogram.get_vm_sizes()
+        self.cpu_over_commit = _safe_division(self.cpu_used, self.cpu_total)
         self.cpu_percent_used = self.cpu_over_commit*100
-        self.mem_over_commit = self.mem_used/self.mem_total
+        self.mem_over_commit = _safe_division(self.mem_used, self.mem_total)
         self.mem_percent_used = self.mem_over_commit*100
-        self.mem_granted_percent = (self.mem_granted/self.mem_total)*100
+        self.mem_granted_percent = _safe_division(self.mem_granted, self.mem_total)*100
 
-        if not vm_cpu:
-            vm_cpu = [0]
-        if not vm_mem:
-            vm_mem = [0]
-        try:
-            self.vm_low_cpu = min(vm_cpu)
-            self.vm_low_mem = min(vm_mem)
-            self.vm_avg_cpu = math.ceil(avg(vm_cpu))
-            self.vm_avg_mem = math.ceil(avg(vm_mem))
-            self.vm_max_cpu = max(vm_cpu)
-            self.vm_max_mem = max(vm_mem)
-        except ValueError as e:
-            raise
+        low_cpu, low_mem, avg_cpu, avg_mem, max_cpu, max_mem = histogram.get_statistics()
+        self.vm_low_cpu = low_cpu
+        self.vm_low_mem = low_mem
+        self.vm_avg_cpu = math.ceil(avg_cpu)
+        self.vm_avg_mem = math.ceil(avg_mem)
+        self.vm_max_cpu = max_cpu
+        self.vm_max_mem = max_mem
 
     @staticmethod
     def map_indexes(self, vm_cpu, vm_mem):
@@ -0,0 +1,205 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from vspherecapacity.vcenter.handle import Vcenter
+from vspherecapacity.vcenter.session import VcenterSessionPool
+from vspherecapacity.capacity.cluster import ClusterCapacity
+from vspherecapacity.capacity.datastore import StorageCapacityCache
+from vspherecapacity.recording import get_recording_path
+from vspherecapacity.credentials.credstore import credential_cache
+
+logger = logging.getLogger(__name__)
+
+# hw_map and sql_map of a collector process, sent once per process instead of once per vCenter
+_process_maps = {}
+
+
+def iter_vcenter(vcenter_name, hw_map=None, sql_map=None, record_dir=None, replay_dir=None, username=None,
+                 password=None, storage_cache=None, session_pool=None, counter_cache_dir=None):
+    """
+    Generator over the ClusterCapacity of every cluster of a single vCenter. The vCenter session is closed
+    as soon as the inventory snapshot is taken and each cluster is only calculated when it is requested, so
+    the caller decides how many clusters are held at once. The inventory is released with the generator.
+    Failures are raised to the caller, the vCenter session is closed either way.
+    :param vcenter_name: vCenter name or ip
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map
+    :param record_dir: directory the retrieved inventory is recorded to
+    :param replay_dir: directory the inventory is replayed from instead of connecting to vCenter
+    :param username: vCenter username, read from the credstore when not provided
+    :param password: vCenter password, read from the credstore when not provided
+    :param storage_cache: StorageCapacityCache of the run, a new one is used when not provided
+    :param session_pool: VcenterSessionPool to reuse vCenter sessions from
+    :param counter_cache_dir: directory caching the performance counter catalog of each vCenter
+    :return: generator of ClusterCapacity
+    """
+    vc = None
+    try:
+        logger.debug("Starting vCenter Capacity for {}".format(vcenter_name))
+        vc = Vcenter(vcenter_name,
+                     username=username,
+                     password=password,
+                     session_pool=session_pool,
+                     counter_cache_dir=counter_cache_dir,
+                     record_path=get_recording_path(record_dir, vcenter_name) if record_dir else None,
+                     replay_path=get_recording_path(replay_dir, vcenter_name) if replay_dir else None)
+        vc.connect()
+        if not vc.is_connected():
+            return
+        inventory = vc.get_inventory()
+        vc.disconnect()
+        vc.si = None
+        if storage_cache is None:
+            storage_cache = StorageCapacityCache()
+        for cl in inventory.get_by_type('ClusterComputeResource'):
+            yield ClusterCapacity(vc.name, cl, inventory, hw_map=hw_map, sql_map=sql_map,
+                                  storage_cache=storage_cache)
+        logger.debug("End vCenter Capacity for {}".format(vcenter_name))
+    finally:
+        if vc and vc.si:
+            vc.disconnect()
+
+
+def collect_vcenter(vcenter_name, hw_map=None, sql_map=None, record_dir=None, replay_dir=None, username=None,
+                    password=None, storage_cache=None, session_pool=None, counter_cache_dir=None, on_cluster=None):
+    """
+    Connects to a single vCenter with its own Vcenter session, takes an inventory snapshot
+    and builds the ClusterCapacity of every cluster, see iter_vcenter(). Any failure is logged and
+    isolated to this vCenter so the remaining vCenters are still collected.
+    :param vcenter_name: vCenter name or ip
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map
+    :param record_dir: directory the retrieved inventory is recorded to
+    :param replay_dir: directory the inventory is replayed from instead of connecting to vCenter
+    :param username: vCenter username, read from the credstore when not provided
+    :param password: vCenter password, read from the credstore when not provided
+    :param storage_cache: StorageCapacityCache of the run, a new one is used when not provided
+    :param session_pool: VcenterSessionPool to reuse vCenter sessions from
+    :param counter_cache_dir: directory caching the performance counter catalog of each vCenter
+    :param on_cluster: callable every ClusterCapacity is handed to as soon as it is calculated, the clusters
+        are then not kept in the returned list
+    :return: list of ClusterCapacity, empty if the vCenter could not be collected or on_cluster is given
+    """
+    cluster_capacity = []
+    try:
+        for cl_capacity in iter_vcenter(vcenter_name,
+                                        hw_map=hw_map,
+                                        sql_map=sql_map,
+                                        record_dir=record_dir,
+                                        replay_dir=replay_dir,
+                                        username=username,
+                                        password=password,
+                                        storage_cache=storage_cache,
+                                        session_pool=session_pool,
+                                        counter_cache_dir=counter_cache_dir):
+            if on_cluster:
+                on_cluster(cl_capacity)
+            else:
+                cluster_capacity.append(cl_capacity)
+    except Exception as e:
+        logger.exception('vCenter {} collection failed: {}'.format(vcenter_name, e))
+    return cluster_capacity
+
+
+def collect_vcenters(vcenter_names, max_workers=1, hw_map=None, sql_map=None, record_dir=None, replay_dir=None,
+                     username=None, password=None, session_pool=None, counter_cache_dir=None, on_cluster=None):
+    """
+    Collects several vCenters at once using a bounded pool of worker threads. Results are
+    returned in the order of vcenter_names regardless of which vCenter finished first, so
+    the database update phase sees the same data as a serial run.
+    :param vcenter_names: list of vCenter names or ips
+    :param max_workers: maximum number of vCenters collected at the same time
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map
+    :param record_dir: directory the retrieved inventories are recorded to
+    :param replay_dir: directory the inventories are replayed from instead of connecting to vCenter
+    :param username: vCenter username, read from the credstore when not provided
+    :param password: vCenter password, read from the credstore when not provided
+    :param session_pool: VcenterSessionPool to reuse vCenter sessions from
+    :param counter_cache_dir: directory caching the performance counter catalog of each vCenter
+    :param on_cluster: passed to collect_vcenter, called from the worker threads
+    :return: list with a list of ClusterCapacity per vCenter
+    """
+    storage_cache = StorageCapacityCache()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(lambda vcenter_name: collect_vcenter(vcenter_name,
+                                                                      hw_map=hw_map,
+                                                                      sql_map=sql_map,
+                                                                      record_dir=record_dir,
+                                                                      replay_dir=replay_dir,
+                                                                      username=username,
+                                                                      password=password,
+                                                                      storage_cache=storage_cache,
+                                                                      session_pool=session_pool,
+                                                                      counter_cache_dir=counter_cache_dir,
+                                                                      on_cluster=on_cluster),
+                                 vcenter_names))
+
+
+def _init_collector_process(hw_map, sql_map, credential_cache_seconds):
+    _process_maps.update({'hw_map': hw_map, 'sql_map': sql_map})
+    # the worker starts with the default ttl, not the one configured in the parent process
+    credential_cache.ttl_seconds = credential_cache_seconds
+
+
+def _collect_vcenter_in_process(vcenter_name, record_dir=None, replay_dir=None, username=None, password=None,
+                                session_dir=None, counter_cache_dir=None):
+    session_pool = VcenterSessionPool(session_dir=session_dir) if session_dir else None
+    return collect_vcenter(vcenter_name,
+                           hw_map=_process_maps.get('hw_map', None),
+                           sql_map=_process_maps.get('sql_map', None),
+                           record_dir=record_dir,
+                           replay_dir=replay_dir,
+                           username=username,
+                           password=password,
+                           session_pool=session_pool,
+                           counter_cache_dir=counter_cache_dir)
+
+
+def collect_vcenters_in_processes(vcenter_names, max_workers=1, hw_map=None, sql_map=None, record_dir=None,
+                                  replay_dir=None, username=None, password=None, session_dir=None,
+                                  counter_cache_dir=None, on_cluster=None):
+    """
+    Collects every vCenter in its own worker process, so deserializing the inventories of large vCenters
+    runs on several cores instead of serializing on the GIL. The ClusterCapacity objects only hold plain
+    data and are pickled back to this process. Datastores shared between vCenters are calculated once per
+    vCenter rather than once per run, as the processes do not share a StorageCapacityCache.
+    :param vcenter_names: list of vCenter names or ips
+    :param max_workers: number of worker processes
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map
+    :param record_dir: directory the retrieved inventories are recorded to
+    :param replay_dir: directory the inventories are replayed from instead of connecting to vCenter
+    :param username: vCenter username, read from the credstore when not provided
+    :param password: vCenter password, read from the credstore when not provided
+    :param session_dir: session directory of a VcenterSessionPool created in each worker process
+    :param counter_cache_dir: directory caching the performance counter catalog of each vCenter
+    :param on_cluster: callable every ClusterCapacity is handed to in this process as soon as its vCenter
+        is collected, the clusters are then not kept in the returned list
+    :return: list with a list of ClusterCapacity per vCenter, in the order of vcenter_names
+    """
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(1, max_workers),
+                             initializer=_init_collector_process,
+                             initargs=(hw_map, sql_map, credential_cache.ttl_seconds)) as executor:
+        futures = {executor.submit(_collect_vcenter_in_process, vcenter_name,
+                                   record_dir=record_dir,
+                                   replay_dir=replay_dir,
+                                   username=username,
+                                   password=password,
+                                   session_dir=session_dir,
+                                   counter_cache_dir=counter_cache_dir): index
+                   for index, vcenter_name in enumerate(vcenter_names)}
+        for future in as_completed(futures):
+            index = futures.pop(future)
+            try:
+                cluster_capacity = future.result()
+            except Exception as e:
+                # collect_vcenter handles its own errors, this is a worker process that died
+                logger.exception('vCenter {} collection process failed: {}'.format(vcenter_names[index], e))
+                cluster_capacity = []
+            if on_cluster:
+                for cl_capacity in cluster_capacity:
+                    on_cluster(cl_capacity)
+                cluster_capacity = []
+            results[index] = cluster_capacity
+    return [results[index] for index in range(len(vcenter_names))]
@@ -1,10 +1,80 @@
 import os
+import time
 import requests
 import json
+import threading
+from requests.adapters import HTTPAdapter
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
 from pycrypt.encryption import Encryption, AESCipher
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Returns the keep-alive requests.Session shared by every Credential of the process
+    :return: requests.Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            disable_warnings(InsecureRequestWarning)
+            session = requests.Session()
+            session.verify = False
+            session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=10))
+            _session = session
+        return _session
+
+
+class CredentialCache(object):
+    """
+    In-process cache of the credentials read from the credstore, keyed by username. The cached Credential
+    keeps its password AES encrypted like any other Credential. An entry is read from the credstore again
+    once it is older than ttl_seconds, a ttl_seconds of 0 disables the cache.
+    """
+
+    def __init__(self, ttl_seconds=3600):
+        self.ttl_seconds = ttl_seconds
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__fetch_locks = {}
+
+    def get(self, username, dev=False):
+        """
+        :param username: credstore username
+        :param dev: credential of the dev credstore
+        :return: cached Credential or None when it is not cached or expired
+        """
+        with self.__lock:
+            entry = self.__entries.get((username, dev), None)
+            if entry is None:
+                return None
+            expires, credential = entry
+            if time.monotonic() >= expires:
+                del self.__entries[(username, dev)]
+                return None
+            return credential
+
+    def put(self, credential, dev=False):
+        if self.ttl_seconds <= 0:
+            return
+        with self.__lock:
+            self.__entries[(credential.username, dev)] = (time.monotonic() + self.ttl_seconds, credential)
+
+    def fetch_lock(self, username, dev=False):
+        # held while a username is read from the credstore so concurrent callers wait for the first read
+        with self.__lock:
+            return self.__fetch_locks.setdefault((username, dev), threading.Lock())
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+credential_cache = CredentialCache()
+
 
 class Credential:
 
@@ -12,14 +82,31 @@ class Credential:
         self.aes_cipher = AESCipher()
         self.rsa_cipher = Encryption()
         self.username = username
-        self.session = requests.Session()
-        self.session.verify = False
-        disable_warnings(InsecureRequestWarning)
+        self.session = get_session()
         self.__password = self.store_password(password)
         self.__private_file = os.environ.get('RSAPrivateFile' or None)
-        self.__secret = open(os.environ.get('RSASecret' or None), 'r').read().strip()
+        self.__secret = None
 
     def get_credential(self, dev=False):
+        """
+        Reads the password of username from the credstore, or from credential_cache when it was read before
+        :param dev: use the dev credstore
+        :return: dict with username and password
+        """
+        with credential_cache.fetch_lock(self.username, dev):
+            cached = credential_cache.get(self.username, dev)
+            if cached is None:
+                self.read_credstore(dev)
+                credential_cache.put(Credential(self.username, password=self.retrieve_password()), dev)
+            else:
+                self.__password = self.store_password(cached.retrieve_password())
+
+        return {
+            'username': self.username,
+            'password': self.retrieve_password()
+        }
+
+    def read_credstore(self, dev=False):
         if dev:
             credstore_uri = 'https://credstore-dev/credentialstore/GetCredential?ClientId={}&username={}'.format(
                 os.environ['ClientId'],
@@ -38,17 +125,15 @@ class Credential:
             password=data[0].get('secret' or None)[0].get('password' or None)
         )
 
-        return {
-            'username': self.username,
-            'password': self.__password
-        }
-
     def decipher(self, shared_key, password):
         rsa_cipher = Encryption()
         aes_cipher = AESCipher()
 
+        # the secret is only read when the credstore is actually used so explicit credentials need no RSASecret
+        if not self.__secret:
+            self.__secret = open(os.environ.get('RSASecret' or None), 'r').read().strip()
         rsa_cipher.decrypt(encrypted_data=shared_key, private_key_file=self.__private_file, secret_code=self.__secret)
-        self.__password = aes_cipher.decrypt(enc=password, key=rsa_cipher.get_decrypted_message())
+        self.__password = self.store_password(aes_cipher.decrypt(enc=password, key=rsa_cipher.get_decrypted_message()))
         self.__secret = None
 
     def store_password(self, password):
@@ -0,0 +1,198 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from pyVmomi import vmodl
+from log.setup import addClassLogger
+from vspherecapacity.vcenter.handle import Vcenter
+from vspherecapacity.vcenter.inventory import Inventory
+from vspherecapacity.capacity import DatabaseAccess
+from vspherecapacity.capacity.cluster import ClusterCapacity
+from vspherecapacity.capacity.datastore import StorageCapacityCache
+
+logger = logging.getLogger(__name__)
+
+
+@addClassLogger
+class IncrementalCollector(object):
+    """
+    Long-running collector for a single vCenter. A full sync is done once through WaitForUpdatesEx
+    with an empty version, after which only the changed properties are applied to the in-memory
+    Inventory. Only the clusters depending on a changed object are recalculated and written to the database.
+    Every full_sync_interval all clusters are written again so date_modified stays current for
+    the decommission pass.
+    """
+
+    def __init__(self, vcenter_name, db_host, db_name, db_user, hw_map=None, sql_map=None,
+                 max_wait_seconds=60, full_sync_interval=timedelta(hours=24), page_size=1000, username=None,
+                 password=None, session_pool=None, counter_cache_dir=None):
+        self.vcenter_name = vcenter_name
+        self.username = username
+        self.__password = password
+        self.session_pool = session_pool
+        self.counter_cache_dir = counter_cache_dir
+        self.db_host = db_host
+        self.db_name = db_name
+        self.db_user = db_user
+        self.hw_map = hw_map
+        self.sql_map = sql_map
+        self.max_wait_seconds = max_wait_seconds
+        self.full_sync_interval = full_sync_interval
+        self.page_size = page_size
+        self.vc = None
+        self.inventory = None
+        self.version = ''
+        self.last_full_sync = None
+        self.__property_collector = None
+        self.__view = None
+
+    def start(self):
+        """
+        Connects to vCenter and creates a dedicated PropertyCollector with a filter over the inventory view
+        :return: None
+        """
+        self.vc = Vcenter(self.vcenter_name, username=self.username, password=self.__password,
+                          session_pool=self.session_pool, counter_cache_dir=self.counter_cache_dir)
+        self.vc.connect()
+        if not self.vc.si:
+            raise ConnectionError('Unable to connect to vCenter {}'.format(self.vcenter_name))
+
+        self.__view = self.vc.create_inventory_view()
+        self.__property_collector = self.vc.content.propertyCollector.CreatePropertyCollector()
+        self.__property_collector.CreateFilter(self.vc.get_inventory_filter_spec(self.__view), partialUpdates=False)
+        self.inventory = Inventory(vcenter_name=self.vc.name)
+        self.version = ''
+
+    def stop(self):
+        try:
+            if self.__property_collector:
+                self.__property_collector.DestroyPropertyCollector()
+            if self.__view:
+                self.__view.Destroy()
+            if self.vc and self.vc.si:
+                self.vc.disconnect()
+        except BaseException as e:
+            self.__log.exception('Exception: {} \n Args: {}'.format(e, e.args))
+        finally:
+            self.__property_collector = None
+            self.__view = None
+            self.vc = None
+
+    def wait_for_updates(self):
+        """
+        Waits up to max_wait_seconds for changes and applies them to the inventory. Truncated results
+        are retrieved immediately using the returned version token.
+        :return: set of changed moIds
+        """
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self.max_wait_seconds,
+                                                            maxObjectUpdates=self.page_size)
+        changed = set()
+        while True:
+            update_set = self.__property_collector.WaitForUpdatesEx(version=self.version, options=options)
+            if not update_set:
+                # maxWaitSeconds expired with no changes
+                return changed
+            changed.update(self.inventory.apply_update_set(update_set))
+            self.version = update_set.version
+            if not update_set.truncated:
+                return changed
+
+    def update_clusters(self, clusters):
+        """
+        Recalculates the capacity of each cluster from the in-memory inventory and writes it to the database.
+        Datastore capacity is shared between the clusters of this update only, as the inventory keeps changing.
+        :param clusters: list of ClusterComputeResource object dicts
+        :return: None
+        """
+        storage_cache = StorageCapacityCache()
+        for cl in clusters:
+            cl_capacity = ClusterCapacity(self.vc.name, cl, self.inventory, hw_map=self.hw_map, sql_map=self.sql_map,
+                                          storage_cache=storage_cache)
+            cl_capacity.setup_database_connection(db_host=self.db_host,
+                                                  db_name=self.db_name,
+                                                  db_user=self.db_user)
+            cl_capacity.db_update_or_create()
+
+    def sync(self):
+        """
+        Runs a single update cycle, doing a full sync when required
+        :return: None
+        """
+        full_sync = not self.last_full_sync or datetime.now() - self.last_full_sync >= self.full_sync_interval
+        changed = self.wait_for_updates()
+        if full_sync:
+            clusters = self.inventory.get_by_type('ClusterComputeResource')
+            self.last_full_sync = datetime.now()
+            self.__log.info('{} full sync of {} clusters'.format(self.vcenter_name, len(clusters)))
+        else:
+            clusters = self.inventory.get_affected_clusters(changed)
+            if clusters:
+                self.__log.info('{} {} changed objects, updating {} clusters'.format(self.vcenter_name,
+                                                                                   len(changed),
+                                                                                   len(clusters)))
+        self.update_clusters(clusters)
+
+    def run(self, retry_seconds=60):
+        """
+        Runs forever. On any failure the session is dropped and a new full sync is started after retry_seconds.
+        :param retry_seconds: seconds to wait before reconnecting after a failure
+        :return: None
+        """
+        while True:
+            try:
+                if not self.vc:
+                    self.start()
+                    self.last_full_sync = None
+                self.sync()
+            except BaseException as e:
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    self.stop()
+                    raise
+                self.__log.exception('vCenter {} incremental collection failed: {}'.format(self.vcenter_name, e))
+                self.stop()
+                time.sleep(retry_seconds)
+
+
+def run_incremental(vcenter_names, db_host, db_name, db_user, hw_map=None, sql_map=None,
+                    max_wait_seconds=60, full_sync_interval=timedelta(hours=24), days_missing_before_decomm=3,
+                    username=None, password=None, session_pool=None, counter_cache_dir=None):
+    """
+    Runs an IncrementalCollector per vCenter, each in its own daemon thread, and runs the
+    decommission pass after every full_sync_interval.
+    :param vcenter_names: list of vCenter names or ips
+    :param db_host: capacity database server
+    :param db_name: capacity database name
+    :param db_user: capacity database user
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map
+    :param max_wait_seconds: maximum seconds a WaitForUpdatesEx call blocks
+    :param full_sync_interval: timedelta between writes of every cluster
+    :param days_missing_before_decomm: passed to DatabaseAccess.update_decommissions
+    :param username: vCenter username, read from the credstore when not provided
+    :param password: vCenter password, read from the credstore when not provided
+    :param session_pool: VcenterSessionPool, its keepalive is started so idle sessions do not expire
+    :param counter_cache_dir: directory caching the performance counter catalog of each vCenter
+    :return: None
+    """
+    if session_pool:
+        session_pool.start_keepalive()
+    collectors = [IncrementalCollector(vcenter_name, db_host, db_name, db_user, hw_map=hw_map, sql_map=sql_map,
+                                       max_wait_seconds=max_wait_seconds, full_sync_interval=full_sync_interval,
+                                       username=username, password=password, session_pool=session_pool,
+                                       counter_cache_dir=counter_cache_dir)
+                  for vcenter_name in vcenter_names]
+    for collector in collectors:
+        threading.Thread(target=collector.run, name=collector.vcenter_name, daemon=True).start()
+
+    while True:
+        time.sleep(full_sync_interval.total_seconds())
+        try:
+            dba = DatabaseAccess(host=db_host,
+                                 db=db_name,
+                                 user=db_user)
+            dba.update_decommissions(days_missing_before_decomm=days_missing_before_decomm)
+            dba.dispose()
+        except BaseException as e:
+            if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                raise
+            logger.exception('Decommission update failed: {}'.format(e))
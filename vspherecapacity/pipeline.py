@@ -0,0 +1,153 @@
+import queue
+import logging
+import threading
+from functools import partial
+from log.setup import addClassLogger
+from vspherecapacity.collector import collect_vcenters, collect_vcenters_in_processes
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def write_cluster_capacity(cl_capacity, db_host, db_name, db_user, bulk_upsert=False):
+    """
+    Writes a single ClusterCapacity to the capacity database
+    :param cl_capacity: ClusterCapacity
+    :param db_host: capacity database server
+    :param db_name: capacity database name
+    :param db_user: capacity database user
+    :param bulk_upsert: write with ClusterCapacity.db_bulk_update_or_create()
+    :return: None
+    """
+    cl_capacity.setup_database_connection(db_host=db_host,
+                                          db_name=db_name,
+                                          db_user=db_user)
+    if bulk_upsert:
+        cl_capacity.db_bulk_update_or_create()
+    else:
+        cl_capacity.db_update_or_create()
+
+
+@addClassLogger
+class CapacityPipeline(object):
+    """
+    Bounded producer/consumer queue between the vCenter collectors and the database writers. Collectors put()
+    every finished ClusterCapacity and block while queue_size clusters are waiting, so memory stays flat when
+    the database is slower than collection. Each writer thread hands the clusters it takes to write().
+    A cluster that fails to write is logged and counted, the other clusters are still written.
+    """
+
+    def __init__(self, write, writers=1, queue_size=16):
+        """
+        :param write: callable taking a ClusterCapacity
+        :param writers: number of writer threads. Clusters share vCenter, datastore and vm size rows, which only
+            the upserts of ClusterCapacity.db_bulk_update_or_create() write safely from several threads. Keep this
+            at 1 with db_update_or_create(), its select then insert of a shared row races with the other writers
+        :param queue_size: maximum number of clusters waiting to be written
+        """
+        self.write = write
+        self.writers = max(1, writers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.written = 0
+        self.failed = 0
+        self.__lock = threading.Lock()
+        self.__threads = []
+
+    def start(self):
+        for i in range(self.writers):
+            thread = threading.Thread(target=self._run_writer, name='capacity-writer-{}'.format(i), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def put(self, cl_capacity):
+        self.queue.put(cl_capacity)
+
+    def close(self):
+        """
+        Waits until every queued cluster is written and stops the writer threads
+        :return: None
+        """
+        for _ in self.__threads:
+            self.queue.put(_STOP)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def _run_writer(self):
+        while True:
+            cl_capacity = self.queue.get()
+            if cl_capacity is _STOP:
+                return
+            try:
+                self.write(cl_capacity)
+                with self.__lock:
+                    self.written += 1
+            except BaseException as e:
+                self.__log.exception('Writing cluster {} of vCenter {} failed: {}'.format(
+                    cl_capacity.name, cl_capacity.vcenter_name, e))
+                with self.__lock:
+                    self.failed += 1
+
+
+def collect_and_write(vcenter_names, db_host, db_name, db_user, max_workers=1, db_writers=1, queue_size=16,
+                      hw_map=None, sql_map=None, record_dir=None, replay_dir=None, username=None, password=None,
+                      session_pool=None, processes=False, session_dir=None, bulk_upsert=False,
+                      counter_cache_dir=None):
+    """
+    Collects the vCenters and writes every cluster to the capacity database while the remaining clusters are
+    still being collected, so a run takes about as long as the slower of the two phases instead of both.
+    :param vcenter_names: list of vCenter names or ips
+    :param db_host: capacity database server
+    :param db_name: capacity database name
+    :param db_user: capacity database user
+    :param max_workers: maximum number of vCenters collected at the same time
+    :param db_writers: number of database writer threads
+    :param queue_size: maximum number of collected clusters waiting to be written
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map
+    :param record_dir: directory the retrieved inventories are recorded to
+    :param replay_dir: directory the inventories are replayed from instead of connecting to vCenter
+    :param username: vCenter username, read from the credstore when not provided
+    :param password: vCenter password, read from the credstore when not provided
+    :param session_pool: VcenterSessionPool to reuse vCenter sessions from, not used with processes
+    :param processes: collect every vCenter in a worker process, see collect_vcenters_in_processes()
+    :param session_dir: session directory of the VcenterSessionPool of each worker process
+    :param bulk_upsert: write every cluster with bulk upserts, see ClusterCapacity.db_bulk_update_or_create()
+    :param counter_cache_dir: directory caching the performance counter catalog of each vCenter
+    :return: CapacityPipeline with the written and failed counts
+    """
+    pipeline = CapacityPipeline(partial(write_cluster_capacity, db_host=db_host, db_name=db_name, db_user=db_user,
+                                        bulk_upsert=bulk_upsert),
+                                writers=db_writers,
+                                queue_size=queue_size)
+    pipeline.start()
+    try:
+        if processes:
+            collect_vcenters_in_processes(vcenter_names,
+                                          max_workers=max_workers,
+                                          hw_map=hw_map,
+                                          sql_map=sql_map,
+                                          record_dir=record_dir,
+                                          replay_dir=replay_dir,
+                                          username=username,
+                                          password=password,
+                                          session_dir=session_dir,
+                                          counter_cache_dir=counter_cache_dir,
+                                          on_cluster=pipeline.put)
+        else:
+            collect_vcenters(vcenter_names,
+                             max_workers=max_workers,
+                             hw_map=hw_map,
+                             sql_map=sql_map,
+                             record_dir=record_dir,
+                             replay_dir=replay_dir,
+                             username=username,
+                             password=password,
+                             session_pool=session_pool,
+                             counter_cache_dir=counter_cache_dir,
+                             on_cluster=pipeline.put)
+    finally:
+        pipeline.close()
+    logger.info('{} clusters written, {} failed'.format(pipeline.written, pipeline.failed))
+    return pipeline
@@ -0,0 +1,90 @@
+import os
+import gzip
+import json
+from datetime import date, datetime
+from vspherecapacity.capacity import DatabaseObject
+
+RECORDING_EXTENSION = '.json.gz'
+MAPS_RECORDING = '_maps'
+# dates are written as {"__date__": "2020-01-31"} so load_json() returns them as date objects again
+DATE_TAG = '__date__'
+DATETIME_TAG = '__datetime__'
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {DATETIME_TAG: value.isoformat()}
+    if isinstance(value, date):
+        return {DATE_TAG: value.isoformat()}
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def _decode_object(obj):
+    if len(obj) == 1:
+        if DATE_TAG in obj:
+            return date.fromisoformat(obj[DATE_TAG])
+        if DATETIME_TAG in obj:
+            return datetime.fromisoformat(obj[DATETIME_TAG])
+    return obj
+
+
+def save_json(obj, fpath):
+    """
+    Writes obj to a gzip compressed json file, dates and datetimes are tagged with their type
+    :param obj: json serializable object, may contain dates and datetimes
+    :param fpath: file path
+    :return: None
+    """
+    with gzip.open(fpath, mode='wt', encoding='utf8') as f:
+        json.dump(obj, f, separators=(',', ':'), default=_encode_value)
+
+
+def load_json(fpath):
+    """
+    Reads a gzip compressed json file written by save_json()
+    :param fpath: file path
+    :return: deserialized object with the tagged dates and datetimes converted back
+    """
+    with gzip.open(fpath, mode='rt', encoding='utf8') as f:
+        return json.load(f, object_hook=_decode_object)
+
+
+def get_recording_path(record_dir, name):
+    return os.path.join(record_dir, '{}{}'.format(name, RECORDING_EXTENSION))
+
+
+def list_recorded_vcenters(replay_dir):
+    """
+    Returns the names of every vCenter recorded in replay_dir
+    :param replay_dir: directory passed as record_dir during the recording run
+    :return: sorted list of vCenter names
+    """
+    return sorted([f[:-len(RECORDING_EXTENSION)] for f in os.listdir(replay_dir)
+                   if f.endswith(RECORDING_EXTENSION) and not f == '{}{}'.format(MAPS_RECORDING, RECORDING_EXTENSION)])
+
+
+def record_maps(record_dir, hw_map, sql_map):
+    """
+    Records the ucs hardware map and lifecycle database map so a replay needs neither UCS nor the lifecycle database
+    :param record_dir: recording directory
+    :param hw_map: ucs service profile to hardware map
+    :param sql_map: lifecycle database map of common_name to DatabaseObject
+    :return: None
+    """
+    save_json({
+        'hw_map': hw_map,
+        'sql_map': {k: dbo.as_dict() for k, dbo in sql_map.items()},
+    }, get_recording_path(record_dir, MAPS_RECORDING))
+
+
+def replay_maps(replay_dir):
+    """
+    Loads the maps written by record_maps()
+    :param replay_dir: recording directory
+    :return: [hw_map, sql_map]
+    """
+    data = load_json(get_recording_path(replay_dir, MAPS_RECORDING))
+    sql_map = {}
+    for k, v in data['sql_map'].items():
+        sql_map[k] = DatabaseObject(columns=list(v.keys()), sql_data=list(v.values()))
+    return [data['hw_map'], sql_map]
@@ -0,0 +1,61 @@
+import time
+import argparse
+import logging
+from vspherecapacity.simulator.inventory import generate_inventories
+from vspherecapacity.simulator.server import VcenterSimulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve simulated vCenters for load testing collect_capacity.py')
+    parser.add_argument('--vcenters', type=int, default=1, help='number of simulated vCenters')
+    parser.add_argument('--hosts', type=int, default=40, help='total number of hosts across all vCenters')
+    parser.add_argument('--vms', type=int, default=2000, help='total number of VMs across all vCenters')
+    parser.add_argument('--hosts-per-cluster', type=int, default=16, help='maximum hosts per cluster')
+    parser.add_argument('--datastores-per-cluster', type=int, default=4, help='datastores mounted by each cluster')
+    parser.add_argument('--storage-pod-ratio', type=float, default=0.5,
+                        help='fraction of clusters whose datastores are in a datastore cluster')
+    parser.add_argument('--shared-datastores', type=int, default=0,
+                        help='datastores in one datastore cluster mounted by every cluster')
+    parser.add_argument('--address', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8900,
+                        help='port of the first vCenter, each further vCenter uses the next port. 0 picks free ports')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random seconds up to this value added to latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of API calls that return a fault')
+    parser.add_argument('--certfile', default=None, help='TLS certificate, a self-signed one is generated if omitted')
+    parser.add_argument('--keyfile', default=None, help='TLS private key of --certfile')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the generated inventories')
+    parser.add_argument('--debug', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    inventories = generate_inventories(args.vcenters, args.hosts, args.vms,
+                                       seed=args.seed,
+                                       hosts_per_cluster=args.hosts_per_cluster,
+                                       datastores_per_cluster=args.datastores_per_cluster,
+                                       storage_pod_ratio=args.storage_pod_ratio,
+                                       shared_datastores=args.shared_datastores)
+    simulator = VcenterSimulator(inventories,
+                                 address=args.address,
+                                 base_port=args.port,
+                                 certfile=args.certfile,
+                                 keyfile=args.keyfile,
+                                 latency=args.latency,
+                                 jitter=args.jitter,
+                                 error_rate=args.error_rate,
+                                 seed=args.seed)
+    vc_names = simulator.start()
+    print('[vcenter]')
+    print('Servers = {}'.format(','.join(vc_names)))
+    print('user = simulator')
+    print('password = simulator')
+    try:
+        while True:
+            time.sleep(60)
+            logging.info('{} API calls served'.format(simulator.call_count))
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
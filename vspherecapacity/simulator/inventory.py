@@ -0,0 +1,183 @@
+import random
+from vspherecapacity.vcenter.inventory import Inventory
+
+HOST_CORES = [24, 32, 40, 48]
+HOST_MEMORY_GB = [384, 512, 768, 1024]
+VM_SIZES = [(1, 2), (1, 4), (2, 4), (2, 8), (4, 8), (4, 16), (8, 16), (8, 32), (16, 64)]
+DATASTORE_TB = [4, 8, 16]
+
+
+def _spread(total, buckets):
+    """
+    Splits total into buckets as evenly as possible
+    :param total: number of items
+    :param buckets: number of buckets
+    :return: list of counts per bucket
+    """
+    if buckets <= 0:
+        return []
+    return [total // buckets + (1 if i < total % buckets else 0) for i in range(buckets)]
+
+
+def generate_inventory(vcenter_name, hosts, vms, hosts_per_cluster=16, datastores_per_cluster=4,
+                       storage_pod_ratio=0.5, poweredoff_ratio=0.1, template_ratio=0.02, seed=0,
+                       id_offset=0, shared_datastores=0):
+    """
+    Generates a synthetic Inventory shaped like the one Vcenter.get_inventory() retrieves. Hosts are
+    grouped into clusters of hosts_per_cluster, VMs are spread evenly across hosts and every cluster
+    mounts its own datastores, which are placed in a StoragePod for storage_pod_ratio of the clusters.
+    :param vcenter_name: name of the simulated vCenter
+    :param hosts: number of HostSystems
+    :param vms: number of VirtualMachines
+    :param hosts_per_cluster: maximum number of hosts per cluster
+    :param datastores_per_cluster: number of datastores mounted by each cluster
+    :param storage_pod_ratio: fraction of clusters whose datastores belong to a datastore cluster
+    :param poweredoff_ratio: fraction of VMs that are powered off
+    :param template_ratio: fraction of VMs that are templates
+    :param seed: random seed, the same arguments and seed always generate the same inventory
+    :param id_offset: added to every moId number so inventories of several vCenters do not share moIds
+    :param shared_datastores: number of datastores, in one StoragePod, mounted by every cluster
+    :return: Inventory
+    """
+    rand = random.Random(seed)
+    inventory = Inventory(vcenter_name=vcenter_name)
+    objects = inventory.objects
+    cluster_count = max(1, -(-hosts // hosts_per_cluster)) if hosts else 0
+    vm_counts = _spread(vms, hosts)
+    host_index = 0
+    vm_index = 0
+
+    shared = []
+    for d in range(shared_datastores):
+        ds_n = id_offset + 900000 + d + 1
+        capacity = rand.choice(DATASTORE_TB) * 1024 ** 4
+        free = int(capacity * rand.uniform(0.1, 0.6))
+        ds = {
+            '_moId': 'datastore-{}'.format(ds_n),
+            '_type': 'Datastore',
+            'name': 'sim-shared-ds-{:05d}'.format(ds_n),
+            'parent': 'group-p{}'.format(id_offset + 900000),
+            'vm': [],
+            'summary.capacity': capacity,
+            'summary.freeSpace': free,
+            'summary.uncommitted': int(free * rand.uniform(0.0, 0.2)),
+        }
+        objects[ds['_moId']] = ds
+        shared.append(ds)
+    if shared:
+        pod = {
+            '_moId': 'group-p{}'.format(id_offset + 900000),
+            '_type': 'StoragePod',
+            'name': 'sim-shared-dscluster',
+            'summary.capacity': sum(ds['summary.capacity'] for ds in shared),
+            'childEntity': [ds['_moId'] for ds in shared],
+        }
+        objects[pod['_moId']] = pod
+
+    for c, cluster_hosts in enumerate(_spread(hosts, cluster_count)):
+        n = id_offset + c + 1
+        cluster = {
+            '_moId': 'domain-c{}'.format(n),
+            '_type': 'ClusterComputeResource',
+            'name': 'sim-cluster-{:04d}'.format(n),
+            'host': [],
+            'datastore': [],
+        }
+        objects[cluster['_moId']] = cluster
+
+        datastores = []
+        for d in range(datastores_per_cluster):
+            ds_n = id_offset + c * datastores_per_cluster + d + 1
+            capacity = rand.choice(DATASTORE_TB) * 1024 ** 4
+            free = int(capacity * rand.uniform(0.1, 0.6))
+            ds = {
+                '_moId': 'datastore-{}'.format(ds_n),
+                '_type': 'Datastore',
+                'name': 'sim-ds-{:05d}'.format(ds_n),
+                'parent': 'group-s1',
+                'vm': [],
+                'summary.capacity': capacity,
+                'summary.freeSpace': free,
+                'summary.uncommitted': int(free * rand.uniform(0.0, 0.2)),
+            }
+            objects[ds['_moId']] = ds
+            datastores.append(ds)
+            cluster['datastore'].append(ds['_moId'])
+        cluster['datastore'].extend(ds['_moId'] for ds in shared)
+
+        if datastores and rand.random() < storage_pod_ratio:
+            pod = {
+                '_moId': 'group-p{}'.format(n),
+                '_type': 'StoragePod',
+                'name': 'sim-dscluster-{:04d}'.format(n),
+                'summary.capacity': sum(ds['summary.capacity'] for ds in datastores),
+                'childEntity': [ds['_moId'] for ds in datastores],
+            }
+            objects[pod['_moId']] = pod
+            for ds in datastores:
+                ds['parent'] = pod['_moId']
+
+        for h in range(cluster_hosts):
+            host_n = id_offset + host_index + 1
+            host = {
+                '_moId': 'host-{}'.format(host_n),
+                '_type': 'HostSystem',
+                'name': 'simesx{:06d}.sim.local'.format(host_n),
+                'parent': cluster['_moId'],
+                'vm': [],
+                'hardware.cpuInfo.numCpuCores': rand.choice(HOST_CORES),
+                'hardware.memorySize': rand.choice(HOST_MEMORY_GB) * 1024 ** 3,
+                'hardware.systemInfo.model': 'SimBlade B200',
+                'hardware.systemInfo.vendor': 'Simulated',
+                'summary.quickStats.overallMemoryUsage': 0,
+                'summary.quickStats.uptime': rand.randint(1, 365) * 86400,
+            }
+            objects[host['_moId']] = host
+            cluster['host'].append(host['_moId'])
+
+            for v in range(vm_counts[host_index]):
+                vm_n = id_offset + vm_index + 1
+                vcpu, vmem = rand.choice(VM_SIZES)
+                state = rand.random()
+                vm = {
+                    '_moId': 'vm-{}'.format(vm_n),
+                    '_type': 'VirtualMachine',
+                    'name': 'simvm{:07d}'.format(vm_n),
+                    'runtime.powerState': 'poweredOff' if state < template_ratio + poweredoff_ratio else 'poweredOn',
+                    'config.hardware.numCPU': vcpu,
+                    'config.hardware.memoryMB': vmem * 1024,
+                    'config.template': state < template_ratio,
+                }
+                objects[vm['_moId']] = vm
+                host['vm'].append(vm['_moId'])
+                if vm['runtime.powerState'] == 'poweredOn':
+                    host['summary.quickStats.overallMemoryUsage'] += vm['config.hardware.memoryMB']
+                if datastores or shared:
+                    rand.choice(datastores + shared)['vm'].append(vm['_moId'])
+                vm_index += 1
+            host_index += 1
+
+    return inventory
+
+
+def generate_inventories(vcenters, hosts, vms, seed=0, **kwargs):
+    """
+    Generates one Inventory per simulated vCenter with hosts and VMs spread evenly across them,
+    for example generate_inventories(50, 2000, 100000) for 50 vCenters with 40 hosts and 2,000 VMs each.
+    :param vcenters: number of simulated vCenters
+    :param hosts: total number of HostSystems
+    :param vms: total number of VirtualMachines
+    :param seed: random seed
+    :param kwargs: passed to generate_inventory()
+    :return: list of Inventory
+    """
+    inventories = []
+    vm_counts = _spread(vms, vcenters)
+    for i, vc_hosts in enumerate(_spread(hosts, vcenters)):
+        inventories.append(generate_inventory('vcsim{:03d}'.format(i + 1),
+                                              hosts=vc_hosts,
+                                              vms=vm_counts[i],
+                                              seed=seed + i,
+                                              id_offset=(i + 1) * 1000000,
+                                              **kwargs))
+    return inventories
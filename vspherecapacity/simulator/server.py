@@ -0,0 +1,671 @@
+import os
+import re
+import ssl
+import time
+import uuid
+import shutil
+import tempfile
+import subprocess
+import random
+import threading
+import logging
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pyVmomi import vim, vmodl
+from pyVmomi.VmomiSupport import GetWsdlType, GetServiceVersions, IsChildVersion, Object, versionIdMap
+from pyVmomi.SoapAdapter import SerializeToUnicode, XMLNS_SOAPENV, XMLNS_XSI
+from log.setup import addClassLogger
+from vspherecapacity.vcenter.handle import Vcenter
+
+logger = logging.getLogger(__name__)
+
+SIMULATED_API_VERSION = 'vim.version.version13'
+VIM_NS = 'urn:vim25'
+SESSION_COOKIE = 'vmware_soap_session'
+
+# Properties of the inventory objects that hold references to other ManagedObjects
+REFERENCE_PROPERTIES = ['parent', 'host', 'datastore', 'vm', 'childEntity']
+
+# moId prefixes of objects that are referenced but not part of the inventory
+MOID_PREFIX_TYPES = [('domain-c', 'ClusterComputeResource'),
+                     ('domain-s', 'ComputeResource'),
+                     ('datacenter-', 'Datacenter'),
+                     ('resgroup-', 'ResourcePool'),
+                     ('group-p', 'StoragePod'),
+                     ('group-', 'Folder')]
+
+# Counters served by PerformanceManager.perfCounter, every group.name.rollup used by Vcenter.get_primary_metrics()
+PERF_COUNTERS = sorted(set(Vcenter.get_primary_metrics(vim.HostSystem('host')) +
+                           Vcenter.get_primary_metrics(vim.VirtualMachine('vm'))))
+PERF_INTERVAL = 20
+
+# Methods that are allowed without a logged in session
+ANONYMOUS_METHODS = ['RetrieveServiceContent', 'Login']
+
+
+class SimulatedFault(Exception):
+    def __init__(self, fault, msg):
+        super().__init__(msg)
+        self.fault = fault
+        self.fault.msg = msg
+
+
+def _tag(name):
+    return '{{{}}}{}'.format(VIM_NS, name)
+
+
+def _text(el, name, default=None):
+    child = el.find(_tag(name))
+    if child is None or child.text is None:
+        return default
+    return child.text
+
+
+def _bool(el, name, default=False):
+    value = _text(el, name)
+    if value is None:
+        return default
+    return value.strip().lower() == 'true'
+
+
+def _parse_selection_specs(el):
+    specs = []
+    for sel in el.findall(_tag('selectSet')):
+        specs.append({
+            'name': _text(sel, 'name'),
+            'type': _text(sel, 'type'),
+            'path': _text(sel, 'path'),
+            'skip': _bool(sel, 'skip'),
+            'selectSet': _parse_selection_specs(sel),
+        })
+    return specs
+
+
+def _parse_filter_spec(el):
+    return {
+        'propSet': [{
+            'type': _text(ps, 'type'),
+            'all': _bool(ps, 'all'),
+            'pathSet': [p.text for p in ps.findall(_tag('pathSet'))],
+        } for ps in el.findall(_tag('propSet'))],
+        'objectSet': [{
+            'obj': os_el.find(_tag('obj')).text,
+            'skip': _bool(os_el, 'skip'),
+            'selectSet': _parse_selection_specs(os_el),
+        } for os_el in el.findall(_tag('objectSet'))],
+    }
+
+
+def _is_session_check(filter_specs):
+    """
+    True when the filter specs only read SessionManager.currentSession, which a client does to find out
+    whether its session is still valid
+    """
+    return bool(filter_specs) and all(
+        spec['propSet'] and spec['objectSet']
+        and all(ps['type'] == 'SessionManager' and not ps['all'] and ps['pathSet'] == ['currentSession']
+                for ps in spec['propSet'])
+        and all(os_spec['obj'] == 'SessionManager' and not os_spec['selectSet'] for os_spec in spec['objectSet'])
+        for spec in filter_specs)
+
+
+def _is_type(mo_type, type_name):
+    """
+    True when the ManagedObject type mo_type is type_name or one of its subtypes
+    """
+    try:
+        return issubclass(GetWsdlType(VIM_NS, mo_type), GetWsdlType(VIM_NS, type_name))
+    except KeyError:
+        return mo_type == type_name
+
+
+@addClassLogger
+class SimulatedVcenter(object):
+    """
+    In-memory stand-in for a vCenter serving an Inventory through the subset of the vSphere API used by
+    Vcenter.connect(), Vcenter.get_container_view(), Vcenter.get_inventory() and IncrementalCollector:
+    RetrieveServiceContent, Login, Logout, CreateContainerView, DestroyView, RetrievePropertiesEx,
+    ContinueRetrievePropertiesEx, CreatePropertyCollector, DestroyPropertyCollector, CreateFilter and
+    WaitForUpdatesEx. Any username and password are accepted.
+    """
+
+    def __init__(self, inventory, fqdn=None, latency=0.0, jitter=0.0, error_rate=0.0, max_wait_seconds=5, seed=None):
+        self.inventory = inventory
+        self.fqdn = fqdn or inventory.vcenter_name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_wait_seconds = max_wait_seconds
+        self.random = random.Random(seed)
+        self.call_count = 0
+        self.fault_count = 0
+        self.instance_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, self.fqdn))
+        self.sessions = {}
+        self.views = {}
+        self.tokens = {}
+        self.property_collectors = {'propertyCollector': {'filters': [], 'version': None}}
+        self.__lock = threading.Lock()
+        self.__next_id = 0
+
+    def next_id(self, prefix):
+        with self.__lock:
+            self.__next_id += 1
+            return '{}-{}'.format(prefix, self.__next_id)
+
+    def get_mo_type(self, mo_id):
+        obj = self.inventory.get(mo_id)
+        if obj:
+            return obj['_type']
+        if mo_id in self.views:
+            return 'ContainerView'
+        if mo_id in self.property_collectors:
+            return 'PropertyCollector'
+        static = {'ServiceInstance': 'ServiceInstance',
+                  'SessionManager': 'SessionManager',
+                  'ViewManager': 'ViewManager',
+                  'VpxSettings': 'OptionManager',
+                  'PerfMgr': 'PerformanceManager',
+                  'group-d1': 'Folder'}
+        if mo_id in static:
+            return static[mo_id]
+        for prefix, mo_type in MOID_PREFIX_TYPES:
+            if mo_id.startswith(prefix):
+                return mo_type
+        return 'ManagedEntity'
+
+    def moref(self, mo_id):
+        return GetWsdlType(VIM_NS, self.get_mo_type(mo_id))(mo_id)
+
+    def get_service_content(self):
+        return vim.ServiceContent(
+            rootFolder=vim.Folder('group-d1'),
+            propertyCollector=vmodl.query.PropertyCollector('propertyCollector'),
+            viewManager=vim.view.ViewManager('ViewManager'),
+            sessionManager=vim.SessionManager('SessionManager'),
+            setting=vim.option.OptionManager('VpxSettings'),
+            perfManager=vim.PerformanceManager('PerfMgr'),
+            about=vim.AboutInfo(name='VMware vCenter Server',
+                                fullName='VMware vCenter Server 6.7.0 build-0 (simulated)',
+                                vendor='VMware, Inc.',
+                                version='6.7.0',
+                                build='0',
+                                osType='linux-x64',
+                                productLineId='vpx',
+                                apiType='VirtualCenter',
+                                apiVersion='6.7.1',
+                                instanceUuid=self.instance_uuid))
+
+    def get_session(self, cookie):
+        if not cookie:
+            return None
+        match = re.search(r'{}="?([^";]+)"?'.format(SESSION_COOKIE), cookie)
+        if not match:
+            return None
+        return self.sessions.get(match.group(1), None)
+
+    def get_property(self, mo_id, path, session):
+        """
+        Returns the value of a property path as pyVmomi data ready to be serialized
+        :return: [found, value]
+        """
+        if mo_id in self.views:
+            if path == 'view':
+                return [True, vim.ManagedEntity.Array([self.moref(v) for v in self.views[mo_id]])]
+            return [False, None]
+        if mo_id == 'VpxSettings' and path == 'setting':
+            return [True, vim.option.OptionValue.Array([vim.option.OptionValue(key='VirtualCenter.FQDN',
+                                                                                value=self.fqdn),
+                                                         vim.option.OptionValue(key='VirtualCenter.InstanceName',
+                                                                                value=self.fqdn)])]
+        if mo_id == 'SessionManager' and path == 'currentSession':
+            return [session is not None, session]
+        if mo_id == 'PerfMgr' and path == 'perfCounter':
+            return [True, self.get_perf_counters()]
+
+        obj = self.inventory.get(mo_id)
+        if obj is None or path not in obj or obj[path] is None:
+            return [False, None]
+        value = obj[path]
+        if path in REFERENCE_PROPERTIES:
+            if isinstance(value, list):
+                return [True, vim.ManagedEntity.Array([self.moref(v) for v in value])]
+            return [True, self.moref(value)]
+        return [True, value]
+
+    def get_object_content(self, mo_id, prop_specs, session):
+        mo_type = self.get_mo_type(mo_id)
+        prop_set = []
+        matched = False
+        for ps in prop_specs:
+            if not _is_type(mo_type, ps['type']):
+                continue
+            matched = True
+            paths = ps['pathSet']
+            if ps['all']:
+                obj = self.inventory.get(mo_id) or {}
+                paths = [k for k in obj.keys() if not k.startswith('_')]
+            for path in paths:
+                found, value = self.get_property(mo_id, path, session)
+                if found:
+                    prop_set.append(vmodl.DynamicProperty(name=path, val=value))
+        if not matched:
+            return None
+        return vmodl.query.PropertyCollector.ObjectContent(obj=self.moref(mo_id), propSet=prop_set)
+
+    def traverse(self, mo_id, select_specs, named_specs, found, depth=0):
+        """
+        Follows the TraversalSpecs from mo_id, adding every reached moId to found
+        """
+        if depth > 16:
+            return
+        for spec in select_specs:
+            if not spec.get('path'):
+                # SelectionSpec referencing a named TraversalSpec
+                spec = named_specs.get(spec['name'], None)
+                if not spec:
+                    continue
+            if not _is_type(self.get_mo_type(mo_id), spec['type']):
+                continue
+            if mo_id in self.views and spec['path'] == 'view':
+                targets = self.views[mo_id]
+            else:
+                obj = self.inventory.get(mo_id) or {}
+                targets = obj.get(spec['path']) or []
+                if not isinstance(targets, list):
+                    targets = [targets]
+            for target in targets:
+                if not spec['skip']:
+                    found.append(target)
+                self.traverse(target, spec['selectSet'], named_specs, found, depth + 1)
+
+    def get_filter_objects(self, filter_spec):
+        mo_ids = []
+        for obj_spec in filter_spec['objectSet']:
+            named_specs = {}
+            pending = list(obj_spec['selectSet'])
+            while pending:
+                spec = pending.pop()
+                if spec.get('path'):
+                    named_specs[spec['name']] = spec
+                    pending.extend(spec['selectSet'])
+            if not obj_spec['skip']:
+                mo_ids.append(obj_spec['obj'])
+            self.traverse(obj_spec['obj'], obj_spec['selectSet'], named_specs, mo_ids)
+        # remove duplicates keeping the traversal order
+        return list(dict.fromkeys(mo_ids))
+
+    def get_filter_contents(self, filter_specs, session):
+        contents = []
+        for filter_spec in filter_specs:
+            for mo_id in self.get_filter_objects(filter_spec):
+                content = self.get_object_content(mo_id, filter_spec['propSet'], session)
+                if content is not None:
+                    contents.append(content)
+        return contents
+
+    def page_results(self, contents, max_objects):
+        result = vmodl.query.PropertyCollector.RetrieveResult(objects=contents[:max_objects])
+        if len(contents) > max_objects:
+            token = str(uuid.uuid4())
+            with self.__lock:
+                self.tokens[token] = (contents[max_objects:], max_objects)
+            result.token = token
+        return result
+
+    def invoke(self, method, this, params, cookie):
+        """
+        Runs a simulated API method
+        :param method: wsdl method name
+        :param this: moId of the object the method is invoked on
+        :param params: the method request element
+        :param cookie: Cookie header of the request
+        :return: [result, set_cookie]
+        """
+        with self.__lock:
+            self.call_count += 1
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.__lock:
+                self.fault_count += 1
+            raise SimulatedFault(vmodl.fault.SystemError(reason='Simulated error'),
+                                 'Simulated error calling {}'.format(method))
+
+        session = self.get_session(cookie)
+        if method not in ANONYMOUS_METHODS and session is None:
+            if not (method == 'RetrievePropertiesEx' and this == 'propertyCollector'
+                    and _is_session_check([_parse_filter_spec(el) for el in params.findall(_tag('specSet'))])):
+                raise SimulatedFault(vim.fault.NotAuthenticated(object=vim.SessionManager('SessionManager'),
+                                                                privilegeId='System.View'),
+                                     'The session is not authenticated.')
+
+        if method == 'RetrieveServiceContent':
+            return [self.get_service_content(), None]
+
+        elif method == 'Login':
+            key = str(uuid.uuid4())
+            user_name = _text(params, 'userName', '')
+            user_session = vim.UserSession(key=key,
+                                           userName=user_name,
+                                           fullName=user_name,
+                                           loginTime=datetime.now(),
+                                           lastActiveTime=datetime.now(),
+                                           locale='en',
+                                           messageLocale='en',
+                                           extensionSession=False,
+                                           ipAddress='127.0.0.1',
+                                           userAgent='simulator',
+                                           callCount=0)
+            self.sessions[key] = user_session
+            return [user_session, '{}="{}"; Path=/; HttpOnly;'.format(SESSION_COOKIE, key)]
+
+        elif method == 'Logout':
+            self.sessions.pop(session.key, None)
+            return [None, None]
+
+        elif method == 'CreateContainerView':
+            types = [t.text for t in params.findall(_tag('type'))]
+            view_id = self.next_id('session[{}]view'.format(session.key[:8]))
+            self.views[view_id] = [k for k, obj in sorted(self.inventory.objects.items())
+                                   if not types or any(_is_type(obj['_type'], t) for t in types)]
+            return [vim.view.ContainerView(view_id), None]
+
+        elif method == 'DestroyView':
+            self.views.pop(this, None)
+            return [None, None]
+
+        elif method == 'RetrievePropertiesEx':
+            filter_specs = [_parse_filter_spec(el) for el in params.findall(_tag('specSet'))]
+            options = params.find(_tag('options'))
+            max_objects = int(_text(options, 'maxObjects', 0) or 0) if options is not None else 0
+            contents = self.get_filter_contents(filter_specs, session)
+            if not contents:
+                return [None, None]
+            return [self.page_results(contents, max_objects or 100), None]
+
+        elif method == 'ContinueRetrievePropertiesEx':
+            token = _text(params, 'token')
+            with self.__lock:
+                pending = self.tokens.pop(token, None)
+            if pending is None:
+                raise SimulatedFault(vmodl.fault.InvalidArgument(invalidProperty='token'), 'Invalid token')
+            return [self.page_results(pending[0], pending[1]), None]
+
+        elif method == 'CancelRetrievePropertiesEx':
+            with self.__lock:
+                self.tokens.pop(_text(params, 'token'), None)
+            return [None, None]
+
+        elif method == 'CreatePropertyCollector':
+            pc_id = self.next_id('session[{}]pc'.format(session.key[:8]))
+            self.property_collectors[pc_id] = {'filters': [], 'version': None}
+            return [vmodl.query.PropertyCollector(pc_id), None]
+
+        elif method == 'DestroyPropertyCollector':
+            self.property_collectors.pop(this, None)
+            return [None, None]
+
+        elif method == 'CreateFilter':
+            pc = self.property_collectors[this]
+            pc['filters'].append(_parse_filter_spec(params.find(_tag('spec'))))
+            return [vmodl.query.PropertyCollector.Filter(self.next_id('session[{}]filter'.format(session.key[:8]))),
+                    None]
+
+        elif method == 'WaitForUpdatesEx':
+            return [self.wait_for_updates(this, params, session), None]
+
+        elif method == 'QueryPerf':
+            return [self.query_perf(params.findall(_tag('querySpec'))), None]
+
+        raise SimulatedFault(vmodl.fault.NotImplemented(), 'Method {} is not simulated'.format(method))
+
+    def get_perf_counters(self):
+        counters = []
+        for key, name in enumerate(PERF_COUNTERS, start=1):
+            group, counter, rollup = name.split('.')
+            counters.append(vim.PerformanceManager.CounterInfo(
+                key=key,
+                nameInfo=vim.ElementDescription(key=counter, label=counter, summary=counter),
+                groupInfo=vim.ElementDescription(key=group, label=group, summary=group),
+                unitInfo=vim.ElementDescription(key='number', label='Num', summary='Number'),
+                rollupType=rollup,
+                statsType='rate'))
+        return vim.PerformanceManager.CounterInfo.Array(counters)
+
+    def query_perf(self, query_specs):
+        """
+        Returns random CSV samples for every counter of every QuerySpec
+        """
+        results = []
+        for spec in query_specs:
+            entity = spec.find(_tag('entity')).text
+            samples = int(_text(spec, 'maxSample', 1) or 1)
+            now = datetime.utcnow().replace(microsecond=0)
+            sample_info = ','.join('{},{}Z'.format(PERF_INTERVAL, now.isoformat()) for i in range(samples))
+            series = []
+            for metric_id in spec.findall(_tag('metricId')):
+                series.append(vim.PerformanceManager.MetricSeriesCSV(
+                    id=vim.PerformanceManager.MetricId(counterId=int(_text(metric_id, 'counterId')),
+                                                       instance=_text(metric_id, 'instance', '') or ''),
+                    value=','.join(str(self.random.randint(0, 10000)) for i in range(samples))))
+            results.append(vim.PerformanceManager.EntityMetricCSV(entity=self.moref(entity),
+                                                                  sampleInfoCSV=sample_info,
+                                                                  value=series))
+        return vim.PerformanceManager.EntityMetricBase.Array(results)
+
+    def wait_for_updates(self, this, params, session):
+        """
+        The first call with an empty version returns every object as 'enter', paged by maxObjectUpdates.
+        The simulated inventory does not change, so later calls wait for maxWaitSeconds and return nothing.
+        """
+        pc = self.property_collectors[this]
+        version = _text(params, 'version', '') or ''
+        options = params.find(_tag('options'))
+        max_wait = self.max_wait_seconds
+        max_updates = 0
+        if options is not None:
+            max_wait = min(int(_text(options, 'maxWaitSeconds', max_wait) or 0), self.max_wait_seconds)
+            max_updates = int(_text(options, 'maxObjectUpdates', 0) or 0)
+
+        if not version:
+            pending = []
+            for filter_spec in pc['filters']:
+                pending.extend(self.get_filter_contents([filter_spec], session))
+            pc['pending'] = pending
+            pc['version'] = 0
+        pending = pc.get('pending') or []
+        if not pending:
+            time.sleep(max_wait)
+            return None
+
+        page = pending[:max_updates] if max_updates else pending
+        pc['pending'] = pending[len(page):]
+        pc['version'] += 1
+        object_set = [vmodl.query.PropertyCollector.ObjectUpdate(
+            kind='enter',
+            obj=content.obj,
+            changeSet=[vmodl.query.PropertyCollector.Change(name=p.name, op='assign', val=p.val)
+                       for p in content.propSet])
+            for content in page]
+        return vmodl.query.PropertyCollector.UpdateSet(
+            version=str(pc['version']),
+            truncated=bool(pc['pending']),
+            filterSet=[vmodl.query.PropertyCollector.FilterUpdate(
+                filter=vmodl.query.PropertyCollector.Filter('filter'),
+                objectSet=object_set)])
+
+
+class SimulatorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s' % (self.address_string(), format % args))
+
+    def send_body(self, status, body, content_type='text/xml; charset=utf-8', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.endswith('/vimServiceVersions.xml'):
+            prior = [versionIdMap[v] for v in GetServiceVersions('vim25')
+                     if v != SIMULATED_API_VERSION and versionIdMap.get(v) and versionIdMap[v] != 'legacy'
+                     and IsChildVersion(SIMULATED_API_VERSION, v)]
+            body = ('<?xml version="1.0" encoding="UTF-8" ?><namespaces version="1.0"><namespace>'
+                    '<name>urn:vim25</name><version>{}</version><priorVersions>{}</priorVersions>'
+                    '</namespace></namespaces>').format(versionIdMap[SIMULATED_API_VERSION],
+                                                       ''.join('<version>{}</version>'.format(v) for v in prior))
+            self.send_body(200, body)
+        else:
+            self.send_body(404, 'Not Found', content_type='text/plain')
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        simulator = self.server.simulator
+        version = SIMULATED_API_VERSION
+        try:
+            body = ElementTree.fromstring(request).find('{{{}}}Body'.format(XMLNS_SOAPENV))
+            params = list(body)[0]
+            method = params.tag.split('}')[-1]
+            this = params.find(_tag('_this')).text
+            result, set_cookie = simulator.invoke(method, this, params, self.headers.get('Cookie'))
+
+            method_info = None
+            for info in GetWsdlType(VIM_NS, simulator.get_mo_type(this))._GetMethodList():
+                if info.wsdlName == method:
+                    method_info = info
+                    break
+            returnval = ''
+            if result is not None and method_info is not None:
+                returnval = SerializeToUnicode(result,
+                                               Object(name='returnval', type=method_info.result,
+                                                      version=version, flags=method_info.resultFlags),
+                                               version,
+                                               {VIM_NS: ''})
+            response = ('<?xml version="1.0" encoding="UTF-8"?>'
+                        '<soapenv:Envelope xmlns:soapenv="{}" xmlns:xsi="{}">'
+                        '<soapenv:Body><{}Response xmlns="{}">{}</{}Response></soapenv:Body>'
+                        '</soapenv:Envelope>').format(XMLNS_SOAPENV, XMLNS_XSI, method, VIM_NS, returnval, method)
+            headers = {'Set-Cookie': set_cookie} if set_cookie else None
+            self.send_body(200, response, headers=headers)
+        except SimulatedFault as sf:
+            self.send_fault(sf.fault, str(sf), version)
+        except BaseException as e:
+            logger.exception('Simulator request failed: {}'.format(e))
+            self.send_fault(vmodl.fault.SystemError(reason=str(e)), str(e), version)
+
+    def send_fault(self, fault, msg, version):
+        fault.msg = msg
+        detail = SerializeToUnicode(fault,
+                                    Object(name='{}Fault'.format(fault._wsdlName), type=object, version=version,
+                                           flags=0),
+                                    version,
+                                    {VIM_NS: ''})
+        response = ('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<soapenv:Envelope xmlns:soapenv="{}" xmlns:xsi="{}"><soapenv:Body><soapenv:Fault>'
+                    '<faultcode>ServerFaultCode</faultcode><faultstring>{}</faultstring><detail>{}</detail>'
+                    '</soapenv:Fault></soapenv:Body></soapenv:Envelope>').format(XMLNS_SOAPENV, XMLNS_XSI,
+                                                                                 msg, detail)
+        self.send_body(500, response)
+
+
+def generate_certificate(cert_dir, common_name='localhost'):
+    """
+    Creates a self-signed certificate with the openssl command line tool
+    :param cert_dir: directory the certificate and key are written to
+    :param common_name: certificate subject CN
+    :return: [certfile, keyfile]
+    """
+    certfile = os.path.join(cert_dir, 'simulator.crt')
+    keyfile = os.path.join(cert_dir, 'simulator.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30',
+                    '-subj', '/CN={}'.format(common_name), '-keyout', keyfile, '-out', certfile],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return [certfile, keyfile]
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, simulator, ssl_context, address='127.0.0.1', port=0):
+        super().__init__((address, port), SimulatorRequestHandler)
+        self.simulator = simulator
+        self.ssl_context = ssl_context
+
+    def get_request(self):
+        sock, addr = super().get_request()
+        # the handshake is done by the handler thread, so a slow client does not block accepting the others
+        return [self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False), addr]
+
+    def finish_request(self, request, client_address):
+        try:
+            request.do_handshake()
+        except (ssl.SSLError, OSError) as e:
+            logger.debug('TLS handshake with {} failed: {}'.format(client_address, e))
+            return
+        super().finish_request(request, client_address)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+@addClassLogger
+class VcenterSimulator(object):
+    """
+    Serves one SimulatedVcenter per Inventory, each on its own https port of address. Vcenter connects to a
+    simulated vCenter unchanged by using '<address>:<port>' as the vCenter name. Without certfile and keyfile
+    a self-signed certificate is generated with openssl.
+    """
+
+    def __init__(self, inventories, address='127.0.0.1', base_port=0, certfile=None, keyfile=None, **kwargs):
+        self.address = address
+        self.base_port = base_port
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.simulators = [SimulatedVcenter(inventory, **kwargs) for inventory in inventories]
+        self.servers = []
+        self.__cert_dir = None
+
+    def get_ssl_context(self):
+        certfile, keyfile = self.certfile, self.keyfile
+        if not certfile:
+            self.__cert_dir = tempfile.mkdtemp(prefix='vcsim')
+            certfile, keyfile = generate_certificate(self.__cert_dir, common_name=self.address)
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(certfile, keyfile)
+        return ssl_context
+
+    def start(self):
+        ssl_context = self.get_ssl_context()
+        for i, simulator in enumerate(self.simulators):
+            server = SimulatorServer(simulator, ssl_context, address=self.address,
+                                     port=self.base_port + i if self.base_port else 0)
+            threading.Thread(target=server.serve_forever, name='simulator-{}'.format(server.port), daemon=True).start()
+            self.servers.append(server)
+            self.__log.info('Simulated vCenter {} listening on {}:{}'.format(simulator.fqdn, self.address, server.port))
+        return self.get_vcenter_names()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        if self.__cert_dir:
+            shutil.rmtree(self.__cert_dir, ignore_errors=True)
+            self.__cert_dir = None
+
+    def get_vcenter_names(self):
+        return ['{}:{}'.format(self.address, server.port) for server in self.servers]
+
+    @property
+    def call_count(self):
+        return sum(simulator.call_count for simulator in self.simulators)
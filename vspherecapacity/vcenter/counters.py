@@ -0,0 +1,53 @@
+import os
+import logging
+import threading
+from vspherecapacity.recording import save_json, load_json, get_recording_path
+
+logger = logging.getLogger(__name__)
+
+
+def get_counter_name(counter):
+    """
+    :param counter: vim.PerformanceManager.CounterInfo
+    :return: counter name as used by Vcenter.get_primary_metrics(), e.g. cpu.ready.summation
+    """
+    return '{}.{}.{}'.format(counter.groupInfo.key, counter.nameInfo.key, counter.rollupType)
+
+
+def download_counter_catalog(content):
+    """
+    Reads PerformanceManager.perfCounter, which is a large payload
+    :param content: vim.ServiceInstanceContent
+    :return: dict of counter name to counter id
+    """
+    return {get_counter_name(c): c.key for c in content.perfManager.perfCounter}
+
+
+def load_counter_catalog(content, cache_dir):
+    """
+    Returns the counter catalog of a vCenter from cache_dir. The catalog is stored per vCenter instanceUuid and
+    only downloaded again when the cached build differs from the build vCenter is running.
+    :param content: vim.ServiceInstanceContent
+    :param cache_dir: directory of the cached catalogs
+    :return: dict of counter name to counter id
+    """
+    instance_uuid = content.about.instanceUuid
+    build = content.about.build
+    fpath = get_recording_path(cache_dir, 'counters-{}'.format(instance_uuid))
+    if os.path.isfile(fpath):
+        try:
+            catalog = load_json(fpath)
+            if catalog.get('build') == build:
+                return catalog['counters']
+            logger.info('vCenter {} build changed from {} to {}, refreshing counter catalog'.format(
+                instance_uuid, catalog.get('build'), build))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('Unable to read counter catalog {}: {}'.format(fpath, e))
+
+    counters = download_counter_catalog(content)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first so concurrent readers never see a partial catalog
+    tmp_path = '{}.{}-{}.tmp'.format(fpath, os.getpid(), threading.get_ident())
+    save_json({'instance_uuid': instance_uuid, 'build': build, 'counters': counters}, tmp_path)
+    os.replace(tmp_path, fpath)
+    return counters
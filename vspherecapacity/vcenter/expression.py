@@ -0,0 +1,228 @@
+import re
+import operator
+from functools import lru_cache
+
+COMPARISON_OPERATORS = ['==', '!=', '>=', '<=', '>', '<', '-like', '-notlike', '-contains', '-notcontains']
+
+# operators are matched longest first so '>=' is never read as '>'. Keywords only count when a space, paren,
+# quote or the end follows, so a bare value such as or-web01 stays a word
+_TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+        (?P<lparen>\()
+      | (?P<rparen>\))
+      | (?P<operator>==|!=|>=|<=|>|<|(?:-notlike|-like|-notcontains|-contains)(?=[\s()"']|$))
+      | (?P<logical>-?(?:and|or)(?=[\s()"']|$))
+      | "(?P<dquote>[^"]*)"
+      | '(?P<squote>[^']*)'
+      | (?P<word>[^\s()=!<>"']+)
+    )""", re.VERBOSE | re.IGNORECASE)
+
+_ORDERING = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def _parse_literal(text):
+    """
+    Converts a bare value to int, float or bool, anything else stays a string
+    """
+    if text.lower() in ['true', '$true']:
+        return True
+    if text.lower() in ['false', '$false']:
+        return False
+    for cast in [int, float]:
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _like_regex(pattern):
+    # '*' matches anything and, as before, the pattern may match anywhere in the value
+    return re.compile('.*'.join(re.escape(part) for part in pattern.split('*')))
+
+
+def _compare_value(val):
+    # ManagedObjects are compared by their moId
+    if hasattr(val, '_moId'):
+        return val._moId
+    return val
+
+
+class Comparison(object):
+
+    def __init__(self, prop, op, text, quoted):
+        self.prop = prop
+        self.operator = op
+        self.text = text
+        self.value = text if quoted else _parse_literal(text)
+        self.regex = _like_regex(text) if op in ['-like', '-notlike'] else None
+
+    def operand(self, val):
+        # property strings are always compared to the value as written, so name == 0319 still works
+        if isinstance(val, str):
+            return self.text
+        return self.value
+
+    def evaluate(self, props):
+        val = _compare_value(props.get(self.prop, None))
+        if self.regex:
+            matched = val is not None and bool(self.regex.search(str(val)))
+            return matched if self.operator == '-like' else not matched
+        if self.operator in ['-contains', '-notcontains']:
+            if val is None:
+                values = []
+            elif isinstance(val, (list, tuple)):
+                values = [_compare_value(v) for v in val]
+            else:
+                values = [val]
+            found = any(v == self.operand(v) for v in values)
+            return found if self.operator == '-contains' else not found
+        if val is None:
+            return self.operator == '!='
+        try:
+            return _ORDERING[self.operator](val, self.operand(val))
+        except TypeError:
+            return False
+
+    def properties(self):
+        return [self.prop]
+
+
+class BooleanExpression(object):
+
+    def __init__(self, op, clauses):
+        self.operator = op
+        self.clauses = clauses
+
+    def evaluate(self, props):
+        if self.operator == 'and':
+            return all(clause.evaluate(props) for clause in self.clauses)
+        return any(clause.evaluate(props) for clause in self.clauses)
+
+    def properties(self):
+        props = []
+        for clause in self.clauses:
+            props.extend(p for p in clause.properties() if p not in props)
+        return props
+
+
+class CompiledFilter(object):
+    """
+    A parsed filter expression. properties holds every property path the expression references,
+    which is all that needs to be retrieved from vCenter to evaluate it.
+    """
+
+    def __init__(self, expression, tree):
+        self.expression = expression
+        self.tree = tree
+        self.properties = tree.properties()
+
+    def evaluate(self, props):
+        """
+        :param props: dict of property path to value, missing properties are treated as unset
+        :return: True when the object matches the expression
+        """
+        return self.tree.evaluate(props)
+
+
+class _Parser(object):
+    """
+    expression := and_clause ('or' and_clause)*
+    and_clause := term ('and' term)*
+    term       := '(' expression ')' | property operator value
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = self.tokenize(expression)
+        self.pos = 0
+
+    @staticmethod
+    def tokenize(expression):
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            match = _TOKEN_REGEX.match(expression, pos)
+            if not match or match.end() == pos:
+                raise FilterSyntaxError('Unable to parse filter expression "{}" at position {}'.format(expression,
+                                                                                                   pos))
+            kind = match.lastgroup
+            value = text = match.group(kind)
+            if kind in ['dquote', 'squote']:
+                kind = 'quoted'
+            elif kind == 'logical':
+                value = value.lower().lstrip('-')
+            elif kind == 'operator':
+                value = value.lower()
+            tokens.append((kind, value, text))
+            pos = match.end()
+        return tokens
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][:2]
+        return (None, None)
+
+    def next(self, *kinds):
+        kind, value = self.peek()
+        if kind not in kinds:
+            raise FilterSyntaxError('Unexpected {} in filter expression "{}"'.format(
+                repr(value) if value else 'end', self.expression))
+        self.pos += 1
+        return [kind, value]
+
+    def parse(self):
+        tree = self.parse_boolean('or')
+        if self.pos != len(self.tokens):
+            self.next(None)
+        return tree
+
+    def parse_boolean(self, op):
+        parse_clause = self.parse_term if op == 'and' else lambda: self.parse_boolean('and')
+        clauses = [parse_clause()]
+        while self.peek() == ('logical', op):
+            self.pos += 1
+            clauses.append(parse_clause())
+        if len(clauses) == 1:
+            return clauses[0]
+        return BooleanExpression(op, clauses)
+
+    def parse_term(self):
+        if self.peek()[0] == 'lparen':
+            self.pos += 1
+            tree = self.parse_boolean('or')
+            self.next('rparen')
+            return tree
+        prop = self.next('word')[1]
+        op = self.next('operator')[1]
+        if self.peek()[0] == 'logical':
+            # a value is never a keyword, so name == or compares with the string 'or' as written
+            value = self.tokens[self.pos][2]
+            self.pos += 1
+            return Comparison(prop, op, value, quoted=False)
+        kind, value = self.next('word', 'quoted')
+        return Comparison(prop, op, value, quoted=kind == 'quoted')
+
+
+@lru_cache(maxsize=256)
+def compile_filter(expression):
+    """
+    Compiles a filter expression such as
+        runtime.powerState == poweredOn and (name -like 'web*' or config.hardware.numCPU >= 8)
+    Compiled filters are cached, so the same expression is only parsed once per process.
+    :param expression: filter expression
+    :return: CompiledFilter
+    """
+    return CompiledFilter(expression, _Parser(expression).parse())
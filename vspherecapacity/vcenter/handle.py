@@ -1,4 +1,3 @@
-import re
 import ssl
 import atexit
 import json
@@ -9,6 +8,9 @@ from urllib3.exceptions import InsecureRequestWarning
 from datetime import datetime, timedelta
 from log.setup import addClassLogger
 from vspherecapacity.credentials.credstore import Credential, AESCipher
+from vspherecapacity.vcenter.inventory import Inventory, INVENTORY_PROPERTIES
+from vspherecapacity.vcenter.expression import compile_filter
+from vspherecapacity.vcenter.counters import load_counter_catalog
 from pyVmomi import vim
 from pyVmomi import vmodl
 from pyVim import connect
@@ -80,20 +82,49 @@ class VcenterList:
 class Vcenter:
     """
     Vcenter class handles basic vcenter methods such as connect, disconnect, get_container_view, ect
+    When record_path is set every inventory retrieved by get_inventory() is also saved to that file.
+    When replay_path is set no connection to vCenter is made and get_inventory() returns the recorded inventory.
+    name may include a port as '<host>:<port>', which is used to connect to the local simulator in
+    vspherecapacity.simulator.
+    When counter_cache_dir is set the performance counter catalog is loaded from that directory at connect time,
+    see vspherecapacity.vcenter.counters.
+    When session_pool is set connect() reuses the pooled session of this vCenter and disconnect() leaves it
+    logged in, see vspherecapacity.vcenter.session.
     """
-    def __init__(self, name, username=None, password=None, ssl_context=None):
+    def __init__(self, name, username=None, password=None, ssl_context=None, record_path=None, replay_path=None,
+                 counter_cache_dir=None, session_pool=None):
         self.cipher = AESCipher()
-        self.credential = Credential(username=username, password=password)
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.counter_cache_dir = counter_cache_dir
+        self.session_pool = session_pool
+        self.perf_counters = None
+        self.credential = None
+        if not self.replay_path:
+            self.credential = Credential(username=username, password=password)
         password = None
         self.si = None
         self.content = None
         self.cookies = None
         self.vcenter = name
         self.name = name
-        self.username = self.credential.username
-        self.__password = self.store_password(self.credential.retrieve_password())
+        self.username = username
+        self.__password = None
+        if self.credential:
+            self.username = self.credential.username
+            self.__password = self.store_password(self.credential.retrieve_password())
         self.ssl_context = ssl_context
 
+    def get_host_and_port(self):
+        """
+        Splits the vCenter name into host and port, the port defaults to 443
+        :return: [host, port]
+        """
+        host, sep, port = self.vcenter.rpartition(':')
+        if sep and port.isdigit():
+            return [host, int(port)]
+        return [self.vcenter, 443]
+
     def store_password(self, password):
         if password:
             return self.cipher.encrypt(password)
@@ -104,49 +135,65 @@ class Vcenter:
             return self.cipher.decrypt(self.__password, self.cipher.AES_KEY)
         return None
 
-    def connect(self):
+    def login(self):
         """
         validate whether username/password were passed or whether a private key should be used
-        logger lines have been commented out until logging is fully implemented
+        and log in to vCenter with a new session
+        :return: vim.ServiceInstance
+        """
+        self.__log.debug('Getting Credential Information')
+        if not self.__password and not self.username:
+            self.__log.debug('No username or password provided. Will read from credstore')
+            cred = Credential('oppvfog01')
+            cred_dict = cred.get_credential()
+            self.username = cred_dict.get('username', None)
+            self.__password = self.store_password(cred_dict.get('password', None))
+            cred_dict = None
+        elif self.username and not self.__password:
+            logger.debug('No username or password provided. Will read from credstore')
+            cred = Credential(self.username)
+            cred_dict = cred.get_credential()
+            self.username = cred_dict.get('username', None)
+            self.__password = self.store_password(cred_dict.get('password', None))
+            cred_dict = None
+        self.__log.info('Conecting to vCenter {}'.format(self.vcenter))
+        self.__log.debug(
+            'Connection Params: vCenter: {}, Username: {}, {}, SSL_Context: {}'.format(self.vcenter,
+                                                                                       self.username,
+                                                                                       self.__password,
+                                                                                       self.ssl_context))
+        host, port = self.get_host_and_port()
+        return connect.SmartConnect(host=host,
+                                    port=port,
+                                    user=self.username,
+                                    pwd=self.retrieve_password(),
+                                    sslContext=self.ssl_context
+                                    )
+
+    def connect(self):
+        """
+        Connects to vCenter through the session pool or with a new login
         :return:
         """
 
+        if self.replay_path:
+            self.__log.info('Replaying vCenter {} from {}'.format(self.vcenter, self.replay_path))
+            return
+
         try:
             # if no ssl_context has been provided then set this to unverified context
             if not self.ssl_context:
                 self.ssl_context = ssl._create_unverified_context()
                 self.ssl_context.verify_mode = ssl.CERT_NONE
 
-                self.__log.debug('Getting Credential Information')
-
-            if not self.__password and not self.username:
-                self.__log.debug('No username or password provided. Will read from credstore')
-                cred = Credential('oppvfog01')
-                cred_dict = cred.get_credential()
-                self.username = cred_dict.get('username', None)
-                self.__password = self.store_password(cred_dict.get('password', None))
-                cred_dict = None
-            elif self.username and not self.__password:
-                logger.debug('No username or password provided. Will read from credstore')
-                cred = Credential(self.username)
-                cred_dict = cred.get_credential()
-                self.username = cred_dict.get('username', None)
-                self.__password = self.store_password(cred_dict.get('password', None))
-                cred_dict = None
-            self.__log.info('Conecting to vCenter {}'.format(self.vcenter))
-            self.__log.debug(
-                'Connection Params: vCenter: {}, Username: {}, {}, SSL_Context: {}'.format(self.vcenter,
-                                                                                           self.username,
-                                                                                           self.__password,
-                                                                                           self.ssl_context))
-            self.si = connect.SmartConnect(host=self.vcenter,
-                                           user=self.username,
-                                           pwd=self.retrieve_password(),
-                                           sslContext=self.ssl_context
-                                           )
-
-            atexit.register(connect.Disconnect, self.si)
+            if self.session_pool:
+                self.si = self.session_pool.connect(self)
+            else:
+                self.si = self.login()
+                atexit.register(connect.Disconnect, self.si)
             self.__log.debug('ServiceInstance: {}'.format(self.si))
+            if self.si._stub.cookie:
+                self.break_down_cookie(self.si._stub.cookie)
 
             self.content = self.si.RetrieveContent()
 
@@ -156,181 +203,155 @@ class Vcenter:
 
             self.name = (vc_name.strip('.nordstrom.net')).lower()
 
+            if self.counter_cache_dir:
+                self.perf_counters = load_counter_catalog(self.content, self.counter_cache_dir)
+
         except BaseException as e:
             self.__log.exception('Exception: {} \n Args: {}'.format(e, e.args))
 
     def disconnect(self):
-        connect.Disconnect(self.si)
+        # pooled sessions stay logged in for the next connect
+        if self.si and not self.session_pool:
+            connect.Disconnect(self.si)
+
+    def is_connected(self):
+        """
+        :return: True when connected to vCenter or replaying a recording
+        """
+        return bool(self.si or self.replay_path)
 
-    def get_container_view(self, view_type, search_root=None, filter_expression=None):
+    def get_container_view(self, view_type, search_root=None, filter_expression=None, page_size=1000):
         """
         Custom container_view function that allows the option for a filtered expression such as name == john_doe
         This is similar to the Where clause in powershell, however, this is case sensative.
-        This function does not handle multiple evaluations such as 'and/or'. This can only evaluate a single expression.
+        Clauses can be combined with 'and'/'or' and grouped with parentheses, property paths may be nested, e.g.
+            runtime.powerState == poweredOn and (name -like 'web*' or config.hardware.numCPU >= 8)
+        Operators: ==, !=, >, <, >=, <=, -like, -notlike, -contains, -notcontains
+        Only the properties referenced by the expression are retrieved, in one paged property collector call
+        that traverses the container view.
         :param view_type: MoRef type [vim.VirtualMachine] , [vim.HostSystem], [vim.ClusterComputeResource], ect
         :param search_root: ManagedObject to search from, by default this is rootFolder
         :param filter_expression: Only return results that match this expression
+        :param page_size: maximum number of objects vCenter returns per page when filtering
         :return: list of ManagedObjects
         """
-
-        def create_filter_spec(pc, obj_view, view_type, prop):
-            """
-            Creates a Property filter spec for each property in prop
-            :param pc:
-            :param obj_view:
-            :param view_type:
-            :param prop:
-            :return:
-            """
-
-            objSpecs = []
-
-            for obj in obj_view:
-                objSpec = vmodl.query.PropertyCollector.ObjectSpec(obj=obj)
-                objSpecs.append(objSpec)
-            filterSpec = vmodl.query.PropertyCollector.FilterSpec()
-            filterSpec.objectSet = objSpecs
-            propSet = vmodl.query.PropertyCollector.PropertySpec(all=False)
-            propSet.type = view_type[0]
-            propSet.pathSet = prop
-            filterSpec.propSet = [propSet]
-            return filterSpec
-
-        def filter_results(result, value, operator):
-            """
-            Evaluates the properties based on the operator and the value being searched for.
-            This does not accept  multiple evaluations (and, or) such as prop1 == value1 and prop2 == value2
-            :param result:
-            :param value:
-            :param operator:
-            :return:
-            """
-
-            objs = []
-
-            # value and operator are a list as a preparation for later being able to evaluate and, or statements as well
-            #  so for now we will just reference the 0 index since only a single expression can be given at this time
-            operator = operator[0]
-            value = value[0]
-            if operator == '==':
-                for o in result:
-                    if o.propSet[0].val == value:
-                        objs.append(o.obj)
-                return objs
-            elif operator == '!=':
-                for o in result:
-                    if o.propSet[0].val != value:
-                        objs.append(o.obj)
-                return objs
-            elif operator == '>':
-                for o in result:
-                    if o.propSet[0].val > value:
-                        objs.append(o.obj)
-                return objs
-            elif operator == '<':
-                for o in result:
-                    if o.propSet[0].val < value:
-                        objs.append(o.obj)
-                return objs
-            elif operator == '>=':
-                for o in result:
-                    if o.propSet[0].val >= value:
-                        objs.append(o.obj)
-                return objs
-            elif operator == '<=':
-                for o in result:
-                    if o.propSet[0].val <= value:
-                        objs.append(o.obj)
-                return objs
-            elif operator == '-like':
-                regex_build = ".*"
-                for v in value.split('*'):
-                    if v == '"' or v == "'":
-                        regex_build = regex_build + ".*"
-                    else:
-                        tmp = v.strip("'")
-                        tmp = tmp.strip('"')
-                        regex_build = regex_build + "(" + re.escape(tmp) + ").*"
-                regex = re.compile(regex_build)
-                for o in result:
-                    if regex.search(o.propSet[0].val):
-                        objs.append(o.obj)
-                return objs
-            elif operator == '-notlike':
-                regex_build = ".*"
-                for v in value.split('*'):
-                    if v == '"' or v == "'":
-                        regex_build = regex_build + ".*"
-                    else:
-                        tmp = v.strip("'")
-                        tmp = tmp.strip('"')
-                        regex_build = regex_build + "(" + re.escape(tmp) + ").*"
-                regex = re.compile(regex_build)
-                for o in result:
-                    if not regex.search(o.propSet[0].val):
-                        objs.append(o.obj)
-                return objs
-            else:
-                return None
-
-        def break_down_expression(expression):
-            """
-            Pass an expression to this function and retrieve 3 things,
-            1. the property to be evaluated
-            2. the value of the property to be evaluated
-            3. the operand of the the expression
-            :param expression:
-            :return:
-            """
-            class Expression:
-                def __init__(self, property, operator, value):
-                    self.prop = property
-                    self.operator = operator
-                    self.value = value
-
-
-            operators = ["==", "!=", ">", "<", ">=", "<=", "-like", "-notlike", "-contains", "-notcontains"]
-
-            for op in operators:
-                exp_split = None
-                exp_split = expression.split(op)
-                if type(exp_split) is list and len(exp_split) == 2:
-                    exp_obj = Expression(property=exp_split[0].strip(),
-                                         operator=op,
-                                         value=exp_split[1].strip()
-                                         )
-                    return [exp_obj]
-
         if not search_root:
             search_root = self.content.rootFolder
 
+        compiled_filter = compile_filter(filter_expression) if filter_expression else None
+
         view_reference = self.content.viewManager.CreateContainerView(container=search_root,
                                                                       type=view_type,
                                                                       recursive=True)
-        view = view_reference.view
-        view_reference.Destroy()
+        try:
+            if not compiled_filter:
+                return view_reference.view
+
+            filter_spec = self.get_inventory_filter_spec(view_reference,
+                                                         {t: compiled_filter.properties for t in view_type})
+            view_obj = []
+            for obj_content in self.retrieve_properties([filter_spec], page_size=page_size):
+                props = {prop.name: prop.val for prop in obj_content.propSet}
+                if compiled_filter.evaluate(props):
+                    view_obj.append(obj_content.obj)
+            return view_obj
+        finally:
+            view_reference.Destroy()
+
+    def retrieve_properties(self, filter_specs, page_size=None):
+        """
+        Runs RetrievePropertiesEx for the filter specs and pages through the remaining results
+        with ContinueRetrievePropertiesEx.
+        :param filter_specs: list of vmodl.query.PropertyCollector.FilterSpec
+        :param page_size: maximum number of objects vCenter returns per page, None lets vCenter decide
+        :return: list of vmodl.query.PropertyCollector.ObjectContent
+        """
+        property_collector = self.content.propertyCollector
+        property_collector_options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+        prop_results = property_collector.RetrievePropertiesEx(filter_specs, property_collector_options)
+        totalProps = []
+        # RetrievePropertiesEx returns None when nothing matched the filter
+        if not prop_results:
+            return totalProps
+        totalProps += prop_results.objects
+        # RetrievePropertiesEx will only retrieve a subset of properties.
+        # So need to use ContinueRetrievePropertiesEx
+        while prop_results.token:
+            prop_results = property_collector.ContinueRetrievePropertiesEx(token=prop_results.token)
+            totalProps += prop_results.objects
+        return totalProps
 
-        if filter_expression:
+    def create_inventory_view(self, properties=None):
+        """
+        Creates a container view over rootFolder holding every ManagedObject type in properties.
+        The caller is responsible for calling Destroy() on the view.
+        :param properties: dict of ManagedObject type name to property paths, defaults to INVENTORY_PROPERTIES
+        :return: vim.view.ContainerView
+        """
+        if not properties:
+            properties = INVENTORY_PROPERTIES
 
-            expression_obj = break_down_expression(filter_expression)
+        view_type = [getattr(vim, mo_type) for mo_type in properties.keys()]
+        return self.content.viewManager.CreateContainerView(container=self.content.rootFolder,
+                                                            type=view_type,
+                                                            recursive=True)
 
-            property_collector = self.content.propertyCollector
-            filter_spec = create_filter_spec(property_collector, view, view_type, [obj.prop for obj in expression_obj])
-            property_collector_options = vmodl.query.PropertyCollector.RetrieveOptions()
-            prop_results = property_collector.RetrievePropertiesEx([filter_spec], property_collector_options)
-            totalProps = []
-            totalProps += prop_results.objects
-            # RetrievePropertiesEx will only retrieve a subset of properties.
-            # So need to use ContinueRetrievePropertiesEx
-            while prop_results.token:
-                prop_results = property_collector.ContinueRetrievePropertiesEx(token=prop_results.token)
-                totalProps += prop_results.objects
-            view_obj = filter_results(totalProps, value=[obj.value for obj in expression_obj],
-                                      operator=[obj.operator for obj in expression_obj])
-        else:
-            view_obj = view
+    @staticmethod
+    def get_inventory_filter_spec(view_reference, properties=None):
+        """
+        Builds a FilterSpec that traverses the container view and retrieves only the explicit property list
+        :param view_reference: vim.view.ContainerView created by create_inventory_view()
+        :param properties: dict of ManagedObject type or type name to property paths, defaults to INVENTORY_PROPERTIES
+        :return: vmodl.query.PropertyCollector.FilterSpec
+        """
+        if not properties:
+            properties = INVENTORY_PROPERTIES
+
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseEntities',
+                                                                     path='view',
+                                                                     skip=False,
+                                                                     type=vim.view.ContainerView)
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view_reference,
+                                                            skip=True,
+                                                            selectSet=[traversal_spec])
+        prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=mo_type if isinstance(mo_type, type)
+                                                                 else getattr(vim, mo_type),
+                                                                 all=False,
+                                                                 pathSet=paths)
+                      for mo_type, paths in properties.items()]
+        return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec],
+                                                        propSet=prop_specs)
+
+    def get_inventory(self, page_size=1000, properties=None):
+        """
+        Takes a snapshot of every ClusterComputeResource, HostSystem, VirtualMachine, Datastore and StoragePod
+        in one paged RetrievePropertiesEx call. A container view over rootFolder is traversed with a
+        TraversalSpec and only the explicit property list is retrieved, so the capacity classes can be
+        built from the returned Inventory without any further calls to vCenter.
+        :param page_size: maximum number of objects vCenter returns per page
+        :param properties: dict of ManagedObject type name to property paths, defaults to INVENTORY_PROPERTIES
+        :return: Inventory
+        """
+        if self.replay_path:
+            inventory = Inventory.load(self.replay_path)
+            self.name = inventory.vcenter_name
+            self.__log.info('Inventory of {} replayed {} objects'.format(self.name, len(inventory)))
+            return inventory
 
-        return view_obj
+        view_reference = self.create_inventory_view(properties)
+        try:
+            filter_spec = self.get_inventory_filter_spec(view_reference, properties)
+            inventory = Inventory(vcenter_name=self.name)
+            for obj_content in self.retrieve_properties([filter_spec], page_size=page_size):
+                inventory.add_object_content(obj_content)
+        finally:
+            view_reference.Destroy()
+
+        self.__log.info('Inventory snapshot of {} retrieved {} objects'.format(self.name, len(inventory)))
+        if self.record_path:
+            inventory.save(self.record_path)
+            self.__log.info('Inventory of {} recorded to {}'.format(self.name, self.record_path))
+        return inventory
 
     def break_down_cookie(self, cookie):
         """ Breaks down vSphere SOAP cookie
@@ -0,0 +1,209 @@
+from pyVmomi.VmomiSupport import ManagedObject
+from log.setup import addClassLogger
+from vspherecapacity.recording import save_json, load_json
+
+# Properties retrieved for each ManagedObject type when taking an inventory snapshot.
+# These are every property the capacity classes read, nothing more, so that capacity
+# calculations can be done entirely from the snapshot without further calls to vCenter.
+INVENTORY_PROPERTIES = {
+    'ClusterComputeResource': ['name',
+                               'host',
+                               'datastore'],
+    'HostSystem': ['name',
+                   'parent',
+                   'vm',
+                   'hardware.cpuInfo.numCpuCores',
+                   'hardware.memorySize',
+                   'hardware.systemInfo.model',
+                   'hardware.systemInfo.vendor',
+                   'summary.quickStats.overallMemoryUsage',
+                   'summary.quickStats.uptime'],
+    'VirtualMachine': ['name',
+                       'runtime.powerState',
+                       'config.hardware.numCPU',
+                       'config.hardware.memoryMB',
+                       'config.template'],
+    'Datastore': ['name',
+                  'parent',
+                  'vm',
+                  'summary.capacity',
+                  'summary.freeSpace',
+                  'summary.uncommitted'],
+    'StoragePod': ['name',
+                   'summary.capacity',
+                   'childEntity'],
+}
+
+
+def to_plain_value(val):
+    """
+    Converts a pyVmomi property value into plain python data. ManagedObject references
+    are replaced with their moId so the snapshot holds no references back to vCenter.
+    :param val: property value returned by the PropertyCollector
+    :return: plain python value
+    """
+    if isinstance(val, ManagedObject):
+        return val._moId
+    elif isinstance(val, list):
+        return [to_plain_value(v) for v in val]
+    elif isinstance(val, bool):
+        return bool(val)
+    elif isinstance(val, int):
+        return int(val)
+    elif isinstance(val, float):
+        return float(val)
+    elif isinstance(val, str):
+        return str(val)
+    return val
+
+
+@addClassLogger
+class Inventory(object):
+    """
+    Plain-data snapshot of a vCenter inventory. Every ManagedObject is stored as a dict of
+    property path to value, keyed by its moId, e.g.
+        {'_moId': 'host-10', '_type': 'HostSystem', 'name': 'esx01', 'parent': 'domain-c7',
+         'vm': ['vm-12', 'vm-13'], 'hardware.cpuInfo.numCpuCores': 24, ...}
+    References to other ManagedObjects are stored as moIds and resolved through get() or get_objects().
+    """
+
+    def __init__(self, vcenter_name=None, objects=None):
+        self.vcenter_name = vcenter_name
+        self.objects = objects or {}
+
+    def __len__(self):
+        return len(self.objects)
+
+    def save(self, fpath):
+        """
+        Records the inventory to a gzip compressed json file
+        :param fpath: file path
+        :return: None
+        """
+        save_json({
+            'vcenter_name': self.vcenter_name,
+            'objects': list(self.objects.values()),
+        }, fpath)
+
+    @staticmethod
+    def load(fpath):
+        """
+        Replays an inventory recorded with save()
+        :param fpath: file path
+        :return: Inventory
+        """
+        data = load_json(fpath)
+        return Inventory(vcenter_name=data['vcenter_name'],
+                         objects={obj['_moId']: obj for obj in data['objects']})
+
+    def add_object_content(self, obj_content):
+        """
+        Adds a vmodl.query.PropertyCollector.ObjectContent returned from RetrievePropertiesEx to the inventory
+        :param obj_content: vmodl.query.PropertyCollector.ObjectContent
+        :return: the stored object dict
+        """
+        obj = {
+            '_moId': obj_content.obj._moId,
+            '_type': obj_content.obj._wsdlName,
+        }
+        for prop in obj_content.propSet or []:
+            obj[prop.name] = to_plain_value(prop.val)
+        self.objects[obj['_moId']] = obj
+        return obj
+
+    def get(self, mo_id):
+        """
+        Returns the object dict for the moId or None if the object is not part of the inventory
+        :param mo_id: ManagedObject moId
+        :return: dict
+        """
+        if mo_id is None:
+            return None
+        return self.objects.get(mo_id, None)
+
+    def get_objects(self, mo_ids):
+        """
+        Resolves a list of moIds into object dicts, skipping any moId not part of the inventory
+        :param mo_ids: list of moIds
+        :return: list of dict
+        """
+        objs = []
+        for mo_id in mo_ids or []:
+            obj = self.objects.get(mo_id, None)
+            if obj is not None:
+                objs.append(obj)
+        return objs
+
+    def get_by_type(self, mo_type):
+        """
+        Returns all object dicts of the given ManagedObject type, ordered by moId
+        :param mo_type: ManagedObject type name such as 'ClusterComputeResource'
+        :return: list of dict
+        """
+        return [self.objects[k] for k in sorted(self.objects.keys()) if self.objects[k]['_type'] == mo_type]
+
+    def apply_update_set(self, update_set):
+        """
+        Applies a vmodl.query.PropertyCollector.UpdateSet returned from WaitForUpdatesEx to the inventory.
+        The filter must be created with partialUpdates=False so every change carries the full property value.
+        :param update_set: vmodl.query.PropertyCollector.UpdateSet
+        :return: set of moIds that entered, changed or left the inventory
+        """
+        changed = set()
+        if not update_set:
+            return changed
+
+        for filter_update in update_set.filterSet or []:
+            for obj_update in filter_update.objectSet or []:
+                mo_id = obj_update.obj._moId
+                changed.add(mo_id)
+                if obj_update.kind == 'leave':
+                    self.objects.pop(mo_id, None)
+                    continue
+
+                obj = self.objects.get(mo_id, None)
+                if obj is None or obj_update.kind == 'enter':
+                    obj = {
+                        '_moId': mo_id,
+                        '_type': obj_update.obj._wsdlName,
+                    }
+                    self.objects[mo_id] = obj
+                for change in obj_update.changeSet or []:
+                    if change.op == 'assign':
+                        obj[change.name] = to_plain_value(change.val)
+                    elif change.op in ('remove', 'indirectRemove'):
+                        obj.pop(change.name, None)
+        return changed
+
+    def get_cluster_related_ids(self, cluster):
+        """
+        Returns the moIds of every object whose properties are read when calculating the cluster capacity:
+        the cluster itself, its hosts and their VMs, its datastores, their datastore clusters and the VMs on them.
+        :param cluster: ClusterComputeResource object dict
+        :return: set of moIds
+        """
+        related = {cluster['_moId']}
+        for host in self.get_objects(cluster.get('host')):
+            related.add(host['_moId'])
+            related.update(host.get('vm') or [])
+        for ds in self.get_objects(cluster.get('datastore')):
+            related.add(ds['_moId'])
+            related.update(ds.get('vm') or [])
+            ds_parent = self.get(ds.get('parent'))
+            if ds_parent and ds_parent['_type'] == 'StoragePod':
+                related.add(ds_parent['_moId'])
+                for pod_ds in self.get_objects(ds_parent.get('childEntity')):
+                    related.add(pod_ds['_moId'])
+                    related.update(pod_ds.get('vm') or [])
+        return related
+
+    def get_affected_clusters(self, mo_ids):
+        """
+        Returns every cluster whose capacity depends on at least one of the moIds
+        :param mo_ids: set of changed moIds, usually returned from apply_update_set()
+        :return: list of ClusterComputeResource object dicts
+        """
+        if not mo_ids:
+            return []
+        return [cl for cl in self.get_by_type('ClusterComputeResource')
+                if not self.get_cluster_related_ids(cl).isdisjoint(mo_ids)]
@@ -0,0 +1,153 @@
+import logging
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from pyVmomi import vim
+from log.setup import addClassLogger
+from vspherecapacity.vcenter.handle import Vcenter
+from vspherecapacity.vcenter.counters import download_counter_catalog
+
+logger = logging.getLogger(__name__)
+
+
+def parse_csv_values(csv_values):
+    """
+    Parses a comma separated sample string of a CSV QueryPerf result. Empty samples are returned as -1,
+    which is what vCenter reports for missing samples in the normal format.
+    :param csv_values: string such as '10,20,,30'
+    :return: array('d')
+    """
+    if not csv_values:
+        return array('d')
+    return array('d', [float(v) if v else -1.0 for v in csv_values.split(',')])
+
+
+def parse_entity_metric_csv(entity_metric, counter_names):
+    """
+    Converts a vim.PerformanceManager.EntityMetricCSV to plain data
+    :param entity_metric: vim.PerformanceManager.EntityMetricCSV
+    :param counter_names: dict of counter id to counter name
+    :return: dict of metric name, or 'name:instance' for instance values, to array('d') of samples
+    """
+    metrics = {}
+    for series in entity_metric.value or []:
+        name = counter_names.get(series.id.counterId, str(series.id.counterId))
+        if series.id.instance:
+            name = '{}:{}'.format(name, series.id.instance)
+        metrics[name] = parse_csv_values(series.value)
+    return metrics
+
+
+@addClassLogger
+class PerformanceCollector(object):
+    """
+    Collects the Vcenter.get_primary_metrics() counters of many entities with few QueryPerf calls.
+    The metric names are resolved to counter ids once, the Vcenter.get_QuerySpec() specs of up to batch_size
+    entities are sent in a single QueryPerf call and max_workers batches run at the same time. Results are
+    requested in CSV format and kept as array('d') per metric.
+    """
+
+    def __init__(self, vc, batch_size=250, max_workers=4, instance=''):
+        """
+        :param vc: connected Vcenter
+        :param batch_size: QuerySpecs per QueryPerf call
+        :param max_workers: QueryPerf calls running at the same time
+        :param instance: metric instance, '' for the aggregate of all instances or '*' for every instance
+        """
+        self.vc = vc
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.instance = instance
+        self.counter_ids = {}
+        self.counter_names = {}
+
+    def load_counters(self):
+        """
+        Maps every counter name to its id, using the catalog Vcenter loaded from its counter cache at connect time
+        and otherwise reading PerformanceManager.perfCounter
+        :return: None
+        """
+        if self.vc.perf_counters:
+            self.set_counters(self.vc.perf_counters)
+        else:
+            self.set_counters(download_counter_catalog(self.vc.content))
+
+    def set_counters(self, counter_ids):
+        """
+        :param counter_ids: dict of counter name to counter id
+        :return: None
+        """
+        self.counter_ids = dict(counter_ids)
+        self.counter_names = {v: k for k, v in self.counter_ids.items()}
+
+    def resolve_metric_ids(self, metric_names):
+        """
+        :param metric_names: list of counter names such as cpu.ready.summation
+        :return: list of vim.PerformanceManager.MetricId, names unknown to this vCenter are skipped
+        """
+        if not self.counter_ids:
+            self.load_counters()
+        metric_ids = []
+        for name in metric_names:
+            counter_id = self.counter_ids.get(name, None)
+            if counter_id is None:
+                self.__log.debug('{} counter {} not available'.format(self.vc.name, name))
+                continue
+            metric_ids.append(vim.PerformanceManager.MetricId(counterId=counter_id, instance=self.instance))
+        return metric_ids
+
+    def get_query_specs(self, entities):
+        """
+        Builds a Vcenter.get_QuerySpec() for every entity with the counter ids of its
+        Vcenter.get_primary_metrics(). The metric ids are resolved once per entity type.
+        :param entities: list of vim.HostSystem and vim.VirtualMachine
+        :return: list of vim.PerformanceManager.QuerySpec
+        """
+        metric_ids = {}
+        specs = []
+        for entity in entities:
+            entity_type = type(entity)
+            if entity_type not in metric_ids:
+                metric_ids[entity_type] = self.resolve_metric_ids(Vcenter.get_primary_metrics(entity) or [])
+            if not metric_ids[entity_type]:
+                continue
+            spec = Vcenter.get_QuerySpec(entity, metric_id=metric_ids[entity_type])
+            if spec:
+                specs.append(spec)
+        return specs
+
+    def query_batch(self, specs):
+        """
+        Runs one QueryPerf call
+        :param specs: list of vim.PerformanceManager.QuerySpec
+        :return: dict of entity moId to parse_entity_metric_csv() result
+        """
+        results = {}
+        for entity_metric in self.vc.content.perfManager.QueryPerf(querySpec=specs) or []:
+            results[entity_metric.entity._moId] = parse_entity_metric_csv(entity_metric, self.counter_names)
+        return results
+
+    def query(self, entities):
+        """
+        Collects the primary metrics of every entity
+        :param entities: list of vim.HostSystem and vim.VirtualMachine
+        :return: dict of entity moId to dict of metric name to array('d') of samples
+        """
+        specs = self.get_query_specs(entities)
+        batches = [specs[i:i + self.batch_size] for i in range(0, len(specs), self.batch_size)]
+        self.__log.info('{} querying {} entities in {} QueryPerf calls'.format(self.vc.name, len(specs), len(batches)))
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch_results in executor.map(self.query_batch, batches):
+                results.update(batch_results)
+        return results
+
+    def query_inventory(self, inventory, mo_type='HostSystem'):
+        """
+        Collects the primary metrics of every object of mo_type in an Inventory snapshot
+        :param inventory: Inventory retrieved from self.vc
+        :param mo_type: HostSystem or VirtualMachine
+        :return: dict of moId to dict of metric name to array('d') of samples
+        """
+        stub = self.vc.si._stub
+        entities = [getattr(vim, mo_type)(obj['_moId'], stub) for obj in inventory.get_by_type(mo_type)]
+        return self.query(entities)
@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import threading
+import logging
+from pyVmomi import vim, SoapStubAdapter
+from log.setup import addClassLogger
+
+logger = logging.getLogger(__name__)
+
+
+@addClassLogger
+class VcenterSessionPool(object):
+    """
+    Keeps one logged in session per vCenter and username and hands it to every Vcenter that connects through
+    the pool, across threads and, when session_dir is set, across runs. A cached vmware_soap_session cookie is
+    checked with a single SessionManager.currentSession call and a full SmartConnect login is only done when
+    that session has expired. Sessions are never logged out by Vcenter.disconnect(), call logout_all() to end them.
+    In daemon mode start_keepalive() touches every session periodically so vCenter does not expire idle sessions.
+    """
+
+    def __init__(self, session_dir=None, keepalive_seconds=600):
+        """
+        :param session_dir: directory the session cookies are stored in, None keeps them in memory only
+        :param keepalive_seconds: seconds between keepalive calls, must be below the vCenter session timeout
+        """
+        self.session_dir = session_dir
+        self.keepalive_seconds = keepalive_seconds
+        self.logins = 0
+        self.reuses = 0
+        self.__sessions = {}
+        self.__locks = {}
+        self.__lock = threading.Lock()
+        self.__keepalive_thread = None
+        self.__stop = threading.Event()
+
+    def get_lock(self, key):
+        with self.__lock:
+            return self.__locks.setdefault(key, threading.Lock())
+
+    def get_session_path(self, key):
+        name = re.sub(r'[^\w.-]', '_', '{}-{}'.format(*key))
+        return os.path.join(self.session_dir, '{}.session'.format(name))
+
+    def load_session(self, key):
+        """
+        :return: stored dict with cookie and version, None when nothing is stored
+        """
+        if not self.session_dir:
+            return None
+        fpath = self.get_session_path(key)
+        if not os.path.isfile(fpath):
+            return None
+        try:
+            with open(fpath, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.__log.warning('Unable to read session {}: {}'.format(fpath, e))
+            return None
+
+    def save_session(self, key, session):
+        if not self.session_dir:
+            return
+        os.makedirs(self.session_dir, mode=0o700, exist_ok=True)
+        fpath = self.get_session_path(key)
+        # the cookie grants access to vCenter, so only the owner may read it
+        fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'cookie': session['cookie'], 'version': session['version']}, f)
+
+    def remove_session(self, key):
+        self.__sessions.pop(key, None)
+        if self.session_dir and os.path.isfile(self.get_session_path(key)):
+            os.remove(self.get_session_path(key))
+
+    @staticmethod
+    def is_valid(si):
+        """
+        Cheap check whether the session of si is still logged in
+        """
+        try:
+            return si.RetrieveContent().sessionManager.currentSession is not None
+        except vim.fault.NotAuthenticated:
+            return False
+
+    def resume(self, vc, session):
+        """
+        Builds a ServiceInstance for a stored cookie without logging in
+        :return: vim.ServiceInstance, None when the session has expired
+        """
+        host, port = vc.get_host_and_port()
+        stub = SoapStubAdapter(host=host, port=port, version=session['version'], sslContext=vc.ssl_context)
+        stub.cookie = session['cookie']
+        si = vim.ServiceInstance('ServiceInstance', stub)
+        try:
+            if self.is_valid(si):
+                return si
+        except BaseException as e:
+            self.__log.debug('Stored session of {} not usable: {}'.format(vc.vcenter, e))
+        return None
+
+    def connect(self, vc):
+        """
+        Returns a logged in ServiceInstance for vc, reusing the session of an earlier connect when it is still valid
+        :param vc: Vcenter
+        :return: vim.ServiceInstance
+        """
+        key = (vc.vcenter, vc.username or '')
+        with self.get_lock(key):
+            session = self.__sessions.get(key, None)
+            if session:
+                try:
+                    if self.is_valid(session['si']):
+                        self.reuses += 1
+                        return session['si']
+                except BaseException as e:
+                    self.__log.debug('Session of {} not usable: {}'.format(vc.vcenter, e))
+            else:
+                session = self.load_session(key)
+                si = self.resume(vc, session) if session else None
+                if si:
+                    self.__log.debug('Reusing session of {}'.format(vc.vcenter))
+                    self.__sessions[key] = {'si': si, 'cookie': session['cookie'], 'version': session['version'],
+                                            'login': vc.login}
+                    self.reuses += 1
+                    return si
+
+            self.__log.info('Logging in to vCenter {}'.format(vc.vcenter))
+            si = vc.login()
+            self.logins += 1
+            session = {'si': si, 'cookie': si._stub.cookie, 'version': si._stub.version, 'login': vc.login}
+            self.__sessions[key] = session
+            self.save_session(key, session)
+            return si
+
+    def keepalive(self):
+        """
+        Touches every session once, logging in again with the credentials of the Vcenter that created a session
+        which expired anyway
+        :return: None
+        """
+        for key in list(self.__sessions.keys()):
+            with self.get_lock(key):
+                session = self.__sessions.get(key, None)
+                if not session:
+                    continue
+                try:
+                    if self.is_valid(session['si']):
+                        continue
+                    self.__log.info('Session of vCenter {} expired, logging in again'.format(key[0]))
+                    si = session['login']()
+                    self.logins += 1
+                    session.update({'si': si, 'cookie': si._stub.cookie, 'version': si._stub.version})
+                    self.save_session(key, session)
+                except BaseException as e:
+                    self.__log.exception('Keepalive of vCenter {} failed: {}'.format(key[0], e))
+
+    def start_keepalive(self):
+        if self.__keepalive_thread:
+            return
+        self.__stop.clear()
+
+        def run():
+            while not self.__stop.wait(self.keepalive_seconds):
+                self.keepalive()
+
+        self.__keepalive_thread = threading.Thread(target=run, name='vcenter-keepalive', daemon=True)
+        self.__keepalive_thread.start()
+
+    def stop_keepalive(self):
+        self.__stop.set()
+        self.__keepalive_thread = None
+
+    def logout_all(self):
+        """
+        Logs out every session of the pool and removes the stored cookies
+        :return: None
+        """
+        self.stop_keepalive()
+        for key in list(self.__sessions.keys()):
+            session = self.__sessions[key]
+            try:
+                session['si'].RetrieveContent().sessionManager.Logout()
+            except BaseException as e:
+                self.__log.debug('Logout of vCenter {} failed: {}'.format(key[0], e))
+            self.remove_session(key)